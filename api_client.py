@@ -5,65 +5,435 @@ Handles all API interactions with the ARMS database
 
 import requests
 import os
-from dotenv import load_dotenv
+import asyncio
+import contextvars
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http_session import SessionManager, RetryPolicy
+from cache import cache_from_env, make_cache_key
+from singleflight import SingleFlight
+from mirror import mirror_from_env
+from query_planner import planner_from_env
+from rate_governor import governor_from_env
+from circuit_breaker import breaker_from_env, mark_stale
+from metrics import UpstreamCall, count_cache_lookup, count_upstream_error
+from structured_log import log_upstream
+from cassette import cassette_from_env
+from startup import load_env
+
+
+ARMS_BASE_URL = 'https://api.ers.usda.gov/data/arms'
+
+UNAVAILABLE_ERROR = 'The USDA ARMS API is currently unavailable. Please try again in a few minutes.'
+
+# Survey years the ARMS API serves
+MIN_SURVEY_YEAR = 1996
+MAX_SURVEY_YEAR = 2023
+
+# Upstream calls the ASGI prefetch made for the current request, by cache key
+_prefetched = contextvars.ContextVar('arms_prefetched', default=None)
+
+
+def remember_prefetches():
+    """
+    Start collecting the ASGI prefetch's upstream calls for the current request
+
+    The Flask route that runs next answers a call found here with its
+    result (waiting for it if still in flight) instead of calling ARMS a
+    second time. Returns the dict (cache key -> Future) that is filled in.
+    """
+    holder = {}
+    _prefetched.set(holder)
+    return holder
+
+
+def collecting_prefetches():
+    return _prefetched.get() is not None
+
+
+def note_prefetch(cache_key, future):
+    """
+    Record a prefetch call for the current request, if collecting
+
+    future is a concurrent.futures.Future resolving to the response, or
+    to None when the route should make the call itself.
+    """
+    holder = _prefetched.get()
+    if holder is not None:
+        holder[cache_key] = future
+
+
+def merge_survey_responses(responses):
+    """
+    Stitch per-year surveydata responses back into one response
+    
+    Rows are concatenated in shard order; any other top-level fields are
+    taken from the first shard. The first error wins.
+    """
+    for response in responses:
+        if 'error' in response:
+            return response
+    
+    merged = {k: v for k, v in responses[0].items() if k != 'data'}
+    merged['data'] = [row for response in responses for row in response.get('data', [])]
+    return merged
+
+
+def build_survey_params(years, state='all', report=None, variable=None,
+                        farmtype=None, category=None, category_value=None, category2=None):
+    """
+    Build the surveydata request body shared by the sync and async clients
+    
+    Returns (params, None) on success or (None, error message).
+    """
+    # Ensure years is a list
+    if not isinstance(years, list):
+        years = [years]
+    
+    # Validate years
+    valid_years = [y for y in years if MIN_SURVEY_YEAR <= y <= MAX_SURVEY_YEAR]
+    if not valid_years:
+        return None, 'Please select years between 1996 and 2023'
+    
+    # Ensure state is a list
+    if not isinstance(state, list):
+        state = [state]
+
+    params = {
+        'year': valid_years,
+        'state': state
+    }
+
+    # Add optional parameters only if they have values
+    if report:
+        if not isinstance(report, list):
+            report = [report]
+        params['report'] = report
+    if variable:
+        if not isinstance(variable, list):
+            variable = [variable]
+        params['variable'] = variable
+    if farmtype:
+        if not isinstance(farmtype, list):
+            farmtype = [farmtype]
+        params['farmtype'] = farmtype
+    if category:
+        if not isinstance(category, list):
+            category = [category]
+        params['category'] = category
+    if category_value:
+        params['category_value'] = category_value
+    if category2:
+        params['category2'] = category2
+    
+    # Validate required fields
+    if not report and not variable:
+        return None, 'Either report or variable parameter is required'
+    
+    return params, None
 
-# Load environment variables
-load_dotenv()
 
 class USDAClient:
     """Client for interacting with USDA ERS ARMS API"""
     
-    def __init__(self):
+    def __init__(self, session_manager=None, retry_policy=None,
+                 connect_timeout=None, read_timeout=None, cache=None,
+                 single_flight=None, mirror=None, planner=None, governor=None,
+                 breaker=None, transport=None):
+        # .env is read on first use rather than at import
+        load_env()
         self.api_key = os.getenv('USDA_API_KEY')
-        self.base_url = 'https://api.ers.usda.gov/data/arms'
+        self.base_url = os.getenv('USDA_BASE_URL', ARMS_BASE_URL)
+        
+        # Record/replay cassette under the HTTP sessions (ARMS_TRANSPORT);
+        # pass transport=False to always use the live API
+        self.transport = transport if transport is not None else cassette_from_env()
+        replaying = bool(self.transport) and self.transport.replaying
         
         if not self.api_key:
-            raise ValueError("USDA_API_KEY not found in environment variables")
+            if not replaying:
+                raise ValueError("USDA_API_KEY not found in environment variables")
+            # Replay never sends the key anywhere
+            self.api_key = 'replay'
+        
+        # Pooled keep-alive sessions (rebuilt per process after fork)
+        self.sessions = session_manager or SessionManager(transport=self.transport or None)
+        self.retry_policy = retry_policy or RetryPolicy()
+        
+        # Separate connect/read timeouts: fail fast on unreachable hosts,
+        # but give large surveydata queries time to come back
+        self.connect_timeout = connect_timeout or float(os.getenv('USDA_CONNECT_TIMEOUT', '3.05'))
+        self.read_timeout = read_timeout or float(os.getenv('USDA_READ_TIMEOUT', '15'))
+        
+        # Persistent response cache shared across restarts (None disables)
+        self.cache = cache if cache is not None else cache_from_env()
+        
+        # Identical concurrent requests share one upstream call
+        self.single_flight = single_flight or SingleFlight()
+        
+        # Local Parquet mirror answering every request (ARMS_MODE=mirror);
+        # pass mirror=False to always use the live API
+        self.mirror = mirror if mirror is not None else mirror_from_env()
+        self.mirror_fallback = os.getenv('ARMS_MIRROR_FALLBACK', '0').lower() in ('1', 'true', 'yes')
+        
+        # Answers surveydata queries from cached results that contain them;
+        # pass planner=False to send every query as-is
+        self.planner = planner if planner is not None else planner_from_env(self)
+        
+        # Token bucket shared by all workers, serving interactive calls before
+        # batch and background ones; pass governor=False for no rate limit.
+        # Replayed calls cost ARMS nothing, so they aren't limited by default
+        if governor is None:
+            governor = None if replaying else governor_from_env()
+        self.governor = governor
+        
+        # Fails fast after repeated timeouts/5xx and serves stale cache entries
+        # until a background probe sees ARMS recover; pass breaker=False to disable
+        self.breaker = breaker if breaker is not None else breaker_from_env(self._probe)
+        
+        # Bounded pool for fetching year shards concurrently (created per process)
+        self.shard_workers = int(os.getenv('ARMS_SHARD_WORKERS', '6'))
+        self._shard_pool = None
+        self._shard_pool_pid = None
+        self._shard_pool_lock = threading.Lock()
+    
+    def _get_shard_pool(self):
+        """Thread pool for year shards; executors don't survive fork, so rebuild per pid"""
+        pid = os.getpid()
+        if self._shard_pool is None or self._shard_pool_pid != pid:
+            with self._shard_pool_lock:
+                if self._shard_pool is None or self._shard_pool_pid != pid:
+                    self._shard_pool = ThreadPoolExecutor(max_workers=self.shard_workers,
+                                                          thread_name_prefix='arms-shard')
+                    self._shard_pool_pid = pid
+        return self._shard_pool
+    
+    def _submit(self, fn, *args, **kwargs):
+        """Run fn on the shard pool in a copy of the caller's context (keeps its priority class)"""
+        return self._get_shard_pool().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    
+    def async_client(self, client_class=None, **kwargs):
+        """
+        AsyncUSDAClient sharing this client's key, endpoint, cache, retry
+        policy, rate governor and circuit breaker
+        
+        Keyword arguments override or add AsyncUSDAClient options;
+        client_class may name an AsyncUSDAClient subclass to build.
+        """
+        from async_client import AsyncUSDAClient
+        options = dict(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            cache=self.cache,
+            retry_policy=self.retry_policy,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            governor=self.governor,
+            breaker=self.breaker or None,
+            transport=self.transport or None
+        )
+        options.update(kwargs)
+        return (client_class or AsyncUSDAClient)(**options)
+    
+    def run_concurrently(self, calls):
+        """
+        Delegate several calls to the async client and run them concurrently
+        
+        Args:
+            calls: List of (method name, kwargs) tuples, e.g.
+                [('get_income_statement', {'years': [2020]})]
+        
+        Returns the results in the same order. Must not be called from a
+        running event loop (use AsyncUSDAClient directly there).
+        """
+        async def run():
+            async with self.async_client() as client:
+                return await client.gather(calls)
+        return asyncio.run(run())
+    
+    def get_all_reports(self, years, state='all', farmtype=None, category=None):
+        """Fetch all six report types concurrently, keyed by report method name"""
+        kwargs = {'years': years, 'state': state, 'farmtype': farmtype, 'category': category}
+        names = ['get_income_statement', 'get_balance_sheet', 'get_financial_ratios',
+                 'get_structural_characteristics', 'get_government_payments',
+                 'get_operator_household_income']
+        results = self.run_concurrently([(name, kwargs) for name in names])
+        return dict(zip(names, results))
+    
+    def compare_all(self, year, report='Farm Business Income Statement'):
+        """Fetch the typology, economic class and region comparisons concurrently"""
+        kwargs = {'year': year, 'report': report}
+        names = ['compare_by_farm_typology', 'compare_by_economic_class', 'compare_by_region']
+        results = self.run_concurrently([(name, kwargs) for name in names])
+        return dict(zip(names, results))
+    
+    @property
+    def timeout(self):
+        """(connect, read) timeout tuple passed to requests"""
+        return (self.connect_timeout, self.read_timeout)
     
     def _make_request(self, endpoint, params=None, method='GET'):
-        """Make HTTP request to USDA API"""
+        """
+        Make HTTP request to USDA API
+        
+        In mirror mode the local mirror answers. Otherwise the response cache
+        answers when possible, and concurrent callers with the same normalized
+        parameters share one upstream call.
+        """
+        if self.mirror:
+            result = self.mirror.answer(endpoint, params, method)
+            if result is not None:
+                return result
+            if not self.mirror_fallback:
+                return {'error': 'This query is not available in the local ARMS mirror'}
+        
+        cache_key = make_cache_key(endpoint, params, method)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        return self._fetch_and_cache(endpoint, params, method, cache_key)
+    
+    def fetch_fresh(self, endpoint, params=None, method='GET'):
+        """
+        Fetch from ARMS even when a fresh cached copy exists, replacing it on success
+        
+        For background refreshes; failures return the error, never a cached copy.
+        """
+        if self.mirror:
+            return self._make_request(endpoint, params, method)
+        cache_key = make_cache_key(endpoint, params, method)
+        return self._fetch_and_cache(endpoint, params, method, cache_key,
+                                     serve_stale=False, use_cached=False)
+    
+    def _fetch_and_cache(self, endpoint, params, method, cache_key, serve_stale=True,
+                         use_cached=True):
+        """
+        Fetch upstream through single-flight and cache a successful result
+        
+        If the fetch fails, or the circuit is open, an expired cache entry
+        is returned instead when there is one (unless serve_stale is False).
+        With use_cached False, an entry another worker cached meanwhile
+        doesn't stand in for the upstream call.
+        """
+        prefetched = _prefetched.get()
+        future = prefetched.get(cache_key) if prefetched else None
+        # A prefetch that failed, or is still running past a batch deadline,
+        # is waited for rather than repeated
+        result = future.result() if future is not None else None
+        if result is None:
+            if self.breaker and not self.breaker.allow():
+                count_upstream_error(endpoint, 'unavailable')
+                result = {'error': UNAVAILABLE_ERROR}
+            else:
+                result = self._coalesced_fetch(endpoint, params, method, cache_key, use_cached)
+        if 'error' in result and serve_stale:
+            return self._stale(endpoint, params, method, cache_key, result)
+        return result
+    
+    def _coalesced_fetch(self, endpoint, params, method, cache_key, use_cached=True):
+        def fetch():
+            if self.governor and not self.governor.acquire():
+                count_upstream_error(endpoint, 'rate_limited')
+                return {'error': 'ARMS request budget exhausted. Please try again shortly.'}
+            result = self._fetch(endpoint, params, method)
+            if self.cache is not None and 'error' not in result:
+                self.cache.set(cache_key, endpoint, result)
+            return result
+        
+        recheck = None
+        if self.cache is not None and use_cached:
+            recheck = lambda: self.cache.get(cache_key)
+        return self.single_flight.do(cache_key, fetch, recheck=recheck)
+    
+    def _stale(self, endpoint, params, method, cache_key, error):
+        """Expired cached response for a failed fetch (refreshed once ARMS is back), else error"""
+        entry = self.cache.get_stale(cache_key) if self.cache is not None else None
+        if entry is None:
+            return error
+        result, age = entry
+        if age > 0:
+            mark_stale(age)
+            count_cache_lookup('stale')
+            if self.breaker:
+                self.breaker.refresh_later(cache_key, lambda: self._fetch_and_cache(
+                    endpoint, dict(params or {}), method, cache_key, serve_stale=False))
+        return result
+    
+    def _probe(self):
+        """Breaker health check: the year listing, straight from ARMS"""
+        if self.governor and not self.governor.acquire():
+            return False
+        return 'error' not in self._fetch('year', method='GET')
+    
+    def _fetch(self, endpoint, params=None, method='GET'):
+        """Send a request to the USDA API"""
         url = f"{self.base_url}/{endpoint}"
         
         if params is None:
             params = {}
+        on_throttle = self.governor.throttle if self.governor else None
+        # Every retry draws its own token, like the first attempt
+        acquire = self.governor.acquire if self.governor else None
+        started = time.perf_counter()
+        response = None
         
-        try:
-            if method == 'GET':
-                # For GET, add api_key to URL params
-                params['api_key'] = self.api_key
-                response = requests.get(url, params=params, timeout=15)
-            elif method == 'POST':
-                # For POST, add api_key to URL and data in body
-                url_with_key = f"{url}?api_key={self.api_key}"
-                
-                # CRITICAL: Remove None values from params
-                clean_params = {k: v for k, v in params.items() if v is not None}
-                
-                # Debug logging (optional - remove in production)
-                print(f"DEBUG: POST to {endpoint}")
-                print(f"DEBUG: Body = {clean_params}")
+        with UpstreamCall(endpoint, method) as call:
+            try:
+                if method == 'GET':
+                    # For GET, add api_key to URL params
+                    params['api_key'] = self.api_key
+                    response = self.sessions.request('GET', url, retry_policy=self.retry_policy,
+                                                     on_throttle=on_throttle, acquire=acquire,
+                                                     params=params, timeout=self.timeout)
+                elif method == 'POST':
+                    # For POST, add api_key to URL and data in body
+                    url_with_key = f"{url}?api_key={self.api_key}"
+                    
+                    # CRITICAL: Remove None values from params
+                    clean_params = {k: v for k, v in params.items() if v is not None}
+                    
+                    response = self.sessions.request('POST', url_with_key, retry_policy=self.retry_policy,
+                                                     on_throttle=on_throttle, acquire=acquire,
+                                                     json=clean_params, timeout=self.timeout)
                 
-                response = requests.post(url_with_key, json=clean_params, timeout=15)
+                response.raise_for_status()
+                result = response.json()
+                if self.breaker:
+                    self.breaker.record_success()
+                return result
             
-            response.raise_for_status()
-            return response.json()
-        
-        except requests.exceptions.HTTPError as e:
-            # Get more detailed error info
-            error_msg = f"API request failed: {str(e)}"
-            try:
-                error_detail = response.json()
-                error_msg += f" - Details: {error_detail}"
-            except:
-                error_msg += f" - Response: {response.text[:300]}"
-            return {'error': error_msg}
-        except requests.exceptions.Timeout:
-            return {'error': 'Request timed out. Please try again.'}
-        except requests.exceptions.RequestException as e:
-            return {'error': f'API request failed: {str(e)}'}
-        except json.JSONDecodeError:
-            return {'error': 'Invalid response from API'}
+            except requests.exceptions.HTTPError as e:
+                call.fail('http')
+                if self.breaker and response.status_code >= 500:
+                    self.breaker.record_failure()
+                # Get more detailed error info
+                error_msg = f"API request failed: {str(e)}"
+                try:
+                    error_detail = response.json()
+                    error_msg += f" - Details: {error_detail}"
+                except:
+                    error_msg += f" - Response: {response.text[:300]}"
+                return {'error': error_msg}
+            except requests.exceptions.Timeout:
+                call.fail('timeout')
+                if self.breaker:
+                    self.breaker.record_failure()
+                return {'error': 'Request timed out. Please try again.'}
+            except json.JSONDecodeError:
+                # Checked before RequestException, which requests' decode error also subclasses
+                call.fail('decode')
+                return {'error': 'Invalid response from API'}
+            except requests.exceptions.RequestException as e:
+                call.fail('connection')
+                if self.breaker:
+                    self.breaker.record_failure()
+                return {'error': f'API request failed: {str(e)}'}
+            finally:
+                log_upstream(endpoint, method, started, error=call.error, params=params,
+                             status=response.status_code if response is not None else None)
     
     def get_states(self):
         """Get all available states"""
@@ -143,50 +513,15 @@ class USDAClient:
         
         Note: Either 'report' OR 'variable' is required
         """
-        # Ensure years is a list
-        if not isinstance(years, list):
-            years = [years]
-        
-        # Validate years
-        valid_years = [y for y in years if 1996 <= y <= 2023]
-        if not valid_years:
-            return {'error': 'Please select years between 1996 and 2023'}
-        
-        # Ensure state is a list
-        if not isinstance(state, list):
-            state = [state]
-
-        params = {
-            'year': valid_years,
-            'state': state
-        }
-
-        # Add optional parameters only if they have values
-        if report:
-            if not isinstance(report, list):
-                report = [report]
-            params['report'] = report
-        if variable:
-            if not isinstance(variable, list):
-                variable = [variable]
-            params['variable'] = variable
-        if farmtype:
-            if not isinstance(farmtype, list):
-                farmtype = [farmtype]
-            params['farmtype'] = farmtype
-        if category:
-            if not isinstance(category, list):
-                category = [category]
-            params['category'] = category
-        if category_value:
-            params['category_value'] = category_value
-        if category2:
-            params['category2'] = category2
-        
-        # Validate required fields
-        if not report and not variable:
-            return {'error': 'Either report or variable parameter is required'}
+        params, error = build_survey_params(
+            years, state=state, report=report, variable=variable, farmtype=farmtype,
+            category=category, category_value=category_value, category2=category2
+        )
+        if error:
+            return {'error': error}
         
+        if self.planner and not self.mirror:
+            return self.planner.execute(params)
         return self._make_request('surveydata', params, method='POST')
     
     def get_income_statement(self, years, state='all', farmtype=None, 
@@ -288,22 +623,47 @@ class USDAClient:
             category='nass region'
         )
     
-    def get_trend_analysis(self, start_year, end_year, variable, state='all'):
+    def get_trend_analysis(self, start_year, end_year, variable, state='all', category=None):
         """
         Get trend analysis for a specific variable across years
         
         Args:
             start_year: Starting year
             end_year: Ending year
-            variable: Variable ID to analyze
+            variable: Variable ID (or list of IDs) to analyze
             state: State or 'all'
+            category: Optional category to break each variable down by
         """
         years = list(range(start_year, end_year + 1))
-        return self.get_survey_data(
+        return self.get_survey_data_by_year(
             years=years,
             state=state,
-            variable=variable
+            variable=variable,
+            category=category
         )
+    
+    def get_survey_data_by_year(self, years, **filters):
+        """
+        Get survey data for several years as concurrent per-year shards
+        
+        Each year is fetched (and cached) as its own surveydata request, so
+        overlapping ranges reuse earlier shards and latency is set by the
+        slowest year rather than the sum. The shards are stitched back into
+        the same response shape get_survey_data returns.
+        
+        Args:
+            years: List of years
+            **filters: Any other get_survey_data argument
+        """
+        if not isinstance(years, list):
+            years = [years]
+        valid_years = sorted(set(y for y in years if MIN_SURVEY_YEAR <= y <= MAX_SURVEY_YEAR))
+        if len(valid_years) <= 1:
+            return self.get_survey_data(years=years, **filters)
+        
+        futures = [self._submit(self.get_survey_data, years=[year], **filters)
+                   for year in valid_years]
+        return merge_survey_responses([future.result() for future in futures])
 
 
 # Test function
@@ -3,12 +3,97 @@ Farm Financial Intelligence Platform
 Main Flask Application
 """
 
-from flask import Flask, render_template, request, jsonify
-from api_client import USDAClient
+import startup
+# Before the modules below read their settings from the environment
+startup.load_env()
+
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+from api_client import USDAClient, MIN_SURVEY_YEAR, MAX_SURVEY_YEAR
+from metadata_catalog import MetadataCatalog
+from http_cache import HTTPCache
+from query_planner import describe_plan
+from export import FORMATS, ExportError, export_chunks, parse_years
+from result_view import ResultViews, wants_view
+from trend_analytics import DEFAULT_WINDOW, TrendEngine
+from cache import make_cache_key
+from pivot import PIVOT_PARAMS, PivotEngine, pivot_spec
+from batch import MAX_ITEMS as BATCH_MAX_ITEMS, BatchRunner, parse_deadline
+from circuit_breaker import track_staleness
+import columnar
+import metrics
+import structured_log
 import json
 
 app = Flask(__name__)
-client = USDAClient()
+# Built on first use, so importing the app opens no sessions or cache files
+client = startup.lazy(USDAClient, 'client')
+
+# Lookup listings are served from memory and refreshed in the background.
+# The snapshot is read now (shared copy-on-write under gunicorn --preload;
+# gunicorn.conf.py fetches the listings in the master when there is none);
+# the refresh thread starts with each worker's first request
+catalog = MetadataCatalog(client)
+with startup.phase('catalog snapshot'):
+    catalog.load_snapshot()
+
+# Prometheus request metrics; registered first so sizes are measured after compression
+metrics.instrument_app(app)
+
+# Opt-in columnar JSON (Accept: application/vnd.arms.columnar+json or ?format=columnar);
+# wraps the metrics provider so row counts are still recorded
+columnar.init_app(app)
+
+# Request IDs and sampled JSON request logs
+structured_log.init_app(app)
+
+# ETags, Cache-Control and gzip/brotli for /api/* responses
+http_cache = HTTPCache(app)
+
+# Paged, sorted and projected views over report results
+views = ResultViews()
+
+# Category x year matrices over the same frames, memoized by pivot spec
+pivots = PivotEngine(views)
+
+# Memoized year-over-year, CAGR, rolling mean and real-dollar trend series
+trends = TrendEngine()
+
+
+@app.before_request
+def start_worker():
+    """Per-process background work starts lazily, after any fork"""
+    catalog.ensure_refresher()
+    startup.mark_request()
+
+
+@app.before_request
+def start_staleness_tracking():
+    g.staleness = track_staleness()
+
+
+@app.after_request
+def mark_stale_response(response):
+    """Flag responses built from expired cache entries while ARMS was unavailable"""
+    staleness = g.get('staleness')
+    if staleness and staleness['stale']:
+        response.headers['X-ARMS-Stale'] = 'true'
+        response.headers['Age'] = str(staleness['age'])
+        response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+
+def survey_query_args(data):
+    """get_survey_data arguments from a custom-query style body"""
+    return {
+        'years': data.get('years', [2020]),
+        'state': data.get('state', 'all'),
+        'report': data.get('report'),
+        'variable': data.get('variable'),
+        'farmtype': data.get('farmtype'),
+        'category': data.get('category'),
+        'category_value': data.get('category_value'),
+        'category2': data.get('category2'),
+    }
 
 
 @app.route('/')
@@ -17,12 +102,22 @@ def index():
     return render_template('index.html')
 
 
+def _listing_response(listing):
+    """jsonify a catalog listing; 503 while it hasn't been loaded from ARMS yet"""
+    if catalog.unavailable(listing):
+        response = jsonify(listing)
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return jsonify(listing)
+
+
 @app.route('/api/years', methods=['GET'])
 def get_years():
     """Get all available years"""
     try:
-        years = client.get_years()
-        return jsonify(years)
+        years = catalog.get('years')
+        return _listing_response(years)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -31,8 +126,8 @@ def get_years():
 def get_states():
     """Get all available states"""
     try:
-        states = client.get_states()
-        return jsonify(states)
+        states = catalog.get('states')
+        return _listing_response(states)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -41,8 +136,8 @@ def get_states():
 def get_reports():
     """Get all available reports"""
     try:
-        reports = client.get_reports()
-        return jsonify(reports)
+        reports = catalog.get('reports')
+        return _listing_response(reports)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -51,8 +146,8 @@ def get_reports():
 def get_farm_types():
     """Get all farm types"""
     try:
-        farm_types = client.get_farm_types()
-        return jsonify(farm_types)
+        farm_types = catalog.get('farm_types')
+        return _listing_response(farm_types)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -61,8 +156,8 @@ def get_farm_types():
 def get_categories():
     """Get all categories"""
     try:
-        categories = client.get_categories()
-        return jsonify(categories)
+        categories = catalog.get('categories')
+        return _listing_response(categories)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -72,8 +167,8 @@ def get_variables():
     """Get variables, optionally filtered by report"""
     try:
         report = request.args.get('report')
-        variables = client.get_variables(report=report)
-        return jsonify(variables)
+        variables = catalog.get_variables(report=report)
+        return _listing_response(variables)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -89,14 +184,16 @@ def get_income_statement():
         category = data.get('category')
         category_value = data.get('category_value')
         
-        result = client.get_income_statement(
+        result = views.respond(request.path, data, lambda: client.get_income_statement(
             years=years,
             state=state,
             farmtype=farmtype,
             category=category,
             category_value=category_value
-        )
+        ))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -112,14 +209,16 @@ def get_balance_sheet():
         category = data.get('category')
         category_value = data.get('category_value')
         
-        result = client.get_balance_sheet(
+        result = views.respond(request.path, data, lambda: client.get_balance_sheet(
             years=years,
             state=state,
             farmtype=farmtype,
             category=category,
             category_value=category_value
-        )
+        ))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -135,14 +234,16 @@ def get_financial_ratios():
         category = data.get('category')
         category_value = data.get('category_value')
         
-        result = client.get_financial_ratios(
+        result = views.respond(request.path, data, lambda: client.get_financial_ratios(
             years=years,
             state=state,
             farmtype=farmtype,
             category=category,
             category_value=category_value
-        )
+        ))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -157,13 +258,15 @@ def get_structural_characteristics():
         farmtype = data.get('farmtype')
         category = data.get('category')
         
-        result = client.get_structural_characteristics(
+        result = views.respond(request.path, data, lambda: client.get_structural_characteristics(
             years=years,
             state=state,
             farmtype=farmtype,
             category=category
-        )
+        ))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -178,13 +281,15 @@ def get_government_payments():
         farmtype = data.get('farmtype')
         category = data.get('category')
         
-        result = client.get_government_payments(
+        result = views.respond(request.path, data, lambda: client.get_government_payments(
             years=years,
             state=state,
             farmtype=farmtype,
             category=category
-        )
+        ))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -199,13 +304,15 @@ def get_operator_household_income():
         farmtype = data.get('farmtype')
         category = data.get('category')
         
-        result = client.get_operator_household_income(
+        result = views.respond(request.path, data, lambda: client.get_operator_household_income(
             years=years,
             state=state,
             farmtype=farmtype,
             category=category
-        )
+        ))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -218,8 +325,10 @@ def compare_farm_typology():
         year = data.get('year', 2020)
         report = data.get('report', 'Farm business income statement')
         
-        result = client.compare_by_farm_typology(year, report)
+        result = views.respond(request.path, data, lambda: client.compare_by_farm_typology(year, report))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -232,8 +341,10 @@ def compare_economic_class():
         year = data.get('year', 2020)
         report = data.get('report', 'Farm business income statement')
         
-        result = client.compare_by_economic_class(year, report)
+        result = views.respond(request.path, data, lambda: client.compare_by_economic_class(year, report))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -246,27 +357,60 @@ def compare_regions():
         year = data.get('year', 2020)
         report = data.get('report', 'Farm business income statement')
         
-        result = client.compare_by_region(year, report)
+        result = views.respond(request.path, data, lambda: client.compare_by_region(year, report))
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/trend-analysis', methods=['POST'])
 def get_trend_analysis():
-    """Get trend analysis for a variable"""
+    """
+    Get trend analysis for one or more variables
+    
+    Returns the rows plus 'analytics': per variable x state x category value
+    series with year-over-year change, CAGR, rolling mean, volatility and
+    inflation-adjusted estimates. Pass include_rows=false for analytics only.
+    """
     try:
         data = request.json
-        start_year = data.get('start_year', 2015)
-        end_year = data.get('end_year', 2020)
+        start_year = int(data.get('start_year', 2015))
+        end_year = int(data.get('end_year', 2020))
         variable = data.get('variable')
         state = data.get('state', 'all')
+        category = data.get('category')
+        window = int(data.get('window', DEFAULT_WINDOW))
+        base_year = data.get('base_year')
         
         if not variable:
             return jsonify({'error': 'Variable is required'}), 400
+        if window < 1:
+            return jsonify({'error': 'window must be at least 1'}), 400
         
-        result = client.get_trend_analysis(start_year, end_year, variable, state)
-        return jsonify(result)
+        def fetch():
+            return client.get_trend_analysis(start_year, end_year, variable, state, category=category)
+        
+        if wants_view(data):
+            return jsonify(views.respond(request.path, data, fetch))
+        
+        years = [y for y in range(start_year, end_year + 1) if MIN_SURVEY_YEAR <= y <= MAX_SURVEY_YEAR]
+        if not years:
+            return jsonify({'error': 'Please select years between 1996 and 2023'}), 400
+        
+        input_key = make_cache_key('trend-analysis', {
+            'year': years, 'state': state, 'variable': variable, 'category': category
+        }, 'POST')
+        include_rows = bool(data.get('include_rows', True))
+        result = trends.analyze(input_key, fetch, years, window=window,
+                                base_year=int(base_year) if base_year else None,
+                                include_rows=include_rows)
+        if 'error' in result or include_rows:
+            return jsonify(result)
+        return jsonify({'analytics': result})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -291,7 +435,10 @@ def custom_query():
         if not report and not variable:
             return jsonify({'error': 'Either report or variable is required'}), 400
         
-        result = client.get_survey_data(
+        if client.planner:
+            # Pages served from an in-memory view don't run a query
+            client.planner.clear_plan()
+        result = views.respond(request.path, data, lambda: client.get_survey_data(
             years=years,
             state=state,
             report=report,
@@ -300,20 +447,172 @@ def custom_query():
             category=category,
             category_value=category_value,
             category2=category2
-        )
+        ))
         
-        return jsonify(result)
+        response = jsonify(result)
+        # Report whether the query was answered from cache, by filtering
+        # cached results, partly upstream or fully upstream
+        plan = client.planner.last_plan() if client.planner else None
+        if plan:
+            response.headers['X-Query-Plan'] = describe_plan(plan)
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def run_batch_item(item):
+    """One /api/batch item: a custom-query spec, optionally with view fields"""
+    if not isinstance(item, dict):
+        return {'error': 'Each item must be an object'}
+    query = {k: v for k, v in item.items() if k != 'id'}
+    if not query.get('report') and not query.get('variable'):
+        return {'error': 'Either report or variable is required'}
+    # Dashboard tabs load through here, so items keep the request's interactive class
+    return views.respond('/api/custom-query', query,
+                         lambda: client.get_survey_data(**survey_query_args(query)))
+
+
+# Bounded per-worker pool for /api/batch items
+batches = BatchRunner(run_batch_item)
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch_query():
+    """
+    Run several custom queries concurrently in one request
+    
+    Body: {"items": [{custom-query fields, optional "id"}, ...],
+    "deadline": seconds}. Each result carries its own status, so one failed
+    or slow item doesn't fail the batch.
+    """
+    try:
+        data = request.json
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f"At most {BATCH_MAX_ITEMS} items per batch"}), 400
+        
+        return jsonify(batches.run(items, deadline=parse_deadline(data.get('deadline'))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/pivot', methods=['POST'])
+def pivot_survey_data():
+    """
+    Aggregate surveydata into a row x column matrix
+    
+    Takes the custom-query filters plus rows/columns (dimension lists,
+    default variable_name, category_value x year), value (default
+    estimate), agg (mean, sum, min, max, median, first, count) and
+    optional exact-match filters.
+    """
+    try:
+        data = request.json
+        spec = pivot_spec(data)
+        query = {k: v for k, v in data.items() if k not in PIVOT_PARAMS}
+        
+        if not query.get('report') and not query.get('variable'):
+            return jsonify({'error': 'Either report or variable is required'}), 400
+        
+        def fetch():
+            return client.get_survey_data(**survey_query_args(query))
+        
+        # Keyed like /api/custom-query, so both share the same result frame
+        return jsonify(pivots.pivot('/api/custom-query', query, spec, fetch))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_survey_data():
+    """
+    Stream a surveydata pull as NDJSON or CSV
+    
+    Takes the custom-query filters (JSON body or query string, where years
+    may be '2015-2023') plus format=ndjson|csv. Rows are written out one
+    year at a time with chunked transfer encoding.
+    """
+    try:
+        data = request.get_json(silent=True) or request.args.to_dict()
+        fmt = str(data.get('format', 'ndjson')).lower()
+        if fmt not in FORMATS:
+            return jsonify({'error': f"Unsupported format: {fmt}"}), 400
+        
+        years = [y for y in parse_years(data.get('years', data.get('year')))
+                 if MIN_SURVEY_YEAR <= y <= MAX_SURVEY_YEAR]
+        if not years:
+            return jsonify({'error': 'Please select years between 1996 and 2023'}), 400
+        if not data.get('report') and not data.get('variable'):
+            return jsonify({'error': 'Either report or variable is required'}), 400
+        
+        filters = {name: data.get(name) for name in
+                   ('state', 'report', 'variable', 'farmtype', 'category',
+                    'category_value', 'category2')}
+        filters['state'] = filters['state'] or 'all'
+        
+        try:
+            chunks = export_chunks(client, years, fmt=fmt, **filters)
+        except ExportError as e:
+            return jsonify({'error': str(e)}), 502
+        
+        filename = f"arms_export_{min(years)}_{max(years)}.{fmt}"
+        return Response(stream_with_context(chunks), mimetype=FORMATS[fmt], headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store',
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Response cache hit/miss counters for this worker and the whole fleet"""
+    if client.cache is None:
+        return jsonify({'enabled': False})
+    try:
+        stats = dict(client.cache.stats(), enabled=True)
+        if client.planner:
+            stats['planner'] = client.planner.stats()
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/rate-stats', methods=['GET'])
+def rate_stats():
+    """Upstream token bucket level plus queue depth and wait times per priority class"""
+    if not client.governor:
+        return jsonify({'enabled': False})
+    try:
+        return jsonify(dict(client.governor.stats(), enabled=True))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (all workers when PROMETHEUS_MULTIPROC_DIR is set)"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for load balancer"""
     return jsonify({
         'status': 'healthy',
         'service': 'farm-financial-platform',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'upstream': client.breaker.stats() if client.breaker else None,
+        'startup': startup.report()
     }), 200
 
 
@@ -329,6 +628,9 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 
+startup.mark_ready()
+
+
 if __name__ == '__main__':
     # For local development
     print("=" * 60)
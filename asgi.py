@@ -0,0 +1,253 @@
+"""
+ASGI Entry Point for Farm Financial Intelligence Platform
+Serves many slow ARMS requests per process: the upstream calls behind each
+/api/* data route are awaited on the event loop, and the Flask route then
+answers from the response cache, so its thread is only held for rendering
+
+Usage:
+    uvicorn asgi:app --workers 3 --port 5000
+"""
+
+import asyncio
+import json
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+from api_client import build_survey_params, remember_prefetches
+from async_client import AsyncUSDAClient
+from batch import MAX_ITEMS as BATCH_MAX_ITEMS, effective_deadline, parse_deadline, start_clock
+from structured_log import REQUEST_ID_HEADER, start_request
+
+
+# Report routes -> (client method, whether the route passes category_value);
+# must match the arguments the Flask routes in app.py use
+REPORT_ROUTES = {
+    '/api/income-statement': ('get_income_statement', True),
+    '/api/balance-sheet': ('get_balance_sheet', True),
+    '/api/financial-ratios': ('get_financial_ratios', True),
+    '/api/structural-characteristics': ('get_structural_characteristics', False),
+    '/api/government-payments': ('get_government_payments', False),
+    '/api/operator-household-income': ('get_operator_household_income', False),
+}
+
+COMPARISON_ROUTES = {
+    '/api/compare-farm-typology': 'compare_by_farm_typology',
+    '/api/compare-economic-class': 'compare_by_economic_class',
+    '/api/compare-regions': 'compare_by_region',
+}
+
+# Upstream calls in flight per process (the sync client is bounded by its threads instead)
+UPSTREAM_CONCURRENCY = int(os.getenv('ARMS_ASGI_CONCURRENCY', '100'))
+
+# Largest request body parsed for prefetching; bigger ones are left to Flask
+MAX_PREFETCH_BODY = 1024 * 1024
+
+
+def _custom_query(data):
+    """get_survey_data call for a custom-query style body, or None if Flask will reject it"""
+    if not data.get('report') and not data.get('variable'):
+        return None
+    return ('get_survey_data', flask_app.survey_query_args(data))
+
+
+def upstream_calls(path, data):
+    """
+    The (client method, kwargs) calls the Flask route for path will make
+
+    Empty when the route doesn't go upstream or the body is invalid; the
+    route then runs exactly as under WSGI.
+    """
+    if path in REPORT_ROUTES:
+        method, with_category_value = REPORT_ROUTES[path]
+        kwargs = {
+            'years': data.get('years', [2020]),
+            'state': data.get('state', 'all'),
+            'farmtype': data.get('farmtype'),
+            'category': data.get('category'),
+        }
+        if with_category_value:
+            kwargs['category_value'] = data.get('category_value')
+        return [(method, kwargs)]
+
+    if path in COMPARISON_ROUTES:
+        return [(COMPARISON_ROUTES[path], {
+            'year': data.get('year', 2020),
+            'report': data.get('report', 'Farm business income statement'),
+        })]
+
+    if path in ('/api/custom-query', '/api/pivot'):
+        call = _custom_query(data)
+        return [call] if call else []
+
+    if path == '/api/trend-analysis':
+        if not data.get('variable'):
+            return []
+        return [('get_trend_analysis', {
+            'start_year': int(data.get('start_year', 2015)),
+            'end_year': int(data.get('end_year', 2020)),
+            'variable': data.get('variable'),
+            'state': data.get('state', 'all'),
+            'category': data.get('category'),
+        })]
+
+    if path == '/api/batch':
+        items = data.get('items')
+        # Bodies Flask rejects with a 400 cost ARMS nothing
+        if not isinstance(items, list) or len(items) > BATCH_MAX_ITEMS:
+            return []
+        try:
+            parse_deadline(data.get('deadline'))
+        except ValueError:
+            return []
+        calls = [_custom_query(item) for item in items if isinstance(item, dict)]
+        return [call for call in calls if call]
+
+    return []
+
+
+class PrefetchClient(AsyncUSDAClient):
+    """
+    AsyncUSDAClient that leaves queries the query planner may answer to Flask
+
+    Such queries are answered by filtering held results (or need only
+    some slices upstream), which the planner does better than fetching
+    the whole query here.
+    """
+
+    def __init__(self, planner=None, **kwargs):
+        super().__init__(**kwargs)
+        self.planner = planner
+
+    async def get_survey_data(self, years, **filters):
+        if self.planner:
+            params, error = build_survey_params(years, **filters)
+            if error is None and self.planner.may_answer(params):
+                return {}
+        return await super().get_survey_data(years, **filters)
+
+
+class AsyncApp:
+    """
+    ASGI application wrapping the Flask app
+
+    For the data routes, the request body is read here and the route's
+    upstream calls are awaited with AsyncUSDAClient, which stores the
+    results in the shared response cache. The unchanged request is then
+    handed to Flask, which finds everything cached; responses, headers
+    and error handling are exactly those of the WSGI deployment. Other
+    routes go to Flask directly. Each Flask call gets its own thread, so
+    slow exports don't hold up other requests.
+    """
+
+    def __init__(self, flask_application, client):
+        self.wsgi = WsgiToAsgi(flask_application)
+        self.client = client
+        self._async_client = None
+
+    def async_client(self):
+        # Created on first use, inside the worker's event loop
+        if self._async_client is None:
+            self._async_client = self.client.async_client(
+                client_class=PrefetchClient, planner=self.client.planner,
+                concurrency=UPSTREAM_CONCURRENCY, max_connections=UPSTREAM_CONCURRENCY)
+        return self._async_client
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        scope = self._with_request_id(scope)
+
+        if (scope['method'] == 'POST' and scope['path'].startswith('/api/')
+                and self.client.cache is not None and not self.client.mirror):
+            body = await self._read_body(receive)
+            if body is None:
+                # Client went away
+                return
+            if len(body) <= MAX_PREFETCH_BODY:
+                # Flask reuses the prefetch's calls instead of asking ARMS again
+                remember_prefetches()
+                await self.prefetch(scope['path'], body)
+            receive = self._replay(body)
+
+        async with ThreadSensitiveContext():
+            await self.wsgi(scope, receive, send)
+
+    def _with_request_id(self, scope):
+        """
+        Start the request's logging context, adding an X-Request-ID header if
+        the client sent none, so the prefetch and the Flask route share one ID
+        """
+        header = REQUEST_ID_HEADER.lower().encode()
+        sent = next((value for name, value in scope['headers'] if name == header), None)
+        holder = start_request(sent.decode('latin-1') if sent else None, handoff=True)
+        if sent is not None and sent.decode('latin-1') == holder['request_id']:
+            return scope
+        headers = [(name, value) for name, value in scope['headers'] if name != header]
+        headers.append((header, holder['request_id'].encode()))
+        return dict(scope, headers=headers)
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _replay(self, body):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                return {'type': 'http.disconnect'}
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return receive
+
+    async def prefetch(self, path, body):
+        """Await the upstream calls behind a request; the Flask route reuses the results and failures"""
+        try:
+            data = json.loads(body or b'null')
+            calls = upstream_calls(path, data) if isinstance(data, dict) else []
+        except (ValueError, TypeError):
+            return
+        if not calls:
+            return
+        if path == '/api/batch':
+            # The batch deadline counts from here, not from when Flask starts
+            start_clock()
+        gathered = asyncio.ensure_future(self.async_client().gather(calls))
+        # Retrieved here even when nobody awaits it any more
+        gathered.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            if path == '/api/batch':
+                # Items still running at the deadline keep going; Flask reports them as timeouts
+                await asyncio.wait_for(asyncio.shield(gathered),
+                                       effective_deadline(parse_deadline(data.get('deadline'))))
+            else:
+                await gathered
+        except Exception:
+            # Including the deadline passing; the Flask route takes it from here
+            pass
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._async_client is not None:
+                    await self._async_client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncApp(flask_app.app, flask_app.client)
@@ -0,0 +1,428 @@
+"""
+Asyncio-native USDA ERS ARMS API client
+Mirrors the USDAClient surface so fan-out workloads (all reports for a year,
+all comparison views) run concurrently over one pooled connection set
+"""
+
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from api_client import (ARMS_BASE_URL, MAX_SURVEY_YEAR, MIN_SURVEY_YEAR, UNAVAILABLE_ERROR,
+                        build_survey_params, collecting_prefetches, merge_survey_responses,
+                        note_prefetch)
+from cache import cache_from_env, make_cache_key
+from http_session import RetryPolicy
+from metrics import UpstreamCall, count_upstream_error
+from structured_log import log_upstream
+from rate_governor import current_priority, governor_from_env
+
+
+# Threads for blocking cache I/O, kept off the loop's default executor
+IO_THREADS = int(os.getenv('USDA_ASYNC_IO_THREADS', '16'))
+
+_io_pool = None
+_io_pool_pid = None
+_io_pool_lock = threading.Lock()
+
+RATE_LIMITED_ERROR = 'ARMS request budget exhausted. Please try again shortly.'
+
+
+def _io_executor():
+    """This process's cache I/O pool; a forked worker builds its own"""
+    global _io_pool, _io_pool_pid
+    pid = os.getpid()
+    if _io_pool is None or _io_pool_pid != pid:
+        with _io_pool_lock:
+            if _io_pool is None or _io_pool_pid != pid:
+                _io_pool = ThreadPoolExecutor(max_workers=IO_THREADS,
+                                              thread_name_prefix='arms-async-io')
+                _io_pool_pid = pid
+    return _io_pool
+
+
+def _share_with_route(cache_key, task):
+    """Hand an upstream call to the Flask route behind the ASGI prefetch, if any"""
+    if not collecting_prefetches():
+        return
+    future = concurrent.futures.Future()
+
+    def done(task):
+        if task.cancelled() or task.exception() is not None:
+            # Let the route make the call itself
+            future.set_result(None)
+        else:
+            future.set_result(copy.deepcopy(task.result()))
+    task.add_done_callback(done)
+    note_prefetch(cache_key, future)
+
+
+async def _run_blocking(fn, *args):
+    """Run a blocking call (cache I/O) on the dedicated I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor(), functools.partial(fn, *args))
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """httpx transport recording into or replaying from a cassette.Cassette"""
+
+    def __init__(self, cassette, live_transport):
+        self.cassette = cassette
+        self.live = live_transport
+
+    async def handle_async_request(self, request):
+        body = request.content
+        if self.cassette.replaying:
+            status, content_type, content = self.cassette.lookup(request.method, str(request.url),
+                                                                 body)
+            return httpx.Response(status, headers={'Content-Type': content_type or 'application/json'},
+                                  content=content, request=request)
+
+        response = await self.live.handle_async_request(request)
+        content = await response.aread()
+        self.cassette.capture(request.method, str(request.url), body, response.status_code,
+                              response.headers.get('Content-Type'), content)
+        # content is already decoded, so drop the encoding and length headers
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+        return httpx.Response(response.status_code, headers=headers, content=content,
+                              request=request, extensions=response.extensions)
+
+    async def aclose(self):
+        await self.live.aclose()
+
+
+class AsyncUSDAClient:
+    """
+    Async client for the USDA ERS ARMS API
+
+    Use as an async context manager so the connection pool is closed:
+
+        async with AsyncUSDAClient() as client:
+            data = await client.get_income_statement([2020])
+    """
+
+    def __init__(self, api_key=None, base_url=None, cache=None, retry_policy=None,
+                 max_connections=None, concurrency=None,
+                 connect_timeout=None, read_timeout=None, governor=None, breaker=None,
+                 transport=None):
+        self.api_key = api_key or os.getenv('USDA_API_KEY')
+        self.base_url = base_url or os.getenv('USDA_BASE_URL', ARMS_BASE_URL)
+
+        if not self.api_key:
+            raise ValueError("USDA_API_KEY not found in environment variables")
+
+        self.cache = cache if cache is not None else cache_from_env()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Shared upstream rate governor (pass governor=False for no rate limit)
+        self.governor = governor if governor is not None else governor_from_env()
+        # Optional CircuitBreaker, normally the one of the USDAClient this was made from
+        self.breaker = breaker
+        # Optional cassette.Cassette recording or replaying the traffic
+        self.transport = transport
+
+        self.max_connections = max_connections or int(os.getenv('USDA_ASYNC_MAX_CONNECTIONS', '20'))
+        self.concurrency = concurrency or int(os.getenv('USDA_ASYNC_CONCURRENCY', '10'))
+        self.connect_timeout = connect_timeout or float(os.getenv('USDA_CONNECT_TIMEOUT', '3.05'))
+        self.read_timeout = read_timeout or float(os.getenv('USDA_READ_TIMEOUT', '15'))
+
+        self._http = None
+        self._semaphore = None
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _client(self):
+        if self._http is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            transport = None
+            if self.transport is not None:
+                transport = self.transport.async_transport(httpx.AsyncHTTPTransport(limits=limits))
+            self._http = httpx.AsyncClient(
+                limits=limits,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                transport=transport,
+            )
+            # Caps concurrent upstream calls independently of pool size
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._http
+
+    async def _make_request(self, endpoint, params=None, method='GET'):
+        """
+        Make HTTP request to USDA API
+
+        Answers from the shared response cache when possible; concurrent
+        coroutines with the same normalized parameters await one upstream call.
+        """
+        cache_key = make_cache_key(endpoint, params, method)
+        if self.cache is not None:
+            cached = await _run_blocking(self.cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            _share_with_route(cache_key, in_flight)
+            # Coalesced callers get their own copy of the shared result
+            return copy.deepcopy(await asyncio.shield(in_flight))
+
+        task = asyncio.ensure_future(self._fetch_and_store(cache_key, endpoint, params, method))
+        self._in_flight[cache_key] = task
+        _share_with_route(cache_key, task)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._in_flight.pop(cache_key, None)
+            else:
+                task.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+
+    async def _fetch_and_store(self, cache_key, endpoint, params, method):
+        if self.breaker and not self.breaker.allow():
+            count_upstream_error(endpoint, 'unavailable')
+            return {'error': UNAVAILABLE_ERROR}
+        if self.governor and not await self.governor.acquire_async(current_priority()):
+            count_upstream_error(endpoint, 'rate_limited')
+            return {'error': RATE_LIMITED_ERROR}
+        result = await self._fetch(endpoint, params, method)
+        if self.cache is not None and 'error' not in result:
+            await _run_blocking(self.cache.set, cache_key, endpoint, result)
+        return result
+
+    async def _fetch(self, endpoint, params=None, method='GET'):
+        """Send a request to the USDA API with retries on 429/5xx and connect errors"""
+        http = self._client()
+        url = f"{self.base_url}/{endpoint}"
+        query = {'api_key': self.api_key}
+        body = None
+        if method == 'GET':
+            query.update(params or {})
+        else:
+            body = {k: v for k, v in (params or {}).items() if v is not None}
+
+        attempt = 0
+        started = time.perf_counter()
+        response = None
+        with UpstreamCall(endpoint, method) as call:
+            try:
+                async with self._semaphore:
+                    while True:
+                        try:
+                            response = await http.request(method, url, params=query, json=body)
+                        except httpx.ConnectError:
+                            if attempt >= self.retry_policy.max_retries:
+                                raise
+                            await asyncio.sleep(self.retry_policy.compute_delay(attempt))
+                            if not await self._retry_token():
+                                raise
+                            attempt += 1
+                            continue
+
+                        if response.status_code == 429 and self.governor:
+                            self.governor.throttle(self.retry_policy.compute_delay(
+                                attempt, response.headers.get('Retry-After')))
+                        if (self.retry_policy.should_retry_status(response.status_code)
+                                and attempt < self.retry_policy.max_retries):
+                            await asyncio.sleep(self.retry_policy.compute_delay(
+                                attempt, response.headers.get('Retry-After')))
+                            if await self._retry_token():
+                                attempt += 1
+                                continue
+                        break
+
+                response.raise_for_status()
+                result = response.json()
+                if self.breaker:
+                    self.breaker.record_success()
+                return result
+
+            except httpx.HTTPStatusError as e:
+                call.fail('http')
+                if self.breaker and e.response.status_code >= 500:
+                    self.breaker.record_failure()
+                error_msg = f"API request failed: {str(e)}"
+                try:
+                    error_msg += f" - Details: {e.response.json()}"
+                except ValueError:
+                    error_msg += f" - Response: {e.response.text[:300]}"
+                return {'error': error_msg}
+            except httpx.TimeoutException:
+                call.fail('timeout')
+                if self.breaker:
+                    self.breaker.record_failure()
+                return {'error': 'Request timed out. Please try again.'}
+            except httpx.HTTPError as e:
+                call.fail('connection')
+                if self.breaker:
+                    self.breaker.record_failure()
+                return {'error': f'API request failed: {str(e)}'}
+            except ValueError:
+                call.fail('decode')
+                return {'error': 'Invalid response from API'}
+            finally:
+                log_upstream(endpoint, method, started, error=call.error, params=params,
+                             status=response.status_code if response is not None else None,
+                             client='async')
+
+    async def _retry_token(self):
+        """Retries are upstream calls too; True once the governor allows one"""
+        if not self.governor:
+            return True
+        return await self.governor.acquire_async(current_priority())
+
+    async def get_states(self):
+        """Get all available states"""
+        return await self._make_request('state', method='GET')
+
+    async def get_years(self):
+        """Get all available years"""
+        return await self._make_request('year', method='GET')
+
+    async def get_reports(self, report_name=None):
+        """Get all available reports or specific report by name"""
+        if report_name:
+            return await self._make_request('report', {'name': report_name}, method='POST')
+        return await self._make_request('report', method='GET')
+
+    async def get_variables(self, report=None, name=None):
+        """Get variables, optionally filtered by report or name"""
+        if report or name:
+            params = {}
+            if report:
+                params['report'] = report
+            if name:
+                params['name'] = name
+            return await self._make_request('variable', params, method='POST')
+        return await self._make_request('variable', method='GET')
+
+    async def get_categories(self, category_name=None):
+        """Get all categories or specific category by name"""
+        if category_name:
+            return await self._make_request('category', {'name': category_name}, method='POST')
+        return await self._make_request('category', method='GET')
+
+    async def get_farm_types(self, name=None):
+        """Get all farm types or search by name"""
+        if name:
+            return await self._make_request('farmtype', {'name': name}, method='POST')
+        return await self._make_request('farmtype', method='GET')
+
+    async def get_survey_data(self, years, state='all', report=None, variable=None,
+                              farmtype=None, category=None, category_value=None, category2=None):
+        """Get survey data with filters (same arguments as USDAClient.get_survey_data)"""
+        params, error = build_survey_params(
+            years, state=state, report=report, variable=variable, farmtype=farmtype,
+            category=category, category_value=category_value, category2=category2
+        )
+        if error:
+            return {'error': error}
+        return await self._make_request('surveydata', params, method='POST')
+
+    async def get_survey_data_by_year(self, years, **filters):
+        """Get survey data for several years as concurrent, individually cached per-year shards"""
+        if not isinstance(years, list):
+            years = [years]
+        valid_years = sorted(set(y for y in years if MIN_SURVEY_YEAR <= y <= MAX_SURVEY_YEAR))
+        if len(valid_years) <= 1:
+            return await self.get_survey_data(years=years, **filters)
+
+        shards = await asyncio.gather(*(self.get_survey_data(years=[year], **filters)
+                                        for year in valid_years))
+        return merge_survey_responses(list(shards))
+
+    async def _get_report(self, report, years, state, farmtype, category, category_value):
+        return await self.get_survey_data(
+            years=years,
+            state=state,
+            report=report,
+            farmtype=farmtype,
+            category=category,
+            category_value=category_value
+        )
+
+    async def get_income_statement(self, years, state='all', farmtype=None,
+                                   category=None, category_value=None):
+        """Get farm business income statement data"""
+        return await self._get_report('Farm Business Income Statement', years, state,
+                                      farmtype, category, category_value)
+
+    async def get_balance_sheet(self, years, state='all', farmtype=None,
+                                category=None, category_value=None):
+        """Get farm business balance sheet data"""
+        return await self._get_report('Farm Business Balance Sheet', years, state,
+                                      farmtype, category, category_value)
+
+    async def get_financial_ratios(self, years, state='all', farmtype=None,
+                                   category=None, category_value=None):
+        """Get farm business financial ratios"""
+        return await self._get_report('Farm Business Financial Ratios', years, state,
+                                      farmtype, category, category_value)
+
+    async def get_structural_characteristics(self, years, state='all', farmtype=None,
+                                             category=None, category_value=None):
+        """Get structural characteristics"""
+        return await self._get_report('Structural Characteristics', years, state,
+                                      farmtype, category, category_value)
+
+    async def get_government_payments(self, years, state='all', farmtype=None,
+                                      category=None, category_value=None):
+        """Get government payments data"""
+        return await self._get_report('Government Payments', years, state,
+                                      farmtype, category, category_value)
+
+    async def get_operator_household_income(self, years, state='all', farmtype=None,
+                                            category=None, category_value=None):
+        """Get operator household income"""
+        return await self._get_report('Operator Household Income', years, state,
+                                      farmtype, category, category_value)
+
+    async def compare_by_farm_typology(self, year, report='Farm Business Income Statement'):
+        """Compare data across different farm typologies"""
+        return await self.get_survey_data(years=[year], state='all', report=report,
+                                          category='collapsed farm typology')
+
+    async def compare_by_economic_class(self, year, report='Farm Business Income Statement'):
+        """Compare data across different economic classes"""
+        return await self.get_survey_data(years=[year], state='all', report=report,
+                                          category='economic class')
+
+    async def compare_by_region(self, year, report='Farm Business Income Statement'):
+        """Compare data across NASS regions"""
+        return await self.get_survey_data(years=[year], state='all', report=report,
+                                          category='nass region')
+
+    async def get_trend_analysis(self, start_year, end_year, variable, state='all', category=None):
+        """Get trend analysis for a specific variable across years"""
+        years = list(range(start_year, end_year + 1))
+        return await self.get_survey_data_by_year(years=years, state=state, variable=variable,
+                                                  category=category)
+
+    async def gather(self, calls):
+        """
+        Run several client calls concurrently
+
+        Args:
+            calls: List of (method name, kwargs) tuples, e.g.
+                [('get_income_statement', {'years': [2020]})]
+
+        Returns the results in the same order.
+        """
+        return await asyncio.gather(*(getattr(self, name)(**kwargs) for name, kwargs in calls))
@@ -0,0 +1,115 @@
+"""
+Batch execution of surveydata queries
+Runs several /api/custom-query style specs concurrently on a bounded pool
+and collects per-item results, errors and timeouts within one deadline
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+DEFAULT_DEADLINE = float(os.getenv('ARMS_BATCH_DEADLINE', '20'))
+MAX_DEADLINE = float(os.getenv('ARMS_BATCH_MAX_DEADLINE', '60'))
+MAX_ITEMS = int(os.getenv('ARMS_BATCH_MAX_ITEMS', '50'))
+
+# When the current request's deadline started counting, if before BatchRunner.run
+# (asgi.py starts it before prefetching the items)
+_clock = contextvars.ContextVar('arms_batch_clock', default=None)
+
+
+def parse_deadline(value):
+    """Deadline in seconds from a request field (None for the default); raises ValueError"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError('deadline must be a number of seconds')
+    try:
+        deadline = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('deadline must be a number of seconds')
+    if not math.isfinite(deadline) or deadline <= 0:
+        raise ValueError('deadline must be a positive number of seconds')
+    return deadline
+
+
+def effective_deadline(deadline):
+    """The deadline a batch runs under: the requested one or the default, capped"""
+    return min(deadline or DEFAULT_DEADLINE, MAX_DEADLINE)
+
+
+def start_clock():
+    """Count the current request's batch deadline from now"""
+    _clock.set(time.perf_counter())
+
+
+class BatchRunner:
+    """
+    Runs batch items on a pool shared by all requests in this worker
+
+    Items still running or queued at the deadline are reported as
+    timeouts; they are not cancelled but finish in the background, so
+    their results land in the response cache for the next request.
+    """
+
+    def __init__(self, run_item, workers=None):
+        self.run_item = run_item
+        self.workers = workers or int(os.getenv('ARMS_BATCH_WORKERS', '8'))
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        """Executors don't survive fork, so rebuild per pid"""
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='arms-batch')
+                    self._pool_pid = pid
+        return self._pool
+
+    def _timed(self, item):
+        start = time.perf_counter()
+        try:
+            result = self.run_item(item)
+        except Exception as e:
+            result = {'error': str(e)}
+        return result, round((time.perf_counter() - start) * 1000, 2)
+
+    def run(self, items, deadline=None):
+        """
+        Run items concurrently and return one entry per item, in order
+
+        Each entry has id (the item's 'id' or its index), status (ok,
+        error or timeout), ms, and result or error.
+        """
+        deadline = effective_deadline(deadline)
+        start = _clock.get() or time.perf_counter()
+        pool = self._get_pool()
+        # Items run in copies of the request's context (priority class, staleness tracking)
+        futures = [pool.submit(contextvars.copy_context().run, self._timed, item) for item in items]
+        wait(futures, timeout=max(0.0, deadline - (time.perf_counter() - start)))
+
+        results = []
+        for index, (item, future) in enumerate(zip(items, futures)):
+            entry = {'id': item.get('id', index) if isinstance(item, dict) else index}
+            if not future.done():
+                entry.update(status='timeout', error=f"Not finished within {deadline:g}s")
+            else:
+                result, ms = future.result()
+                entry['ms'] = ms
+                if 'error' in result:
+                    entry.update(status='error', error=result['error'])
+                else:
+                    entry.update(status='ok', result=result)
+            results.append(entry)
+        return {
+            'results': results,
+            'ms': round((time.perf_counter() - start) * 1000, 2),
+            'deadline': deadline,
+        }
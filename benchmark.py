@@ -0,0 +1,274 @@
+"""
+Benchmark suite run against the local stub ARMS API
+Microbenchmarks of the client and CLI hot paths, plus end-to-end throughput
+and latency of the Flask routes (under gunicorn) at several concurrency
+levels. Results are written as JSON and compared with a stored baseline.
+
+Usage:
+    python benchmark.py                          # run, compare with the baseline
+    python benchmark.py --save-baseline          # record a new baseline
+    python benchmark.py --only micro --json out.json
+    python benchmark.py --concurrency 1,16,64 --latency-ms 200 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+import httpx
+
+from load_test import query_bodies, start_server
+from stub_arms import build_survey_rows, start_background_server
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+
+INCOME_STATEMENT = 'Farm Business Income Statement'
+
+# Route scenarios: (name, method, path, body); None bodies are generated per
+# request so every one goes upstream
+ROUTES = [
+    ('years', 'GET', '/api/years', None),
+    ('income-statement-cached', 'POST', '/api/income-statement',
+     {'years': [2021, 2022], 'state': 'all'}),
+    ('custom-query-uncached', 'POST', '/api/custom-query', None),
+]
+
+# Lower is better for these metrics; higher for the rest
+LOWER_IS_BETTER = ('us_per_op', 'p50_ms', 'p95_ms')
+
+
+def survey_response(scale):
+    """A surveydata response as ARMS would return it for a two-year income statement"""
+    body = {'year': [2021, 2022], 'state': ['all'], 'report': [INCOME_STATEMENT]}
+    return {'data': build_survey_rows(body, scale)}
+
+
+def time_op(fn, min_time=0.2, repeat=5):
+    """Best and median microseconds per call of fn() over repeat timed runs"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_time / repeat or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        runs.append((time.perf_counter() - start) / loops * 1e6)
+    return {'us_per_op': round(min(runs), 3), 'median_us': round(statistics.median(runs), 3),
+            'loops': loops}
+
+
+def run_micro(scale):
+    """Parameter normalization, serialization and CLI table rendering"""
+    from api_client import build_survey_params
+    from cache import make_cache_key
+    from cli_app import FarmCLI
+
+    response = survey_response(scale)
+    encoded = json.dumps(response).encode('utf-8')
+    compressed = zlib.compress(encoded)
+    # display_table doesn't touch the client; skip constructing one
+    cli = FarmCLI.__new__(FarmCLI)
+
+    def normalize():
+        params, _ = build_survey_params([2022, 2021], state='all', report=INCOME_STATEMENT,
+                                        farmtype='Farm Businesses',
+                                        category='collapsed farm typology')
+        return make_cache_key('surveydata', params, 'POST')
+
+    def display():
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli.display_table(response, 'Income Statement')
+
+    cases = {
+        'survey_params_normalize': normalize,
+        'response_serialize': lambda: json.dumps(response),
+        'response_parse': lambda: json.loads(encoded),
+        'cache_entry_encode': lambda: zlib.compress(json.dumps(response).encode('utf-8')),
+        'cache_entry_decode': lambda: json.loads(zlib.decompress(compressed)),
+        'display_table': display,
+    }
+    results = {}
+    for name, fn in cases.items():
+        results[name] = time_op(fn)
+        print(f"  {name:<28}{results[name]['us_per_op']:>14,.1f} us/op", file=sys.stderr)
+    results['_rows'] = len(response['data'])
+    return results
+
+
+async def drive(url, method, path, bodies, concurrency):
+    """Send one request per body with at most concurrency in flight; (ok, seconds) each"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=300) as http:
+        async def one(body):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await http.request(method, path, json=body)
+                    ok = response.status_code == 200 and 'error' not in response.json()
+                except (httpx.HTTPError, ValueError):
+                    ok = False
+                return ok, time.perf_counter() - start
+        return await asyncio.gather(*(one(body) for body in bodies))
+
+
+def _percentile(latencies, q):
+    return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+
+
+def run_e2e(args):
+    """Each route scenario at each concurrency level against a gunicorn server"""
+    stub, upstream_url = start_background_server(latency_ms=args.latency_ms,
+                                                 error_rate=args.error_rate, scale=args.scale)
+    workdir = tempfile.mkdtemp(prefix='arms-bench-')
+    levels = [int(level) for level in args.concurrency.split(',')]
+    # Distinct bodies for the uncached scenario, never reused across levels
+    fresh = iter(query_bodies(args.requests * len(levels)))
+    results = {}
+    try:
+        process, url = start_server('wsgi', args.workers, upstream_url, workdir)
+        try:
+            for name, method, path, body in ROUTES:
+                if body is not None:
+                    # Warm the cache so the scenario measures the cached path
+                    asyncio.run(drive(url, method, path, [body], 1))
+                for concurrency in levels:
+                    bodies = ([body] * args.requests if body is not None or method == 'GET'
+                              else [next(fresh) for _ in range(args.requests)])
+                    start = time.perf_counter()
+                    outcomes = asyncio.run(drive(url, method, path, bodies, concurrency))
+                    elapsed = time.perf_counter() - start
+                    latencies = sorted(seconds for _, seconds in outcomes)
+                    key = f"{name}@{concurrency}"
+                    results[key] = {
+                        'requests_per_s': round(len(outcomes) / elapsed, 1),
+                        'p50_ms': _percentile(latencies, 0.5),
+                        'p95_ms': _percentile(latencies, 0.95),
+                        'error_rate': round(sum(1 for ok, _ in outcomes if not ok) / len(outcomes), 4),
+                    }
+                    row = results[key]
+                    print(f"  {key:<34}{row['requests_per_s']:>9} req/s  p50 {row['p50_ms']:>9} ms"
+                          f"  p95 {row['p95_ms']:>9} ms  errors {row['error_rate']:.1%}",
+                          file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of results against baseline
+
+    A metric regresses when it is worse than the baseline by more than
+    tolerance (a fraction). Error rates regress when they grow at all.
+    """
+    regressions = []
+    for section in ('micro', 'e2e'):
+        for name, metrics in results.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if not isinstance(metrics, dict) or not isinstance(before, dict):
+                continue
+            for metric, value in metrics.items():
+                old = before.get(metric)
+                if metric in ('loops', 'median_us') or old is None:
+                    continue
+                if metric == 'error_rate':
+                    worse = value > old
+                elif not old:
+                    continue
+                elif metric in LOWER_IS_BETTER:
+                    worse = value > old * (1 + tolerance)
+                else:
+                    worse = value < old * (1 - tolerance)
+                if worse:
+                    regressions.append({'section': section, 'name': name, 'metric': metric,
+                                        'baseline': old, 'current': value,
+                                        'change': round(value / old - 1, 3) if old else None})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks against the local stub ARMS API')
+    parser.add_argument('--only', choices=('micro', 'e2e'), help='Run one part only')
+    parser.add_argument('--scale', type=int, default=4, help='Stub payload size multiplier')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated levels')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route and level')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Stub upstream latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Stub 503 rate')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown before flagging a regression')
+    parser.add_argument('--json', help='Write the results to this file (default: stdout)')
+    args = parser.parse_args()
+
+    os.environ.setdefault('USDA_API_KEY', 'stub')
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': args.scale,
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'workers': args.workers,
+            'requests': args.requests,
+        },
+    }
+    if args.only in (None, 'micro'):
+        print('Microbenchmarks', file=sys.stderr)
+        results['micro'] = run_micro(args.scale)
+    if args.only in (None, 'e2e'):
+        print('End-to-end (gunicorn)', file=sys.stderr)
+        results['e2e'] = run_e2e(args)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        results['regressions'] = []
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+        for item in results['regressions']:
+            change = f" ({item['change']:+.0%})" if item['change'] is not None else ''
+            print(f"REGRESSION {item['section']}/{item['name']} {item['metric']}: "
+                  f"{item['baseline']} -> {item['current']}{change}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,579 @@
+"""
+Persistent response cache for USDA ARMS API results
+Stores upstream JSON so repeat queries survive worker restarts and redeploys,
+and shares it between gunicorn workers and web servers
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+from circuit_breaker import mark_expires
+from metrics import count_cache_lookup
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'cache', 'arms_cache.sqlite3')
+
+# Seconds each endpoint's responses stay fresh. Survey data for past
+# years is effectively immutable; metadata listings change more often.
+DEFAULT_TTLS = {
+    'surveydata': 30 * 24 * 3600,
+    'year': 6 * 3600,
+    'state': 6 * 3600,
+    'report': 6 * 3600,
+    'variable': 6 * 3600,
+    'category': 6 * 3600,
+    'farmtype': 6 * 3600,
+}
+FALLBACK_TTL = 3600
+
+STAT_FIELDS = ('hits', 'misses', 'sets')
+
+
+def _normalize_value(value):
+    """Make list parameters order-independent"""
+    if isinstance(value, (list, tuple, set)):
+        items = {json.dumps(v, sort_keys=True): v for v in value}
+        return [items[k] for k in sorted(items)]
+    return value
+
+
+def normalize_params(params):
+    """
+    Canonical form of a request body
+
+    None-valued parameters and the API key are dropped and list values
+    are de-duplicated and sorted, so logically identical requests map to
+    the same body.
+    """
+    if not params:
+        return {}
+    return {k: _normalize_value(v) for k, v in params.items()
+            if v is not None and k != 'api_key'}
+
+
+def make_cache_key(endpoint, params=None, method='GET'):
+    """Stable hash of endpoint, method and normalized parameters"""
+    payload = json.dumps({
+        'endpoint': endpoint,
+        'method': method,
+        'params': normalize_params(params),
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def ttl_for(endpoint, ttls=None):
+    """TTL for an endpoint, overridable with ARMS_CACHE_TTL_<ENDPOINT>"""
+    override = os.getenv(f"ARMS_CACHE_TTL_{endpoint.upper()}")
+    if override:
+        return int(override)
+    return (ttls or DEFAULT_TTLS).get(endpoint, FALLBACK_TTL)
+
+
+def max_stale_seconds():
+    """How long past expiry an entry may still be served during an outage (ARMS_CACHE_MAX_STALE)"""
+    return float(os.getenv('ARMS_CACHE_MAX_STALE', str(30 * 24 * 3600)))
+
+
+def worker_id():
+    """Identifier of this worker process, unique across the fleet"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CacheBackend:
+    """
+    Storage interface used by ResponseCache
+
+    Backends store opaque compressed bodies with their expiry time; TTL
+    checks happen in ResponseCache.
+    """
+
+    def get(self, key):
+        """Return (body, expires) or None"""
+        raise NotImplementedError
+
+    def set(self, key, endpoint, body, created, expires):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def purge_expired(self, now):
+        """Remove entries that expired before now, returning how many were removed"""
+        raise NotImplementedError
+
+    def add_stats(self, worker, deltas):
+        """Add counter deltas for one worker"""
+        raise NotImplementedError
+
+    def read_stats(self):
+        """Return {worker: {counter: value}} for every worker"""
+        raise NotImplementedError
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Host-local backend shared by every worker on the machine
+
+    The database runs in WAL mode so readers in one worker never block
+    behind a writer in another.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('ARMS_CACHE_PATH', DEFAULT_CACHE_PATH)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' key TEXT PRIMARY KEY,'
+                ' endpoint TEXT NOT NULL,'
+                ' body BLOB NOT NULL,'
+                ' created REAL NOT NULL,'
+                ' expires REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_stats ('
+                ' worker TEXT PRIMARY KEY,'
+                ' hits INTEGER NOT NULL DEFAULT 0,'
+                ' misses INTEGER NOT NULL DEFAULT 0,'
+                ' sets INTEGER NOT NULL DEFAULT 0,'
+                ' updated REAL NOT NULL)'
+            )
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT body, expires FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    def set(self, key, endpoint, body, created, expires):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, endpoint, body, created, expires)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (key, endpoint, body, created, expires)
+            )
+
+    def delete(self, key):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM responses')
+
+    def purge_expired(self, now):
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM responses WHERE expires < ?', (now,))
+        return cursor.rowcount
+
+    def add_stats(self, worker, deltas):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO cache_stats (worker, hits, misses, sets, updated)'
+                ' VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT(worker) DO UPDATE SET'
+                ' hits = hits + excluded.hits,'
+                ' misses = misses + excluded.misses,'
+                ' sets = sets + excluded.sets,'
+                ' updated = excluded.updated',
+                (worker, deltas.get('hits', 0), deltas.get('misses', 0),
+                 deltas.get('sets', 0), time.time())
+            )
+
+    def read_stats(self):
+        rows = self._connect().execute(
+            'SELECT worker, hits, misses, sets FROM cache_stats'
+        ).fetchall()
+        return {row[0]: dict(zip(STAT_FIELDS, row[1:])) for row in rows}
+
+
+class RemoteBackend(CacheBackend):
+    """
+    Network backend speaking the cache_server.py HTTP protocol
+
+    Lets both web servers share one cache. Timeouts are short: an
+    unreachable cache server behaves like a cache miss.
+    """
+
+    def __init__(self, url=None, timeout=None):
+        self.url = (url or os.getenv('ARMS_CACHE_URL', 'http://127.0.0.1:8765')).rstrip('/')
+        self.timeout = timeout or float(os.getenv('ARMS_CACHE_TIMEOUT', '0.5'))
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None or getattr(self._local, 'pid', None) != os.getpid():
+            session = requests.Session()
+            self._local.session = session
+            self._local.pid = os.getpid()
+        return session
+
+    def get(self, key):
+        response = self._session().get(f"{self.url}/entries/{key}", timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content, float(response.headers['X-Cache-Expires'])
+
+    def set(self, key, endpoint, body, created, expires):
+        response = self._session().put(
+            f"{self.url}/entries/{key}", data=body, timeout=self.timeout,
+            headers={
+                'Content-Type': 'application/octet-stream',
+                'X-Cache-Endpoint': endpoint,
+                'X-Cache-Created': repr(created),
+                'X-Cache-Expires': repr(expires),
+            })
+        response.raise_for_status()
+
+    def delete(self, key):
+        self._session().delete(f"{self.url}/entries/{key}", timeout=self.timeout).raise_for_status()
+
+    def clear(self):
+        self._session().delete(f"{self.url}/entries", timeout=self.timeout).raise_for_status()
+
+    def purge_expired(self, now):
+        response = self._session().post(f"{self.url}/purge", json={'now': now},
+                                        timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get('removed', 0)
+
+    def add_stats(self, worker, deltas):
+        self._session().post(f"{self.url}/stats/{worker}", json=deltas,
+                             timeout=self.timeout).raise_for_status()
+
+    def read_stats(self):
+        response = self._session().get(f"{self.url}/stats", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class TieredBackend(CacheBackend):
+    """
+    Host-local SQLite in front of a shared remote backend
+
+    Reads are served locally when possible and remote hits are copied
+    into the local tier; writes go to both. The remote tier is best
+    effort: when the cache server is unreachable the local tier carries on.
+    """
+
+    REMOTE_ERRORS = (requests.exceptions.RequestException, ValueError, KeyError)
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is not None and entry[1] >= time.time():
+            return entry
+        # Missing or expired locally: another server may have refreshed it
+        try:
+            remote_entry = self.remote.get(key)
+        except self.REMOTE_ERRORS:
+            return entry
+        if remote_entry is None or (entry is not None and remote_entry[1] <= entry[1]):
+            return entry
+        body, expires = remote_entry
+        self.local.set(key, '', body, time.time(), expires)
+        return remote_entry
+
+    def set(self, key, endpoint, body, created, expires):
+        self.local.set(key, endpoint, body, created, expires)
+        try:
+            self.remote.set(key, endpoint, body, created, expires)
+        except self.REMOTE_ERRORS:
+            pass
+
+    def delete(self, key):
+        self.local.delete(key)
+        try:
+            self.remote.delete(key)
+        except self.REMOTE_ERRORS:
+            pass
+
+    def clear(self):
+        self.local.clear()
+        try:
+            self.remote.clear()
+        except self.REMOTE_ERRORS:
+            pass
+
+    def purge_expired(self, now):
+        removed = self.local.purge_expired(now)
+        try:
+            removed += self.remote.purge_expired(now)
+        except self.REMOTE_ERRORS:
+            pass
+        return removed
+
+    def add_stats(self, worker, deltas):
+        self.remote.add_stats(worker, deltas)
+
+    def read_stats(self):
+        return self.remote.read_stats()
+
+
+# Failures of either backend (including a malformed answer from the cache
+# server); ResponseCache treats them as misses or skipped writes
+BACKEND_ERRORS = (sqlite3.Error,) + TieredBackend.REMOTE_ERRORS
+
+
+class ResponseCache:
+    """
+    Cache of upstream JSON responses with per-endpoint TTLs
+
+    Hit/miss counters are kept per worker and periodically flushed to the
+    backend so they can be aggregated across the fleet. Entries expired
+    for longer than max_stale_seconds() are purged in the background every
+    ARMS_CACHE_PURGE_INTERVAL seconds (checked on writes).
+    """
+
+    STATS_FLUSH_INTERVAL = 5.0
+    STATS_FLUSH_OPS = 100
+    PURGE_INTERVAL = 3600.0
+
+    def __init__(self, backend=None, ttls=None):
+        self.backend = backend or SQLiteBackend()
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+
+        self._stats_lock = threading.Lock()
+        self._counters = dict.fromkeys(STAT_FIELDS, 0)
+        self._pending = dict.fromkeys(STAT_FIELDS, 0)
+        self._last_flush = time.time()
+
+        self.purge_interval = float(os.getenv('ARMS_CACHE_PURGE_INTERVAL', self.PURGE_INTERVAL))
+        self._purge_lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _count(self, field):
+        with self._stats_lock:
+            self._counters[field] += 1
+            self._pending[field] += 1
+            due = (sum(self._pending.values()) >= self.STATS_FLUSH_OPS
+                   or time.time() - self._last_flush >= self.STATS_FLUSH_INTERVAL)
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Push pending counter deltas to the shared backend"""
+        with self._stats_lock:
+            deltas, self._pending = self._pending, dict.fromkeys(STAT_FIELDS, 0)
+            self._last_flush = time.time()
+        if not any(deltas.values()):
+            return
+        try:
+            self.backend.add_stats(worker_id(), deltas)
+        except BACKEND_ERRORS:
+            # Put the deltas back so they are retried on the next flush
+            with self._stats_lock:
+                for field, value in deltas.items():
+                    self._pending[field] += value
+
+    def get(self, key):
+        """Return the cached response for key, or None if missing or expired"""
+        entry = self.get_with_expiry(key)
+        return entry[0] if entry is not None else None
+
+    def get_with_expiry(self, key):
+        """Return (response, expiry timestamp) for key, or None if missing or expired"""
+        try:
+            entry = self.backend.get(key)
+            if entry is not None and entry[1] >= time.time():
+                entry = json.loads(zlib.decompress(entry[0])), entry[1]
+            else:
+                entry = None
+        except BACKEND_ERRORS + (zlib.error,):
+            entry = None
+
+        if entry is None:
+            self._count('misses')
+            count_cache_lookup('miss')
+            return None
+        self._count('hits')
+        count_cache_lookup('hit')
+        mark_expires(entry[1])
+        return entry
+
+    def get_stale(self, key, max_stale=None):
+        """
+        Return (response, seconds since it expired) even if expired, or None
+
+        Used while ARMS is unavailable; the age is negative for entries
+        that are still fresh. Entries expired for longer than max_stale
+        (ARMS_CACHE_MAX_STALE) are not returned. Not counted in the
+        statistics.
+        """
+        if max_stale is None:
+            max_stale = max_stale_seconds()
+        try:
+            entry = self.backend.get(key)
+            if entry is None:
+                return None
+            age = time.time() - entry[1]
+            if age > max_stale:
+                return None
+            return json.loads(zlib.decompress(entry[0])), age
+        except BACKEND_ERRORS + (zlib.error,):
+            return None
+
+    def set(self, key, endpoint, value, ttl=None):
+        """Store a response under key"""
+        if ttl is None:
+            ttl = ttl_for(endpoint, self.ttls)
+        now = time.time()
+        body = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        try:
+            self.backend.set(key, endpoint, body, now, now + ttl)
+        except BACKEND_ERRORS:
+            # A cache write failure must never fail the request
+            return
+        self._count('sets')
+        mark_expires(now + ttl)
+        self._maybe_purge(now)
+
+    def get_raw(self, key):
+        """
+        Return bytes stored with set_raw, or None
+
+        Raw entries hold derived artifacts (e.g. the query planner index)
+        and are not counted in the hit/miss statistics.
+        """
+        try:
+            entry = self.backend.get(key)
+        except BACKEND_ERRORS:
+            return None
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def set_raw(self, key, endpoint, body, ttl=None):
+        """Store bytes as-is under key"""
+        if ttl is None:
+            ttl = ttl_for(endpoint, self.ttls)
+        now = time.time()
+        try:
+            self.backend.set(key, endpoint, body, now, now + ttl)
+        except BACKEND_ERRORS:
+            return
+        self._maybe_purge(now)
+
+    def delete(self, key):
+        try:
+            self.backend.delete(key)
+        except BACKEND_ERRORS:
+            pass
+
+    def purge_expired(self):
+        """Remove expired entries, returning how many were deleted"""
+        return self.backend.purge_expired(time.time())
+
+    def _maybe_purge(self, now):
+        # At most one purge per interval per worker, off the request thread
+        if now - self._last_purge < self.purge_interval:
+            return
+        with self._purge_lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        threading.Thread(target=self._purge_quietly, name='arms-cache-purge', daemon=True).start()
+
+    def _purge_quietly(self):
+        # Entries stay servable by get_stale for max_stale after they expire
+        try:
+            self.backend.purge_expired(time.time() - max_stale_seconds())
+        except BACKEND_ERRORS:
+            pass
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Hit/miss counters for this worker, every worker and the aggregate"""
+        self.flush_stats()
+        with self._stats_lock:
+            local = dict(self._counters)
+        try:
+            workers = self.backend.read_stats()
+        except BACKEND_ERRORS:
+            workers = {}
+
+        aggregate = dict.fromkeys(STAT_FIELDS, 0)
+        for counters in workers.values():
+            for field in STAT_FIELDS:
+                aggregate[field] += counters.get(field, 0)
+
+        return {
+            'worker': dict(local, id=worker_id(), hit_ratio=_hit_ratio(local)),
+            'workers': workers,
+            'aggregate': dict(aggregate, hit_ratio=_hit_ratio(aggregate)),
+        }
+
+
+def _hit_ratio(counters):
+    lookups = counters['hits'] + counters['misses']
+    return round(counters['hits'] / lookups, 4) if lookups else None
+
+
+def backend_from_env():
+    """
+    Build the cache backend selected by ARMS_CACHE_BACKEND
+
+    sqlite (default): shared by all workers on this host
+    remote: shared by every web server via ARMS_CACHE_URL
+    tiered: host-local SQLite in front of the remote backend
+    """
+    kind = os.getenv('ARMS_CACHE_BACKEND', 'sqlite').lower()
+    if kind == 'remote':
+        return RemoteBackend()
+    if kind == 'tiered':
+        return TieredBackend(SQLiteBackend(), RemoteBackend())
+    return SQLiteBackend()
+
+
+def cache_from_env():
+    """Build the response cache unless disabled with ARMS_CACHE_ENABLED=0"""
+    if os.getenv('ARMS_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+        return None
+    return ResponseCache(backend_from_env())
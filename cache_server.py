@@ -0,0 +1,171 @@
+"""
+Stand-in shared cache server for the ARMS response cache
+Implements the HTTP protocol used by cache.RemoteBackend, for local
+development and tests of multi-server deployments
+
+Usage:
+    python cache_server.py --port 8765 [--path cache/shared.sqlite3]
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import STAT_FIELDS, SQLiteBackend, CacheBackend
+
+
+class MemoryBackend(CacheBackend):
+    """In-process dict storage used when the server runs without --path"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[1], entry[3]
+
+    def set(self, key, endpoint, body, created, expires):
+        with self._lock:
+            self._entries[key] = (endpoint, body, created, expires)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def purge_expired(self, now):
+        with self._lock:
+            expired = [k for k, v in self._entries.items() if v[3] < now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def add_stats(self, worker, deltas):
+        with self._lock:
+            counters = self._stats.setdefault(worker, dict.fromkeys(STAT_FIELDS, 0))
+            for field in STAT_FIELDS:
+                counters[field] += int(deltas.get(field, 0))
+
+    def read_stats(self):
+        with self._lock:
+            return {worker: dict(counters) for worker, counters in self._stats.items()}
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end over a CacheBackend"""
+
+    protocol_version = 'HTTP/1.1'
+    backend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload, status=200):
+        self._send(status, json.dumps(payload).encode('utf-8'))
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _entry_key(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'entries':
+            return parts[1]
+        return None
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self._send_json(self.backend.read_stats())
+
+        key = self._entry_key()
+        if key is None:
+            return self._send_json({'error': 'not found'}, 404)
+        entry = self.backend.get(key)
+        if entry is None:
+            return self._send_json({'error': 'not found'}, 404)
+        body, expires = entry
+        self._send(200, body, 'application/octet-stream', {'X-Cache-Expires': repr(expires)})
+
+    def do_PUT(self):
+        key = self._entry_key()
+        if key is None:
+            return self._send_json({'error': 'not found'}, 404)
+        body = self._read_body()
+        created = float(self.headers.get('X-Cache-Created', time.time()))
+        self.backend.set(key, self.headers.get('X-Cache-Endpoint', ''), body,
+                         created, float(self.headers['X-Cache-Expires']))
+        self._send(204)
+
+    def do_DELETE(self):
+        if self.path.rstrip('/') == '/entries':
+            self.backend.clear()
+            return self._send(204)
+        key = self._entry_key()
+        if key is None:
+            return self._send_json({'error': 'not found'}, 404)
+        self.backend.delete(key)
+        self._send(204)
+
+    def do_POST(self):
+        payload = json.loads(self._read_body() or b'{}')
+        if self.path == '/purge':
+            removed = self.backend.purge_expired(payload.get('now', time.time()))
+            return self._send_json({'removed': removed})
+        if self.path.startswith('/stats/'):
+            self.backend.add_stats(self.path[len('/stats/'):], payload)
+            return self._send(204)
+        self._send_json({'error': 'not found'}, 404)
+
+
+def make_server(host='127.0.0.1', port=8765, backend=None):
+    """Create (but do not start) a cache server; port 0 picks a free port"""
+    handler = type('BoundCacheRequestHandler', (CacheRequestHandler,),
+                   {'backend': backend or MemoryBackend()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_background_server(host='127.0.0.1', port=0, backend=None):
+    """Start a server on a daemon thread and return it (useful in tests)"""
+    server = make_server(host, port, backend)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared ARMS response cache server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', help='SQLite file to persist entries (default: in memory)')
+    args = parser.parse_args()
+
+    backend = SQLiteBackend(args.path) if args.path else MemoryBackend()
+    server = make_server(args.host, args.port, backend)
+    print(f"ARMS cache server listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Record/replay transport for the USDA ARMS API
+In record mode every upstream request and response is captured in a
+compressed SQLite cassette; in replay mode responses are served from it
+without touching the network, and requests it doesn't hold are logged as
+misses. Select with ARMS_TRANSPORT=record or ARMS_TRANSPORT=replay.
+
+Usage:
+    ARMS_TRANSPORT=record python app.py      # use the app normally to fill the cassette
+    ARMS_TRANSPORT=replay python app.py      # same app, no network
+    python cassette.py info
+    python cassette.py misses
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from cache import make_cache_key, normalize_params
+from http_session import RETRY_STATUS_CODES
+
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+DEFAULT_CASSETTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'cassettes', 'arms.cassette')
+
+# Served for requests the cassette doesn't hold; 404 so clients don't retry
+MISS_STATUS = 404
+
+
+def request_key(method, url, body=None):
+    """
+    (key, endpoint, params) for a request
+
+    Query and JSON body parameters are merged and normalized the same way
+    as response cache keys, minus the API key, so key order, list order
+    and the base URL host don't matter.
+    """
+    parts = urlsplit(url)
+    params = {}
+    for name, value in parse_qsl(parts.query):
+        if name in params:
+            previous = params[name]
+            params[name] = (previous if isinstance(previous, list) else [previous]) + [value]
+        else:
+            params[name] = value
+    if body:
+        try:
+            decoded = json.loads(body)
+        except ValueError:
+            decoded = None
+        if isinstance(decoded, dict):
+            params.update(decoded)
+        else:
+            params['_body'] = body.decode('utf-8', 'replace') if isinstance(body, bytes) else body
+    params = normalize_params(params)
+    endpoint = parts.path.rstrip('/').rsplit('/', 1)[-1]
+    return make_cache_key(endpoint, params, method.upper()), endpoint, params
+
+
+class Cassette:
+    """
+    Recorded interactions in one SQLite file, bodies zlib-compressed
+
+    Safe to share between threads and worker processes, so a gunicorn
+    deployment can record or replay through one cassette.
+    """
+
+    def __init__(self, path=None, mode=REPLAY):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Cassette mode must be {RECORD} or {REPLAY}")
+        self.path = path or os.getenv('ARMS_CASSETTE_PATH', DEFAULT_CASSETTE_PATH)
+        self.mode = mode
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        self._ensure_schema()
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS interactions ('
+                ' key TEXT PRIMARY KEY,'
+                ' method TEXT NOT NULL,'
+                ' endpoint TEXT NOT NULL,'
+                ' params TEXT NOT NULL,'
+                ' status INTEGER NOT NULL,'
+                ' content_type TEXT,'
+                ' body BLOB NOT NULL,'
+                ' recorded REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS misses ('
+                ' key TEXT PRIMARY KEY,'
+                ' method TEXT NOT NULL,'
+                ' endpoint TEXT NOT NULL,'
+                ' params TEXT NOT NULL,'
+                ' count INTEGER NOT NULL,'
+                ' first_seen REAL NOT NULL,'
+                ' last_seen REAL NOT NULL)'
+            )
+
+    def get(self, key):
+        """(status, content type, body bytes) recorded for key, or None"""
+        row = self._connect().execute(
+            'SELECT status, content_type, body FROM interactions WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], zlib.decompress(row[2])
+
+    def put(self, key, method, endpoint, params, status, content_type, body):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO interactions'
+                ' (key, method, endpoint, params, status, content_type, body, recorded)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, method, endpoint, json.dumps(params, sort_keys=True), status,
+                 content_type, zlib.compress(body, 6), time.time())
+            )
+            # A request that was missing is now covered
+            conn.execute('DELETE FROM misses WHERE key = ?', (key,))
+
+    def record_miss(self, key, method, endpoint, params):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO misses (key, method, endpoint, params, count, first_seen, last_seen)'
+                ' VALUES (?, ?, ?, ?, 1, ?, ?)'
+                ' ON CONFLICT(key) DO UPDATE SET count = count + 1, last_seen = excluded.last_seen',
+                (key, method, endpoint, json.dumps(params, sort_keys=True), now, now)
+            )
+
+    def misses(self):
+        """Requests replay couldn't answer, most frequent first"""
+        rows = self._connect().execute(
+            'SELECT method, endpoint, params, count, first_seen, last_seen FROM misses'
+            ' ORDER BY count DESC, last_seen DESC'
+        ).fetchall()
+        return [{'method': row[0], 'endpoint': row[1], 'params': json.loads(row[2]),
+                 'count': row[3], 'first_seen': row[4], 'last_seen': row[5]} for row in rows]
+
+    def clear_misses(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM misses')
+
+    def info(self):
+        conn = self._connect()
+        endpoints = conn.execute(
+            'SELECT endpoint, COUNT(*), SUM(LENGTH(body)) FROM interactions GROUP BY endpoint'
+        ).fetchall()
+        missed = conn.execute('SELECT COUNT(*), COALESCE(SUM(count), 0) FROM misses').fetchone()
+        return {
+            'path': self.path,
+            'mode': self.mode,
+            'interactions': sum(row[1] for row in endpoints),
+            'compressed_bytes': sum(row[2] or 0 for row in endpoints),
+            'endpoints': {row[0]: row[1] for row in endpoints},
+            'missed_requests': missed[0],
+            'missed_calls': missed[1],
+        }
+
+    def lookup(self, method, url, body=None):
+        """
+        Replay a request: (status, content type, body), or a miss response
+
+        Misses are recorded for the report and answered with a 404 JSON
+        error, which clients surface without retrying.
+        """
+        key, endpoint, params = request_key(method, url, body)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        self.record_miss(key, method.upper(), endpoint, params)
+        error = {'error': f"No recording for {method.upper()} {endpoint} in cassette {self.path}"}
+        return MISS_STATUS, 'application/json', json.dumps(error).encode('utf-8')
+
+    def capture(self, method, url, body, status, content_type, content):
+        """Record a live response; retryable failures are left out so replay doesn't repeat them"""
+        if status in RETRY_STATUS_CODES:
+            return
+        key, endpoint, params = request_key(method, url, body)
+        self.put(key, method.upper(), endpoint, params, status, content_type, content)
+
+    def adapter(self, live_adapter):
+        """requests transport adapter: replay from, or record live_adapter's traffic into, this cassette"""
+        return CassetteAdapter(self, live_adapter)
+
+    def async_transport(self, live_transport):
+        """httpx transport counterpart of adapter() for AsyncUSDAClient"""
+        # httpx is only imported by processes that use the async client
+        from async_client import CassetteTransport
+        return CassetteTransport(self, live_transport)
+
+
+class CassetteAdapter(BaseAdapter):
+    """requests adapter in front of the pooled HTTPAdapter"""
+
+    def __init__(self, cassette, live_adapter):
+        super().__init__()
+        self.cassette = cassette
+        self.live = live_adapter
+
+    def send(self, request, **kwargs):
+        if self.cassette.replaying:
+            status, content_type, content = self.cassette.lookup(request.method, request.url,
+                                                                 request.body)
+            return self._build_response(request, status, content_type, content)
+
+        response = self.live.send(request, **kwargs)
+        content = response.content
+        self.cassette.capture(request.method, request.url, request.body, response.status_code,
+                              response.headers.get('Content-Type'), content)
+        return response
+
+    def _build_response(self, request, status, content_type, content):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({'Content-Type': content_type or 'application/json',
+                                                'Content-Length': str(len(content))})
+        response._content = content
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK' if status < 400 else 'Not Recorded'
+        return response
+
+    def close(self):
+        self.live.close()
+
+
+def cassette_from_env():
+    """Cassette for ARMS_TRANSPORT=record or replay, else None (live API)"""
+    mode = os.getenv('ARMS_TRANSPORT', '').lower()
+    if mode in ('', 'live', 'off'):
+        return None
+    return Cassette(mode=mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ARMS record/replay cassette')
+    parser.add_argument('--path', help='Cassette file (default: ARMS_CASSETTE_PATH or cassettes/arms.cassette)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help='What the cassette holds')
+    misses_parser = commands.add_parser('misses', help='Requests replay could not answer')
+    misses_parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    misses_parser.add_argument('--clear', action='store_true', help='Reset the report afterwards')
+    args = parser.parse_args()
+
+    cassette = Cassette(args.path)
+    if args.command == 'info':
+        print(json.dumps(cassette.info(), indent=2))
+    elif args.command == 'misses':
+        misses = cassette.misses()
+        if args.json:
+            print(json.dumps(misses, indent=2))
+        elif not misses:
+            print('No misses recorded')
+        else:
+            print(f"{'count':>6}  {'method':<6} {'endpoint':<12} params")
+            for miss in misses:
+                print(f"{miss['count']:>6}  {miss['method']:<6} {miss['endpoint']:<12} "
+                      f"{json.dumps(miss['params'], sort_keys=True)}")
+        if args.clear:
+            cassette.clear_misses()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Circuit breaker for the USDA ARMS API
+Stops sending requests to ARMS after repeated timeouts or 5xx responses,
+probes for recovery in the background, and tracks which responses of the
+current request were served stale from the cache meanwhile
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from forksafe import reset_after_fork
+from rate_governor import priority
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+_staleness = contextvars.ContextVar('arms_staleness', default=None)
+
+
+def track_staleness():
+    """
+    Start recording stale responses for the current request
+
+    Returns the dict that mark_stale() and mark_expires() update. Work
+    submitted to other threads with contextvars.copy_context().run
+    updates the same dict.
+    """
+    holder = {'stale': False, 'age': 0, 'expires': None}
+    _staleness.set(holder)
+    return holder
+
+
+def mark_stale(age):
+    """Note that the current request used a response that expired age seconds ago"""
+    holder = _staleness.get()
+    if holder is not None:
+        holder['stale'] = True
+        holder['age'] = max(holder['age'], int(age))
+
+
+def served_stale():
+    """True if the current request has used a stale response so far"""
+    holder = _staleness.get()
+    return bool(holder and holder['stale'])
+
+
+def mark_expires(expires):
+    """Note that the current request used a cached response fresh until expires"""
+    holder = _staleness.get()
+    if holder is not None and (holder['expires'] is None or expires < holder['expires']):
+        holder['expires'] = expires
+
+
+def fresh_until():
+    """When the first cached response the current request used expires, or None if unknown"""
+    holder = _staleness.get()
+    return holder['expires'] if holder else None
+
+
+class CircuitBreaker:
+    """
+    Fail fast while ARMS is down
+
+    After failure_threshold consecutive upstream failures the circuit
+    opens and allow() returns False, so callers answer from stale cache
+    entries or error out at once instead of waiting for timeouts. A
+    background thread then probes ARMS every reset_timeout seconds
+    (backing off to max_reset_timeout); the first successful probe closes
+    the circuit and re-fetches the responses that were served stale.
+    """
+
+    def __init__(self, probe, failure_threshold=None, reset_timeout=None,
+                 max_reset_timeout=None, max_refreshes=None):
+        self.probe = probe
+        self.failure_threshold = failure_threshold or int(os.getenv('ARMS_BREAKER_FAILURES', '5'))
+        self.reset_timeout = reset_timeout or float(os.getenv('ARMS_BREAKER_RESET', '15'))
+        self.max_reset_timeout = max_reset_timeout or float(os.getenv('ARMS_BREAKER_MAX_RESET', '120'))
+        self.max_refreshes = max_refreshes or int(os.getenv('ARMS_BREAKER_REFRESHES', '256'))
+        self._reset()
+
+        reset_after_fork(self, '_reset')
+
+    def _reset(self):
+        # The probe thread doesn't survive fork; each worker tracks ARMS itself
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+        self._refreshes = OrderedDict()
+        self._prober = None
+
+    def allow(self):
+        """True if a request may go upstream now"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.failures or self.state != CLOSED:
+            with self._lock:
+                self.failures = 0
+
+    def record_failure(self):
+        """Count a timeout, connection error or 5xx; opens the circuit at the threshold"""
+        with self._lock:
+            self.failures += 1
+            if self.state == CLOSED and self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+                self._start_prober()
+
+    def refresh_later(self, key, refresh):
+        """Re-run refresh() once ARMS is back (latest refresh per key wins)"""
+        with self._lock:
+            self._refreshes[key] = refresh
+            self._refreshes.move_to_end(key)
+            while len(self._refreshes) > self.max_refreshes:
+                self._refreshes.popitem(last=False)
+
+    def _start_prober(self):
+        if self._prober is None or not self._prober.is_alive():
+            self._prober = threading.Thread(target=self._probe_loop, name='arms-breaker-probe',
+                                            daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        delay = self.reset_timeout
+        with priority('background'):
+            while True:
+                time.sleep(delay)
+                try:
+                    healthy = self.probe()
+                except Exception:
+                    healthy = False
+                if healthy:
+                    break
+                delay = min(delay * 2, self.max_reset_timeout)
+
+            with self._lock:
+                self.state = CLOSED
+                self.failures = 0
+                self.opened_at = None
+                refreshes, self._refreshes = list(self._refreshes.values()), OrderedDict()
+            for refresh in refreshes:
+                if self.state != CLOSED:
+                    break
+                try:
+                    refresh()
+                except Exception:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'open_for_s': round(time.time() - self.opened_at, 1) if self.opened_at else 0,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'pending_refreshes': len(self._refreshes),
+            }
+
+
+def breaker_from_env(probe):
+    """Breaker around probe unless disabled with ARMS_BREAKER_ENABLED=0"""
+    if os.getenv('ARMS_BREAKER_ENABLED', '1').lower() in ('0', 'false', 'no'):
+        return None
+    return CircuitBreaker(probe)
@@ -4,6 +4,7 @@ Command-line interface for analyzing USDA ARMS data
 """
 
 from api_client import USDAClient
+from survey_frame import SurveyFrame
 import sys
 from tabulate import tabulate
 
@@ -80,17 +81,13 @@ class FarmCLI:
         print(f" {title}")
         print("=" * 70)
         
-        # Get headers and rows
-        headers = list(data['data'][0].keys())
-        rows = []
-        
-        for item in data['data']:
-            row = [self.format_value(item.get(h)) for h in headers]
-            rows.append(row)
+        # Build the columnar frame once; headers and rows come from its columns
+        frame = SurveyFrame.from_response(data)
+        rows = frame.to_rows(formatter=self.format_value)
         
         # Display table
-        print(tabulate(rows, headers=headers, tablefmt='grid'))
-        print(f"\nTotal Records: {len(data['data'])}")
+        print(tabulate(rows, headers=frame.columns, tablefmt='grid'))
+        print(f"\nTotal Records: {len(frame)}")
         print("=" * 70 + "\n")
     
     def format_value(self, value):
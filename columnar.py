@@ -0,0 +1,291 @@
+"""
+Columnar, dictionary-encoded JSON wire format for API responses
+Surveydata rows repeat the same report, state, category and variable
+strings; sent column by column with each string stored once, a response is
+a fraction of the size and faster to parse. Opt in per request with
+Accept: application/vnd.arms.columnar+json or ?format=columnar; everyone
+else keeps getting row-oriented JSON.
+
+Usage:
+    python columnar.py --scale 1,4,16       # size and parse time vs row JSON
+"""
+
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import time
+
+from flask import request
+from flask.json.provider import JSONProvider
+
+
+MIMETYPE = 'application/vnd.arms.columnar+json'
+FORMAT = 'arms-columnar/1'
+QUERY_PARAM = 'format'
+
+# Dictionary-encode a string column when it has at most this share of distinct values
+MAX_DISTINCT_RATIO = 0.5
+
+
+def _accepted_types(accept):
+    """Media range -> q-value from an Accept header"""
+    accepted = {}
+    for part in (accept or '').split(','):
+        pieces = part.strip().split(';')
+        media_range = pieces[0].strip().lower()
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_range] = quality
+    return accepted
+
+
+def accepts_columnar(accept):
+    """
+    True if an Accept header asks for the columnar format
+
+    Only an explicit entry counts (wildcards keep meaning row JSON), and
+    it has to be acceptable (q > 0) and not ranked below application/json.
+    """
+    accepted = _accepted_types(accept)
+    quality = accepted.get(MIMETYPE, 0)
+    if quality <= 0:
+        return False
+    json_quality = accepted.get('application/json', accepted.get('application/*',
+                                                                 accepted.get('*/*', 0)))
+    return quality >= json_quality
+
+
+def wants_columnar():
+    """True if the current request asked for the columnar format"""
+    if request.args.get(QUERY_PARAM, '').lower() == 'columnar':
+        return True
+    return accepts_columnar(request.headers.get('Accept'))
+
+
+def _encodable(obj):
+    """The row list to encode, or None if obj has no uniform 'data' rows"""
+    if not isinstance(obj, dict):
+        return None
+    rows = obj.get('data')
+    if not isinstance(rows, list) or not rows or not isinstance(rows[0], dict):
+        return None
+    keys = rows[0].keys()
+    # Every row must have the same fields, or decoding couldn't restore them
+    if not all(isinstance(row, dict) and row.keys() == keys for row in rows):
+        return None
+    return rows
+
+
+def _encode_column(values):
+    kinds = {type(v) for v in values}
+    kinds.discard(type(None))
+    if kinds <= {int}:
+        return {'type': 'int', 'values': values}
+    if kinds <= {int, float}:
+        return {'type': 'float', 'values': values}
+    if kinds <= {str}:
+        codes = {}
+        encoded = [codes.setdefault(v, len(codes)) for v in values]
+        if len(codes) <= len(values) * MAX_DISTINCT_RATIO:
+            return {'type': 'dict', 'dict': list(codes), 'codes': encoded}
+        return {'type': 'str', 'values': values}
+    return {'type': 'json', 'values': values}
+
+
+def encode(obj):
+    """
+    obj with its 'data' rows replaced by a columnar block, or None if not applicable
+
+        {"data": {"format": "arms-columnar/1", "rows": 2, "columns": {
+            "year":  {"type": "int", "values": [2020, 2021]},
+            "state": {"type": "dict", "dict": ["Iowa"], "codes": [0, 0]}, ...}},
+         "page": {...}}
+
+    Other top-level fields are kept as they are. Missing values stay null
+    (in dictionary columns, null is a dictionary entry).
+    """
+    rows = _encodable(obj)
+    if rows is None:
+        return None
+    columns = {name: _encode_column([row[name] for row in rows]) for name in rows[0]}
+    return dict(obj, data={'format': FORMAT, 'rows': len(rows), 'columns': columns})
+
+
+def decode(obj):
+    """Inverse of encode(): obj with 'data' back as a list of row dicts"""
+    block = obj.get('data') if isinstance(obj, dict) else None
+    if not isinstance(block, dict) or block.get('format') != FORMAT:
+        return obj
+    names = list(block['columns'])
+    lists = []
+    for name in names:
+        column = block['columns'][name]
+        if column['type'] == 'dict':
+            dictionary = column['dict']
+            lists.append([dictionary[code] for code in column['codes']])
+        else:
+            lists.append(column['values'])
+    return dict(obj, data=[dict(zip(names, values)) for values in zip(*lists)])
+
+
+class ColumnarJSONProvider(JSONProvider):
+    """
+    Wraps the app's JSON provider: jsonify() answers in the columnar
+    format when the request asks for it and the response has uniform rows
+    """
+
+    def __init__(self, app, inner):
+        super().__init__(app)
+        self.inner = inner
+
+    def dumps(self, obj, **kwargs):
+        return self.inner.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return self.inner.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if len(args) != 1 or kwargs or _encodable(args[0]) is None:
+            return self.inner.response(*args, **kwargs)
+        if wants_columnar():
+            response = self.inner.response(encode(args[0]))
+            response.mimetype = MIMETYPE
+        else:
+            response = self.inner.response(*args)
+        # The same URL has two representations
+        response.vary.add('Accept')
+        return response
+
+
+def init_app(app):
+    """Offer the columnar format on every jsonify() response with row data"""
+    app.json = ColumnarJSONProvider(app, app.json)
+
+
+def _best_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(min(timings), 3)
+
+
+# Times JSON.parse (plus decodeColumnar for the columnar body) in node, using
+# the decoder from static/js/main.js
+_NODE_SCRIPT = r"""
+const fs = require('fs');
+const vm = require('vm');
+const context = {document: {addEventListener() {}}, performance, console};
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(process.argv[1], 'utf8'), context);
+const rows = fs.readFileSync(process.argv[2], 'utf8');
+const columnar = fs.readFileSync(process.argv[3], 'utf8');
+const repeat = Number(process.argv[4]);
+function best(fn) {
+    let min = Infinity;
+    for (let i = 0; i < repeat; i++) {
+        const start = performance.now();
+        fn();
+        min = Math.min(min, performance.now() - start);
+    }
+    return Math.round(min * 1000) / 1000;
+}
+console.log(JSON.stringify({
+    rows_ms: best(() => JSON.parse(rows)),
+    columnar_ms: best(() => context.decodeColumnar(JSON.parse(columnar))),
+}));
+"""
+
+
+def _node_parse_times(rows_body, columnar_body, repeat):
+    """Browser-side parse times via node, or None if node isn't installed"""
+    import shutil
+    import tempfile
+
+    node = shutil.which('node')
+    if not node:
+        return None
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for name, body in (('rows.json', rows_body), ('columnar.json', columnar_body)):
+            path = os.path.join(workdir, name)
+            with open(path, 'wb') as f:
+                f.write(body)
+            paths.append(path)
+        output = subprocess.run(
+            [node, '-e', _NODE_SCRIPT, os.path.join(here, 'static', 'js', 'main.js'),
+             *paths, str(repeat)],
+            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def measure(response, repeat=5):
+    """Sizes (raw and gzip) and encode/parse times of row JSON vs columnar for one response"""
+    rows_body = json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    columnar_body = json.dumps(encode(response), sort_keys=True,
+                               separators=(',', ':')).encode('utf-8')
+    assert decode(json.loads(columnar_body)) == json.loads(rows_body)
+
+    result = {
+        'rows': len(response['data']),
+        'bytes': {'rows': len(rows_body), 'columnar': len(columnar_body)},
+        'gzip_bytes': {'rows': len(gzip.compress(rows_body, 6)),
+                       'columnar': len(gzip.compress(columnar_body, 6))},
+        'python_serialize_ms': {
+            'rows': _best_ms(lambda: json.dumps(response, sort_keys=True), repeat),
+            'columnar': _best_ms(lambda: json.dumps(encode(response), sort_keys=True), repeat),
+        },
+        'python_parse_ms': {
+            'rows': _best_ms(lambda: json.loads(rows_body), repeat),
+            'columnar': _best_ms(lambda: decode(json.loads(columnar_body)), repeat),
+        },
+    }
+    node_times = _node_parse_times(rows_body, columnar_body, repeat * 4)
+    if node_times:
+        result['js_parse_ms'] = {'rows': node_times['rows_ms'],
+                                 'columnar': node_times['columnar_ms']}
+    return result
+
+
+def main():
+    from stub_arms import build_survey_rows
+
+    parser = argparse.ArgumentParser(description='Columnar vs row JSON for surveydata responses')
+    parser.add_argument('--scale', default='1,4,16', help='Comma-separated stub payload scales')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='Print the measurements as JSON')
+    args = parser.parse_args()
+
+    body = {'year': [2021, 2022], 'state': ['all'], 'report': ['Farm Business Income Statement']}
+    results = [measure({'data': build_survey_rows(body, int(scale))}, args.repeat)
+               for scale in args.scale.split(',')]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'rows':>7}{'KB rows':>10}{'KB col':>9}{'gz rows':>9}{'gz col':>8}"
+          f"{'py ser r/c ms':>17}{'py parse r/c ms':>19}{'js parse r/c ms':>19}")
+    for r in results:
+        js = r.get('js_parse_ms')
+        js_text = f"{js['rows']:.2f}/{js['columnar']:.2f}" if js else 'n/a'
+        print(f"{r['rows']:>7}{r['bytes']['rows'] / 1024:>10.1f}{r['bytes']['columnar'] / 1024:>9.1f}"
+              f"{r['gzip_bytes']['rows'] / 1024:>9.1f}{r['gzip_bytes']['columnar'] / 1024:>8.1f}"
+              f"{r['python_serialize_ms']['rows']:>9.2f}/{r['python_serialize_ms']['columnar']:<7.2f}"
+              f"{r['python_parse_ms']['rows']:>11.2f}/{r['python_parse_ms']['columnar']:<7.2f}"
+              f"{js_text:>19}")
+
+
+if __name__ == '__main__':
+    main()
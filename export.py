@@ -0,0 +1,129 @@
+"""
+Streaming export of surveydata pulls as NDJSON or CSV
+Rows are fetched one year at a time and written out as they arrive, so a
+worker only ever holds a couple of years of a pull in memory
+"""
+
+import csv
+import io
+import json
+
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Rows serialized per yielded chunk
+CHUNK_ROWS = 500
+
+
+class ExportError(Exception):
+    """Upstream error raised while streaming an export"""
+
+
+def parse_years(value):
+    """Years from a list, a single year, or a '2015-2023' / '2015,2018' string"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        return [int(y) for y in value]
+    if isinstance(value, int):
+        return [value]
+    years = []
+    for part in str(value).split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            years.extend(range(int(start), int(end) + 1))
+        elif part:
+            years.append(int(part))
+    return years
+
+
+def iter_year_responses(client, years, lookahead=2, **filters):
+    """
+    Yield surveydata responses one year at a time, in year order
+
+    Up to lookahead years are fetched ahead on the client's shard pool, so
+    the next year is usually ready when the previous one has been written.
+    Each year is its own cached request.
+    """
+    years = sorted(set(years))
+    pending = []
+    for year in years:
+        pending.append(client._submit(client.get_survey_data, years=[year], **filters))
+        if len(pending) > lookahead:
+            yield pending.pop(0).result()
+    while pending:
+        yield pending.pop(0).result()
+
+
+def iter_rows(responses):
+    """Flatten responses into rows, raising ExportError on the first error"""
+    for response in responses:
+        if 'error' in response:
+            raise ExportError(response['error'])
+        for row in response.get('data') or []:
+            yield row
+
+
+def ndjson_chunks(rows):
+    """One JSON object per line"""
+    buffer = []
+    try:
+        for row in rows:
+            buffer.append(json.dumps(row, separators=(',', ':')))
+            if len(buffer) >= CHUNK_ROWS:
+                yield '\n'.join(buffer) + '\n'
+                buffer = []
+    except ExportError as e:
+        buffer.append(json.dumps({'error': str(e)}))
+    if buffer:
+        yield '\n'.join(buffer) + '\n'
+
+
+def csv_chunks(rows):
+    """CSV with a header taken from the first row's fields"""
+    out = io.StringIO()
+    writer = None
+    count = 0
+    try:
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=list(row.keys()), extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(row)
+            count += 1
+            if count % CHUNK_ROWS == 0:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+    except ExportError as e:
+        # CSV has no error channel; end with a marker line readers can spot
+        out.write(f"# error: {e}\n")
+    if out.tell():
+        yield out.getvalue()
+
+
+def export_chunks(client, years, fmt='ndjson', **filters):
+    """
+    Generator of text chunks for an export
+
+    The first year is fetched before the generator is returned, so an
+    upstream error can still be answered with an error status instead of
+    a half-written stream. Raises ExportError in that case.
+    """
+    responses = iter_year_responses(client, years, **filters)
+    first = next(responses, None)
+    if first is not None and 'error' in first:
+        raise ExportError(first['error'])
+
+    def all_responses(head):
+        # Pop rather than hold on to the first year for the whole stream
+        while head:
+            yield head.pop()
+        yield from responses
+
+    writer = csv_chunks if fmt == 'csv' else ndjson_chunks
+    return writer(iter_rows(all_responses([first] if first is not None else [])))
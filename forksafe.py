@@ -0,0 +1,28 @@
+"""
+After-fork resets for per-process state
+Objects holding sessions, locks or thread state that a forked worker must
+not share with its parent register here; one hook resets every live one
+in the child. Registration holds only a weak reference, so instances made
+in tests or benchmarks are freed as usual.
+"""
+
+import os
+import weakref
+
+
+# Live instance -> name of the method that resets it in a forked child
+_instances = weakref.WeakKeyDictionary()
+
+
+def reset_after_fork(instance, method):
+    """Call instance.<method>() in every child forked while instance is alive"""
+    _instances[instance] = method
+
+
+def _after_fork():
+    for instance, method in list(_instances.items()):
+        getattr(instance, method)()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,58 @@
+"""
+Gunicorn settings for the Farm Financial Intelligence Platform
+Picked up automatically when gunicorn is started from the project directory:
+
+    gunicorn --workers 3 --bind 0.0.0.0:5000 wsgi:app
+
+Each worker keeps its own Prometheus metrics; they are written to
+PROMETHEUS_MULTIPROC_DIR so /metrics on any worker reports all of them.
+
+The app is imported once in the master (ARMS_PRELOAD=0 to import it in
+each worker instead, e.g. for code reloads on HUP), together with pandas
+and the other heavy modules, so workers fork ready to serve and share
+those pages copy-on-write. When there is no metadata snapshot yet, the master
+also fetches the lookup listings first (ARMS_PRELOAD_CATALOG_TIMEOUT seconds
+at most).
+"""
+
+import os
+import shutil
+import tempfile
+
+
+# Must be set before the workers import prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'arms-prometheus'))
+
+preload_app = os.getenv('ARMS_PRELOAD', '1').lower() not in ('0', 'false', 'no')
+
+
+def on_starting(server):
+    """Drop metric files left by a previous run; counters start from zero"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Stop counting a dead worker's in-flight gauges"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    """Runs in the master before the first worker is forked"""
+    if server.cfg.preload_app:
+        import app
+        import startup
+        # Without a snapshot, workers would otherwise start with empty listings
+        startup.preload_catalog(app.catalog)
+        startup.preload()
+
+
+def post_worker_init(worker):
+    """Log how long this worker took to become ready"""
+    import startup
+    import structured_log
+    startup.mark_ready('worker ready')
+    structured_log.logger.info('worker_started', extra={'fields': startup.report()})
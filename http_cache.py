@@ -0,0 +1,215 @@
+"""
+HTTP-level caching and compression for the Flask JSON API
+Adds content-hash ETags with 304 handling, Cache-Control and Last-Modified
+headers, and gzip/brotli negotiation to /api/* responses
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Path prefix -> Cache-Control header. First match wins.
+CACHE_CONTROL_RULES = [
+    ('/api/cache-stats', 'no-store'),
+    ('/api/rate-stats', 'no-store'),
+    ('/api/years', 'public, max-age=3600, stale-while-revalidate=86400'),
+    ('/api/states', 'public, max-age=3600, stale-while-revalidate=86400'),
+    ('/api/reports', 'public, max-age=3600, stale-while-revalidate=86400'),
+    ('/api/farm-types', 'public, max-age=3600, stale-while-revalidate=86400'),
+    ('/api/categories', 'public, max-age=3600, stale-while-revalidate=86400'),
+    ('/api/variables', 'public, max-age=3600, stale-while-revalidate=86400'),
+]
+# Survey data for past years is effectively immutable
+DEFAULT_CACHE_CONTROL = 'public, max-age=86400'
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/vnd.arms.columnar+json', 'text/')
+MIN_COMPRESS_SIZE = 1024
+
+
+def cache_control_for(path):
+    for prefix, value in CACHE_CONTROL_RULES:
+        if path.startswith(prefix):
+            return value
+    return DEFAULT_CACHE_CONTROL
+
+
+def content_etag(body):
+    """Strong ETag derived from the response body"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _etag_matches(header, etag):
+    """True if an If-None-Match header matches etag (ignoring encoding suffixes)"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"').split('-', 1)[0]
+        if candidate == etag:
+            return True
+    return False
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header, or None"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        pieces = part.strip().split(';')
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class HTTPCache:
+    """
+    Computes ETags and compressed bodies for API responses
+
+    Compressed variants and first-seen times are kept in a bounded
+    in-process LRU keyed by content hash; nothing is written to the
+    response cache on the request path.
+    """
+
+    def __init__(self, app=None, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._variants = OrderedDict()
+        self._bytes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.process_response)
+        app.extensions['http_cache'] = self
+
+    def _lru_get(self, key):
+        with self._lock:
+            value = self._variants.get(key)
+            if value is not None:
+                self._variants.move_to_end(key)
+            return value
+
+    def _lru_put(self, key, value):
+        size = len(value) if isinstance(value, bytes) else 64
+        with self._lock:
+            if key in self._variants:
+                return
+            self._variants[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._variants:
+                _, evicted = self._variants.popitem(last=False)
+                self._bytes -= len(evicted) if isinstance(evicted, bytes) else 64
+
+    def first_seen(self, etag):
+        """
+        When this worker first served a body with this ETag (drives Last-Modified)
+
+        Per worker, so after a restart or on another worker Last-Modified
+        can be later; that only costs a 304, since If-None-Match wins.
+        """
+        key = f"seen:{etag}"
+        seen = self._lru_get(key)
+        if seen is None:
+            seen = time.time()
+            self._lru_put(key, seen)
+        return seen
+
+    def compressed(self, etag, body, encoding):
+        """Compressed body for etag, reusing a recent copy when available"""
+        key = f"{encoding}:{etag}"
+        data = self._lru_get(key)
+        if data is None:
+            data = compress(body, encoding)
+            self._lru_put(key, data)
+        return data
+
+    def process_response(self, response):
+        """after_request hook for /api/* responses"""
+        if not request.path.startswith('/api/'):
+            return response
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+        if 'Content-Encoding' in response.headers:
+            return response
+
+        body = response.get_data()
+        # Errors come back as small {"error": ...} bodies with status 200
+        if len(body) < 4096 and b'"error"' in body:
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+
+        etag = content_etag(body)
+        last_modified = self.first_seen(etag)
+        # Stale answers served during an ARMS outage are revalidated on every use
+        response.headers['Cache-Control'] = ('no-cache' if 'X-ARMS-Stale' in response.headers
+                                             else cache_control_for(request.path))
+        response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+        response.vary.add('Accept-Encoding')
+
+        encoding = None
+        mimetype = response.mimetype or ''
+        if len(body) >= MIN_COMPRESS_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES):
+            encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+
+        # The data endpoints are read-only queries sent as POST, so a
+        # matching If-None-Match is answered with 304 for them too
+        if self._not_modified(etag, last_modified):
+            response.status_code = 304
+            response.set_data(b'')
+            response.headers.pop('Content-Length', None)
+            return response
+
+        if encoding:
+            response.set_data(self.compressed(etag, body, encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _not_modified(self, etag, last_modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            return _etag_matches(if_none_match, etag)
+
+        if_modified_since = request.headers.get('If-Modified-Since')
+        if if_modified_since and request.method in ('GET', 'HEAD'):
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(last_modified) <= since
+        return False
@@ -0,0 +1,178 @@
+"""
+Pooled HTTP session layer for the USDA ARMS API client
+Keeps keep-alive connections to the API hosts and retries transient failures
+"""
+
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from forksafe import reset_after_fork
+
+
+# Upstream responses that are worth retrying
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+def _parse_host_pool_sizes(value):
+    """Parse 'host=size,host=size' into a dict"""
+    sizes = {}
+    if not value:
+        return sizes
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        host, size = item.split('=', 1)
+        sizes[host.strip()] = int(size)
+    return sizes
+
+
+class RetryPolicy:
+    """Jittered exponential backoff for 429/5xx responses and connect errors"""
+
+    def __init__(self, max_retries=None, backoff_base=None, backoff_max=None):
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.getenv('USDA_MAX_RETRIES', '3'))
+        self.backoff_base = backoff_base if backoff_base is not None else float(
+            os.getenv('USDA_BACKOFF_BASE', '0.5'))
+        self.backoff_max = backoff_max if backoff_max is not None else float(
+            os.getenv('USDA_BACKOFF_MAX', '8'))
+
+    def should_retry_status(self, status_code):
+        return status_code in RETRY_STATUS_CODES
+
+    def compute_delay(self, attempt, retry_after=None):
+        """
+        Delay before the next attempt (full jitter)
+
+        Args:
+            attempt: Zero-based number of the attempt that just failed
+            retry_after: Optional Retry-After header value from the server
+        """
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+
+class SessionManager:
+    """
+    Hands out one pooled requests.Session per process
+
+    Sessions are rebuilt after fork so gunicorn workers never share
+    sockets inherited from the master process.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, host_pool_sizes=None,
+                 transport=None):
+        self.pool_connections = pool_connections or int(
+            os.getenv('USDA_POOL_CONNECTIONS', '4'))
+        self.pool_maxsize = pool_maxsize or int(os.getenv('USDA_POOL_MAXSIZE', '10'))
+        self.host_pool_sizes = _parse_host_pool_sizes(os.getenv('USDA_HOST_POOL_SIZES'))
+        if host_pool_sizes:
+            self.host_pool_sizes.update(host_pool_sizes)
+        # Optional cassette.Cassette recording or replaying the traffic
+        self.transport = transport
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+        reset_after_fork(self, '_forget_session')
+
+    def _forget_session(self):
+        # Drop (never close) the parent's session: closing would tear down
+        # connections the parent process is still using
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _mount(self, session, prefix, adapter):
+        if self.transport is not None:
+            adapter = self.transport.adapter(adapter)
+        session.mount(prefix, adapter)
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=0)
+        self._mount(session, 'https://', adapter)
+        self._mount(session, 'http://', adapter)
+
+        for host, size in self.host_pool_sizes.items():
+            host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0)
+            self._mount(session, f"https://{host}/", host_adapter)
+            self._mount(session, f"http://{host}/", host_adapter)
+        return session
+
+    def set_host_pool_size(self, url_or_host, size):
+        """Size the connection pool for one host (takes effect on next session build)"""
+        host = urlsplit(url_or_host).netloc or url_or_host
+        self.host_pool_sizes[host] = size
+        self.close()
+
+    def get_session(self):
+        """Return the session for the current process, creating it if needed"""
+        pid = os.getpid()
+        session = self._session
+        if session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._build_session()
+                    self._pid = pid
+                session = self._session
+        return session
+
+    def close(self):
+        """Close pooled connections owned by this process"""
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+    def request(self, method, url, retry_policy=None, on_throttle=None, acquire=None, **kwargs):
+        """
+        Send a request through the pooled session, retrying transient failures
+
+        Returns the final response; connect errors are re-raised once the
+        retry budget is spent. on_throttle(delay) is called for each 429.
+        acquire(), if given, is called before every retry and must return
+        True for it to go ahead (e.g. a rate governor token); otherwise the
+        last response or error stands.
+        """
+        retry_policy = retry_policy or RetryPolicy(max_retries=0)
+        attempt = 0
+        while True:
+            try:
+                response = self.get_session().request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError:
+                if attempt >= retry_policy.max_retries:
+                    raise
+                time.sleep(retry_policy.compute_delay(attempt))
+                if acquire is not None and not acquire():
+                    raise
+                attempt += 1
+                continue
+
+            if response.status_code == 429 and on_throttle is not None:
+                on_throttle(retry_policy.compute_delay(attempt, response.headers.get('Retry-After')))
+            if (retry_policy.should_retry_status(response.status_code)
+                    and attempt < retry_policy.max_retries):
+                delay = retry_policy.compute_delay(attempt, response.headers.get('Retry-After'))
+                time.sleep(delay)
+                if acquire is not None and not acquire():
+                    return response
+                response.close()
+                attempt += 1
+                continue
+            return response
@@ -0,0 +1,152 @@
+"""
+Concurrency load test: WSGI (gunicorn, sync workers) vs ASGI (uvicorn)
+Starts the local ARMS stub with a fixed latency, runs each server against it
+with the same number of worker processes, and fires distinct /api/custom-query
+requests (all cache misses) at a given concurrency
+
+Usage:
+    python load_test.py --requests 300 --concurrency 100 --latency-ms 500
+    python load_test.py --servers asgi --json results.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from stub_arms import REPORTS, STATES, YEARS, start_background_server
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SERVERS = {
+    'wsgi': lambda port, workers: ['gunicorn', '--workers', str(workers), '--bind',
+                                   f"127.0.0.1:{port}", '--timeout', '120', 'wsgi:app'],
+    'asgi': lambda port, workers: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers',
+                                   str(workers), '--port', str(port), '--log-level', 'warning'],
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def query_bodies(count):
+    """Distinct custom-query bodies, so every request has to go upstream"""
+    combos = itertools.product(YEARS, [s['id'] for s in STATES], list(REPORTS))
+    bodies = [{'years': [year], 'state': state, 'report': report}
+              for year, state, report in itertools.islice(combos, count)]
+    if len(bodies) < count:
+        raise SystemExit(f"At most {len(bodies)} distinct requests are available")
+    return bodies
+
+
+def start_server(kind, workers, upstream_url, workdir):
+    port = _free_port()
+    env = dict(os.environ,
+               USDA_API_KEY='stub',
+               USDA_BASE_URL=upstream_url,
+               ARMS_CACHE_PATH=os.path.join(workdir, kind, 'cache.sqlite3'),
+               ARMS_CATALOG_SNAPSHOT=os.path.join(workdir, kind, 'catalog.json'),
+               ARMS_RATE_LIMIT='off',
+               USDA_READ_TIMEOUT='60')
+    process = subprocess.Popen(SERVERS[kind](port, workers), cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+async def run_load(url, bodies, concurrency):
+    """Send every body with at most concurrency requests in flight; returns per-request results"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=300) as http:
+        async def one(body):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await http.post('/api/custom-query', json=body)
+                    ok = response.status_code == 200 and 'error' not in response.json()
+                except httpx.HTTPError:
+                    ok = False
+                return ok, time.perf_counter() - start
+        return await asyncio.gather(*(one(body) for body in bodies))
+
+
+def summarize(kind, results, elapsed, concurrency):
+    latencies = sorted(seconds for _, seconds in results)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+    return {
+        'server': kind,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': sum(1 for ok, _ in results if not ok),
+        'seconds': round(elapsed, 2),
+        'requests_per_s': round(len(results) / elapsed, 1),
+        'p50_ms': pick(0.5),
+        'p95_ms': pick(0.95),
+        'max_ms': round(latencies[-1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WSGI vs ASGI concurrency load test')
+    parser.add_argument('--servers', default='wsgi,asgi', help='Comma-separated: wsgi, asgi')
+    parser.add_argument('--workers', type=int, default=3, help='Worker processes per server')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=500, help='Stub upstream latency')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    stub, upstream_url = start_background_server(latency_ms=args.latency_ms)
+    workdir = tempfile.mkdtemp(prefix='arms-load-')
+    bodies = query_bodies(args.requests)
+    results = []
+    try:
+        for kind in args.servers.split(','):
+            process, url = start_server(kind.strip(), args.workers, upstream_url, workdir)
+            try:
+                start = time.perf_counter()
+                outcomes = asyncio.run(run_load(url, bodies, args.concurrency))
+                results.append(summarize(kind, outcomes, time.perf_counter() - start,
+                                         args.concurrency))
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.requests} distinct queries, {args.concurrency} concurrent, "
+          f"{args.workers} workers, upstream latency {args.latency_ms:g} ms")
+    print(f"{'server':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+    for row in results:
+        print(f"{row['server']:<8}{row['requests_per_s']:>10}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['max_ms']:>10}{row['errors']:>8}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Preloaded metadata catalog for the ARMS lookup endpoints
+Years, states, reports, farm types, categories and variables are held in
+memory, loaded from a snapshot file at startup and refreshed in the background
+"""
+
+import json
+import os
+import threading
+import time
+
+from forksafe import reset_after_fork
+from rate_governor import priority
+
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'cache', 'metadata_catalog.json')
+
+# Catalog entry -> ARMS endpoint listing it (GET, no parameters)
+ENTRIES = {
+    'years': 'year',
+    'states': 'state',
+    'reports': 'report',
+    'farm_types': 'farmtype',
+    'categories': 'category',
+    'variables': 'variable',
+}
+
+LOADING_ERROR = 'Metadata is still loading. Please try again shortly.'
+
+
+class MetadataCatalog:
+    """
+    In-memory copy of the ARMS metadata listings
+
+    Requests are answered from memory. A daemon thread refreshes the
+    listings from ARMS on a schedule and writes a snapshot so freshly
+    started workers have data before their first upstream round trip. If
+    a refresh fails the previous data is kept, so an ARMS outage never
+    reaches page load. A listing that was never loaded is answered with
+    an error straight away (see unavailable()) while the thread fetches it.
+    """
+
+    def __init__(self, client, snapshot_path=None, refresh_interval=None, failure_backoff=None):
+        self.client = client
+        self.snapshot_path = snapshot_path or os.getenv('ARMS_CATALOG_SNAPSHOT', DEFAULT_SNAPSHOT_PATH)
+        self.refresh_interval = refresh_interval or float(os.getenv('ARMS_CATALOG_REFRESH', '3600'))
+        # After a failed fetch, don't retry inline for this many seconds
+        self.failure_backoff = failure_backoff or float(os.getenv('ARMS_CATALOG_FAILURE_BACKOFF', '60'))
+
+        self._lock = threading.Lock()
+        self._data = {}
+        self._report_variables = {}
+        self._failures = {}
+        self.loaded_at = None
+        self.refreshed_at = None
+
+        self._refresher = None
+        self._refresher_pid = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._wanted_reports = set()
+
+        reset_after_fork(self, '_after_fork')
+
+    def _after_fork(self):
+        # The parent's lock may have been held mid-refresh when we forked
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._refresher_pid = None
+        self._wake = threading.Event()
+
+    def load_snapshot(self):
+        """Load listings from the snapshot file; returns True if anything was loaded"""
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        with self._lock:
+            self._data.update(snapshot.get('entries', {}))
+            self._report_variables.update(snapshot.get('report_variables', {}))
+            self.loaded_at = snapshot.get('saved_at')
+        return bool(self._data)
+
+    def save_snapshot(self):
+        """Atomically write the current listings to the snapshot file"""
+        with self._lock:
+            snapshot = {
+                'saved_at': time.time(),
+                'entries': dict(self._data),
+                'report_variables': dict(self._report_variables),
+            }
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _fetch(self, key, endpoint, params=None, method='GET', fresh=False):
+        """Fetch one listing, from ARMS itself when fresh; returns (response, ok)"""
+        fetch = self.client.fetch_fresh if fresh else self.client._make_request
+        try:
+            result = fetch(endpoint, params, method)
+        except Exception:
+            result = {'error': 'Metadata request failed'}
+        if 'error' in result:
+            self._failures[key] = (time.time(), result)
+            return result, False
+        self._failures.pop(key, None)
+        return result, True
+
+    def _fetch_variables(self, report, fresh=False):
+        return self._fetch(('variables', report), 'variable', {'report': report}, 'POST', fresh)
+
+    def refresh(self):
+        """Re-fetch every listing from ARMS, keeping the old copy of any that fail"""
+        fetched = {}
+        for name, endpoint in ENTRIES.items():
+            result, ok = self._fetch(name, endpoint, fresh=True)
+            if ok:
+                fetched[name] = result
+
+        with self._lock:
+            reports = list(self._report_variables)
+        report_variables = {}
+        for report in reports:
+            result, ok = self._fetch_variables(report, fresh=True)
+            if ok:
+                report_variables[report] = result
+
+        with self._lock:
+            self._data.update(fetched)
+            self._report_variables.update(report_variables)
+            self.refreshed_at = time.time()
+
+        if fetched or report_variables:
+            try:
+                self.save_snapshot()
+            except OSError:
+                pass
+        return len(fetched) == len(ENTRIES)
+
+    def fill_missing(self):
+        """
+        Load the listings that were never loaded, accepting cached responses
+
+        Returns True when every listing is now loaded.
+        """
+        with self._lock:
+            names = [name for name in ENTRIES if name not in self._data]
+            reports = [report for report in self._wanted_reports
+                       if report not in self._report_variables]
+            self._wanted_reports.clear()
+
+        fetched = {}
+        for name in names:
+            result, ok = self._fetch(name, ENTRIES[name])
+            if ok:
+                fetched[name] = result
+        report_variables = {}
+        for report in reports:
+            result, ok = self._fetch_variables(report)
+            if ok:
+                report_variables[report] = result
+
+        with self._lock:
+            self._data.update(fetched)
+            self._report_variables.update(report_variables)
+            complete = len(self._data) >= len(ENTRIES)
+        if fetched or report_variables:
+            try:
+                self.save_snapshot()
+            except OSError:
+                pass
+        return complete
+
+    def clear_failures(self):
+        """Forget failed fetches, so the next request asks the refresh thread again"""
+        self._failures.clear()
+
+    def _missing(self, failure_key):
+        """Error for a listing not loaded yet; asks the refresh thread to fetch it"""
+        failure = self._failures.get(failure_key)
+        if failure and time.time() - failure[0] < self.failure_backoff:
+            return failure[1]
+        self._wake.set()
+        return {'error': LOADING_ERROR}
+
+    def get(self, name):
+        """Return a listing (see ENTRIES), or an error if it hasn't been loaded yet"""
+        self.ensure_refresher()
+        data = self._data.get(name)
+        return data if data is not None else self._missing(name)
+
+    def get_variables(self, report=None):
+        """Variables for one report, or all variables when report is None"""
+        if not report:
+            return self.get('variables')
+        self.ensure_refresher()
+        data = self._report_variables.get(report)
+        if data is not None:
+            return data
+        with self._lock:
+            self._wanted_reports.add(report)
+        return self._missing(('variables', report))
+
+    @staticmethod
+    def unavailable(listing):
+        """True if get() had nothing to answer with (the route should answer 503)"""
+        return isinstance(listing, dict) and 'error' in listing
+
+    def start(self):
+        """Load the snapshot and start background refreshing"""
+        self.load_snapshot()
+        self.ensure_refresher()
+
+    def ensure_refresher(self):
+        """Start the refresh thread in this process if it isn't running (threads don't survive fork)"""
+        pid = os.getpid()
+        if self._refresher_pid == pid and self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher_pid == pid and self._refresher is not None:
+                return
+            self._stop = threading.Event()
+            self._refresher = threading.Thread(target=self._refresh_loop,
+                                               name='arms-catalog-refresh', daemon=True)
+            self._refresher_pid = pid
+            self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _refresh_loop(self):
+        # Refreshes yield upstream capacity to user requests
+        with priority('background'):
+            # Load straight away whatever the snapshot didn't have
+            self.fill_missing()
+            while not self._stop.is_set():
+                woken = self._wake.wait(self.refresh_interval)
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                if woken:
+                    # A request found a listing missing
+                    self.fill_missing()
+                else:
+                    self.refresh()
@@ -0,0 +1,172 @@
+"""
+Prometheus metrics for the Flask app and the ARMS clients
+Request latency, in-flight, response size and row count per route, upstream
+call latency and errors per ARMS endpoint, and response cache lookups.
+
+Under gunicorn (or uvicorn --workers) set PROMETHEUS_MULTIPROC_DIR to an
+empty directory before the workers start, so /metrics aggregates every
+worker; gunicorn.conf.py does this by default.
+"""
+
+import os
+import time
+
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                               Gauge, Histogram, generate_latest, multiprocess)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B .. 64 MB
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+REQUEST_LATENCY = Histogram(
+    'arms_http_request_duration_seconds', 'Flask request latency (to the first byte for streams)',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge(
+    'arms_http_requests_in_flight', 'Flask requests being handled',
+    ['route'], multiprocess_mode='livesum')
+RESPONSE_SIZE = Histogram(
+    'arms_http_response_size_bytes', 'Response body size as sent (after compression)',
+    ['route'], buckets=SIZE_BUCKETS)
+RESPONSE_ROWS = Histogram(
+    'arms_http_response_rows', 'Data rows in JSON responses',
+    ['route'], buckets=ROW_BUCKETS)
+
+UPSTREAM_LATENCY = Histogram(
+    'arms_upstream_request_duration_seconds', 'ARMS API call latency, including retries',
+    ['endpoint', 'method', 'outcome'], buckets=LATENCY_BUCKETS)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'arms_upstream_requests_in_flight', 'ARMS API calls in progress',
+    ['endpoint'], multiprocess_mode='livesum')
+UPSTREAM_ERRORS = Counter(
+    'arms_upstream_errors_total',
+    'Failed ARMS calls by type (timeout, connection, http, decode, unavailable, rate_limited)',
+    ['endpoint', 'type'])
+
+CACHE_LOOKUPS = Counter(
+    'arms_cache_lookups_total',
+    'Response cache lookups by result (hit, miss; stale = a miss answered from an expired entry)',
+    ['result'])
+
+
+class UpstreamCall:
+    """
+    Times one ARMS call and counts it in flight
+
+        with UpstreamCall('surveydata', 'POST') as call:
+            ...
+            call.fail('timeout')
+    """
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.error = None
+
+    def fail(self, kind):
+        self.error = kind
+
+    def __enter__(self):
+        UPSTREAM_IN_FLIGHT.labels(self.endpoint).inc()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        UPSTREAM_IN_FLIGHT.labels(self.endpoint).dec()
+        if exc_type is not None and self.error is None:
+            self.error = 'exception'
+        UPSTREAM_LATENCY.labels(self.endpoint, self.method, 'error' if self.error else 'ok').observe(
+            time.perf_counter() - self.start)
+        if self.error:
+            UPSTREAM_ERRORS.labels(self.endpoint, self.error).inc()
+
+
+def count_upstream_error(endpoint, kind):
+    """An ARMS call refused before it was sent (circuit open, rate budget spent)"""
+    UPSTREAM_ERRORS.labels(endpoint, kind).inc()
+
+
+def count_cache_lookup(result):
+    CACHE_LOOKUPS.labels(result).inc()
+
+
+def _row_count(obj):
+    """Rows in a response object: len(data), or summed over batch results"""
+    if not isinstance(obj, dict):
+        return None
+    data = obj.get('data')
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict) and isinstance(data.get('rows'), int):
+        # Columnar responses (see columnar.py) carry their row count
+        return data['rows']
+    results = obj.get('results')
+    if isinstance(results, list):
+        return sum(len(item.get('result', {}).get('data') or [])
+                   for item in results if isinstance(item, dict))
+    return None
+
+
+class RowCountingJSONProvider(DefaultJSONProvider):
+    """jsonify() that notes how many data rows the response carries"""
+
+    def response(self, *args, **kwargs):
+        if len(args) == 1 and not kwargs:
+            rows = _row_count(args[0])
+            if rows is not None:
+                g.response_rows = rows
+        return super().response(*args, **kwargs)
+
+
+def _route():
+    # The URL rule, not the path, keeps label cardinality bounded
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def instrument_app(app):
+    """
+    Record request metrics for every Flask request
+
+    Call before other after_request hooks (e.g. HTTPCache) are registered:
+    hooks run in reverse order, so sizes are then measured as sent.
+    """
+    app.json = RowCountingJSONProvider(app)
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_route = _route()
+        REQUESTS_IN_FLIGHT.labels(g.metrics_route).inc()
+
+    @app.after_request
+    def _record_request_metrics(response):
+        route = g.get('metrics_route')
+        if route is None:
+            return response
+        REQUEST_LATENCY.labels(route, request.method, str(response.status_code)).observe(
+            time.perf_counter() - g.metrics_start)
+        if not response.is_streamed:
+            RESPONSE_SIZE.labels(route).observe(response.calculate_content_length() or 0)
+        rows = g.get('response_rows')
+        if rows is not None:
+            RESPONSE_ROWS.labels(route).observe(rows)
+        return response
+
+    @app.teardown_request
+    def _end_request_metrics(error=None):
+        route = g.pop('metrics_route', None)
+        if route is not None:
+            REQUESTS_IN_FLIGHT.labels(route).dec()
+
+
+def render():
+    """(body, content type) of the metrics page, aggregated across workers in multiprocess mode"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,386 @@
+"""
+Offline local mirror of the ARMS dataset
+Syncs every report x year x state x category combination reachable through
+USDAClient into Parquet files, and answers surveydata and metadata requests
+from them in "mirror mode" (ARMS_MODE=mirror)
+
+Usage:
+    python mirror.py sync [--path mirror] [--years 2015-2023] [--workers 4]
+    python mirror.py info
+    python mirror.py query --report "Farm Business Income Statement" --year 2020
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_governor import priority
+from survey_frame import SurveyFrame
+from startup import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mirror')
+MANIFEST_NAME = 'manifest.json'
+
+# Columns recording which request produced each row; never returned to callers
+STATE_TAG = '_state'
+CATEGORY_TAG = '_category'
+TAG_COLUMNS = (STATE_TAG, CATEGORY_TAG)
+
+# Metadata listings stored alongside the survey data
+METADATA_METHODS = {
+    'year': 'get_years',
+    'state': 'get_states',
+    'report': 'get_reports',
+    'variable': 'get_variables',
+    'category': 'get_categories',
+    'farmtype': 'get_farm_types',
+}
+
+
+def _slug(name):
+    return ''.join(c if c.isalnum() else '_' for c in name.lower()).strip('_')
+
+
+def _names(listing, key='name'):
+    """Extract names from a metadata listing ({'data': [...]})"""
+    names = []
+    for item in listing.get('data', []) if isinstance(listing, dict) else []:
+        if isinstance(item, dict):
+            value = item.get(key) or item.get('id')
+        else:
+            value = item
+        if value is not None:
+            names.append(value)
+    return names
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class ArmsMirror:
+    """
+    Parquet-backed copy of the ARMS surveydata
+
+    One file per report holds every synced year, state and category,
+    tagged with the request parameters that produced each row. Frames are
+    loaded lazily and indexed by (state, category, year) so queries only
+    touch the rows they return.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('ARMS_MIRROR_PATH', DEFAULT_MIRROR_PATH)
+        self._lock = threading.Lock()
+        self._frames = {}
+        self._indexes = {}
+        self._coverage = {}
+        self._manifest = None
+
+    # ---- storage -------------------------------------------------------
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+            except (OSError, ValueError):
+                self._manifest = {'reports': {}, 'metadata': {}}
+        return self._manifest
+
+    def exists(self):
+        return bool(self.manifest.get('reports'))
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, f"{MANIFEST_NAME}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_NAME))
+        self._manifest = manifest
+
+    def write_report(self, report, records, combos):
+        """Store all rows for one report, replacing any previous copy"""
+        frame = SurveyFrame.from_records(records).df
+        for tag in TAG_COLUMNS:
+            frame[tag] = frame[tag].astype('category')
+        frame = frame.sort_values([STATE_TAG, CATEGORY_TAG, 'year'], kind='stable')
+        frame = frame.reset_index(drop=True)
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = f"{_slug(report)}.parquet"
+        frame.to_parquet(os.path.join(self.path, filename), index=False)
+
+        manifest = self.manifest
+        manifest['reports'][report] = {
+            'file': filename,
+            'rows': len(frame),
+            'combos': sorted(combos),
+            'synced_at': time.time(),
+        }
+        self._write_manifest(manifest)
+        with self._lock:
+            self._frames.pop(report, None)
+            self._indexes.pop(report, None)
+            self._coverage.pop(report, None)
+
+    def write_metadata(self, metadata):
+        manifest = self.manifest
+        manifest['metadata'] = metadata
+        self._write_manifest(manifest)
+
+    def _frame(self, report):
+        """Loaded frame and (state, category, year) -> row positions index"""
+        frame = self._frames.get(report)
+        if frame is None:
+            with self._lock:
+                frame = self._frames.get(report)
+                if frame is None:
+                    entry = self.manifest['reports'][report]
+                    frame = pd.read_parquet(os.path.join(self.path, entry['file']))
+                    self._indexes[report] = frame.groupby(
+                        [STATE_TAG, CATEGORY_TAG, 'year'], observed=True, sort=False).indices
+                    self._frames[report] = frame
+        return frame, self._indexes[report]
+
+    def preload(self):
+        """Load every report into memory (e.g. before forking workers)"""
+        for report in self.manifest.get('reports', {}):
+            self._frame(report)
+
+    # ---- queries -------------------------------------------------------
+
+    def covers(self, report, year, state, category):
+        """True if the sync fetched this (report, year, state, category) combination"""
+        coverage = self._coverage.get(report)
+        if coverage is None:
+            entry = self.manifest['reports'].get(report)
+            if entry is None:
+                return False
+            coverage = set(tuple(combo) for combo in entry['combos'])
+            self._coverage[report] = coverage
+        return (state, category, year) in coverage
+
+    def answer(self, endpoint, params=None, method='GET'):
+        """
+        Answer a USDAClient request from the mirror
+
+        Returns the response dict, or None when the mirror doesn't hold it.
+        """
+        params = params or {}
+        if endpoint == 'surveydata':
+            return self.query(params)
+
+        metadata = self.manifest.get('metadata', {})
+        if params.get('report') and not params.get('name'):
+            listing = metadata.get('variable_by_report', {}).get(params['report'])
+            return listing
+        if params.get('name'):
+            listing = metadata.get(endpoint)
+            if listing is None:
+                return None
+            needle = str(params['name']).lower()
+            return dict(listing, data=[
+                item for item in listing.get('data', [])
+                if needle in json.dumps(item).lower()
+            ])
+        return metadata.get(endpoint)
+
+    def query(self, params):
+        """Answer a surveydata request body, or None if it isn't fully mirrored"""
+        if params.get('farmtype') or params.get('category2'):
+            # The sync pulls the default farm type without cross-tabs
+            return None
+
+        years = _as_list(params.get('year'))
+        states = [str(s).lower() for s in _as_list(params.get('state')) or ['all']]
+        categories = [str(c).lower() for c in _as_list(params.get('category'))] or ['']
+        reports = _as_list(params.get('report'))
+        variables = _as_list(params.get('variable'))
+
+        if not reports:
+            if not variables:
+                return None
+            reports = self._reports_with_variables(variables)
+            if not reports:
+                return None
+
+        # Report names are matched case-insensitively, as ARMS does
+        known = {name.lower(): name for name in self.manifest['reports']}
+        parts = []
+        for report in reports:
+            report = known.get(str(report).lower())
+            if report is None:
+                return None
+            frame, index = self._frame(report)
+            positions = []
+            for state in states:
+                for category in categories:
+                    for year in years:
+                        if not self.covers(report, year, state, category):
+                            return None
+                        rows = index.get((state, category, year))
+                        if rows is not None:
+                            positions.append(rows)
+            if not positions:
+                continue
+            part = frame.iloc[np.concatenate(positions)]
+            if variables:
+                part = part[part['variable_id'].isin(variables)]
+            if params.get('category_value'):
+                part = part[part['category_value'] == params['category_value']]
+            parts.append(part)
+
+        if not parts:
+            return {'data': []}
+        result = pd.concat(parts) if len(parts) > 1 else parts[0]
+        result = result.drop(columns=list(TAG_COLUMNS))
+        return SurveyFrame(result).to_response()
+
+    def _reports_with_variables(self, variables):
+        by_report = self.manifest.get('metadata', {}).get('variable_by_report', {})
+        wanted = set(variables)
+        reports = []
+        for report in self.manifest['reports']:
+            listing = by_report.get(report, {})
+            ids = set(_names(listing, key='id')) | set(_names(listing, key='name'))
+            if ids & wanted:
+                reports.append(report)
+        return reports
+
+
+def sync(client, mirror, years=None, states=None, categories=None, reports=None,
+         workers=4, progress=print):
+    """
+    Pull report x year x state x category combinations into the mirror
+
+    Each combination is fetched as its own cached surveydata request, so
+    an interrupted sync resumes from the response cache. Requests go out
+    at background priority.
+    """
+    with priority('background'):
+        metadata = {endpoint: getattr(client, method)()
+                    for endpoint, method in METADATA_METHODS.items()}
+    for endpoint, listing in metadata.items():
+        if 'error' in listing:
+            raise RuntimeError(f"Could not fetch {endpoint} listing: {listing['error']}")
+
+    reports = reports or _names(metadata['report'])
+    years = years or [int(y) for y in _names(metadata['year'])]
+    states = states or [str(s).lower() for s in _names(metadata['state'], key='id')]
+    categories = categories if categories is not None else [
+        str(c).lower() for c in _names(metadata['category'])]
+    # '' stands for "no category" (all farms)
+    categories = [''] + [c for c in categories if c]
+
+    with priority('background'):
+        metadata['variable_by_report'] = {
+            report: client.get_variables(report=report) for report in reports}
+
+    def fetch(report, year, state, category):
+        with priority('background'):
+            result = client.get_survey_data(years=[year], state=state, report=report,
+                                            category=category or None)
+        return (report, year, state, category), result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='arms-mirror') as pool:
+        for report in reports:
+            jobs = [pool.submit(fetch, report, year, state, category)
+                    for state in states for category in categories for year in years]
+            records, combos, failed = [], [], 0
+            for job in jobs:
+                (report_name, year, state, category), result = job.result()
+                if 'error' in result:
+                    failed += 1
+                    continue
+                for row in result.get('data', []):
+                    row = dict(row)
+                    row[STATE_TAG] = state
+                    row[CATEGORY_TAG] = category
+                    records.append(row)
+                combos.append((state, category, year))
+            if records:
+                mirror.write_report(report, records, combos)
+            progress(f"{report}: {len(records)} rows from {len(combos)} requests"
+                     f" ({failed} failed)")
+
+    mirror.write_metadata(metadata)
+    return mirror.manifest
+
+
+def mirror_from_env():
+    """The mirror to answer from when ARMS_MODE=mirror, else None"""
+    if os.getenv('ARMS_MODE', '').lower() != 'mirror':
+        return None
+    return ArmsMirror()
+
+
+def _parse_years(value):
+    if not value:
+        return None
+    years = []
+    for part in value.split(','):
+        if '-' in part:
+            start, end = part.split('-', 1)
+            years.extend(range(int(start), int(end) + 1))
+        else:
+            years.append(int(part))
+    return years
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mirror of the ARMS dataset')
+    parser.add_argument('--path', help='Mirror directory (default: ARMS_MIRROR_PATH or ./mirror)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = commands.add_parser('sync', help='Pull data from ARMS into the mirror')
+    sync_parser.add_argument('--years', help='e.g. 2015-2023 or 2019,2020 (default: all)')
+    sync_parser.add_argument('--states', help='Comma-separated state ids (default: all)')
+    sync_parser.add_argument('--categories', help='Comma-separated categories (default: all)')
+    sync_parser.add_argument('--reports', help='Comma-separated report names (default: all)')
+    sync_parser.add_argument('--workers', type=int, default=4)
+
+    commands.add_parser('info', help='Show what the mirror holds')
+
+    query_parser = commands.add_parser('query', help='Time a query against the mirror')
+    query_parser.add_argument('--report', required=True)
+    query_parser.add_argument('--year', type=int, action='append', required=True)
+    query_parser.add_argument('--state', default='all')
+    query_parser.add_argument('--category')
+
+    args = parser.parse_args()
+    mirror = ArmsMirror(args.path)
+
+    if args.command == 'sync':
+        from api_client import USDAClient
+        client = USDAClient(mirror=False)
+        split = lambda value: [v.strip() for v in value.split(',')] if value else None
+        sync(client, mirror, years=_parse_years(args.years), states=split(args.states),
+             categories=split(args.categories), reports=split(args.reports),
+             workers=args.workers)
+    elif args.command == 'info':
+        for report, entry in mirror.manifest.get('reports', {}).items():
+            print(f"{report}: {entry['rows']} rows, {len(entry['combos'])} combinations")
+    elif args.command == 'query':
+        params = {'year': args.year, 'state': [args.state], 'report': [args.report]}
+        if args.category:
+            params['category'] = [args.category]
+        mirror.query(params)  # load and index the report
+        start = time.perf_counter()
+        result = mirror.query(params)
+        elapsed = (time.perf_counter() - start) * 1000
+        rows = len(result['data']) if result else 'not mirrored'
+        print(f"{rows} rows in {elapsed:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
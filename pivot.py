@@ -0,0 +1,170 @@
+"""
+Group-by / pivot views over surveydata results
+Aggregates a cached result into a compact matrix of row keys x column keys
+(e.g. category value x year) so widgets can ask for exactly the grid they show
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import make_cache_key, ttl_for
+from circuit_breaker import served_stale
+from startup import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+
+# Request fields describing the pivot rather than the surveydata query
+PIVOT_PARAMS = ('rows', 'columns', 'value', 'agg', 'filters')
+
+AGGREGATIONS = ('mean', 'sum', 'min', 'max', 'median', 'first', 'count')
+NUMERIC_AGGREGATIONS = ('mean', 'sum', 'min', 'max', 'median')
+
+DEFAULT_ROWS = ['variable_name', 'category_value']
+DEFAULT_COLUMNS = ['year']
+DEFAULT_VALUE = 'estimate'
+DEFAULT_AGG = 'mean'
+
+MAX_CELLS = int(os.getenv('ARMS_PIVOT_MAX_CELLS', '250000'))
+
+
+def _dimensions(value, default):
+    if value is None or value == '':
+        return list(default)
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return list(value)
+
+
+def pivot_spec(data):
+    """Parse and validate the pivot fields of a request; raises ValueError"""
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise ValueError('filters must be an object of column: value')
+    spec = {
+        'rows': _dimensions(data.get('rows'), DEFAULT_ROWS),
+        'columns': _dimensions(data.get('columns'), DEFAULT_COLUMNS),
+        'value': data.get('value') or DEFAULT_VALUE,
+        'agg': str(data.get('agg') or DEFAULT_AGG).lower(),
+        'filters': filters,
+    }
+    if spec['agg'] not in AGGREGATIONS:
+        raise ValueError(f"agg must be one of: {', '.join(AGGREGATIONS)}")
+    if not spec['rows']:
+        raise ValueError('At least one row dimension is required')
+    overlap = set(spec['rows']) & set(spec['columns'])
+    if overlap:
+        raise ValueError(f"Dimensions used for both rows and columns: {', '.join(sorted(overlap))}")
+    return spec
+
+
+def _keys(index):
+    """Index labels as lists of plain values (one list per key)"""
+    if isinstance(index, pd.MultiIndex):
+        return [list(key) for key in index.tolist()]
+    return [[key] for key in index.tolist()]
+
+
+def pivot_frame(frame, spec):
+    """
+    Aggregate a SurveyFrame into a matrix
+
+    Returns {'rows': {'dims', 'keys'}, 'columns': {'dims', 'keys'},
+    'values': [[...]]} with None for empty cells. Without column
+    dimensions the matrix has a single column.
+    """
+    frame = frame.filter(**spec['filters'])
+    df = frame.df
+    needed = spec['rows'] + spec['columns'] + [spec['value']]
+    missing = [name for name in needed if name not in df.columns] if not df.empty else []
+    if missing:
+        raise ValueError(f"Unknown columns: {', '.join(missing)}")
+
+    if df.empty:
+        return {'rows': {'dims': spec['rows'], 'keys': []},
+                'columns': {'dims': spec['columns'], 'keys': []}, 'values': []}
+
+    values = df[spec['value']]
+    if spec['agg'] in NUMERIC_AGGREGATIONS:
+        values = pd.to_numeric(values, errors='coerce')
+    grouped = values.groupby([df[name] for name in spec['rows'] + spec['columns']],
+                             observed=True, sort=True).agg(spec['agg'])
+
+    if spec['columns']:
+        levels = list(range(len(spec['rows']), len(spec['rows']) + len(spec['columns'])))
+        matrix = grouped.unstack(levels)
+    else:
+        matrix = grouped.to_frame(spec['value'])
+    if matrix.size > MAX_CELLS:
+        raise ValueError(f"Pivot has {matrix.size} cells; the limit is {MAX_CELLS}")
+
+    if spec['agg'] == 'first':
+        cells = np.where(pd.isna(matrix).to_numpy(), None, matrix.to_numpy(dtype=object))
+    else:
+        numeric = matrix.to_numpy(dtype=float)
+        if spec['agg'] == 'count':
+            # Cells with no rows are empty after unstack; counts stay integers
+            cells = np.where(np.isnan(numeric), None, np.nan_to_num(numeric).astype(int).astype(object))
+        else:
+            cells = np.where(np.isnan(numeric), None, np.round(numeric, 4))
+
+    return {
+        'rows': {'dims': spec['rows'], 'keys': _keys(matrix.index)},
+        'columns': {'dims': spec['columns'],
+                    'keys': _keys(matrix.columns) if spec['columns'] else []},
+        'values': cells.tolist(),
+    }
+
+
+class PivotEngine:
+    """
+    Pivots over the query frames held by ResultViews, memoized by pivot spec
+
+    The same query frame serves every pivot of it, and each distinct spec
+    is computed once for as long as the frame's cached responses stay fresh.
+    """
+
+    def __init__(self, views, max_entries=None, ttl=None):
+        self.views = views
+        self.max_entries = max_entries or int(os.getenv('ARMS_PIVOT_MEMO', '128'))
+        self.ttl = ttl if ttl is not None else ttl_for('surveydata')
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._memo.get(key)
+            if entry is None or entry[0] < time.time():
+                return None
+            self._memo.move_to_end(key)
+            return entry[1]
+
+    def _put(self, key, value, expires):
+        with self._lock:
+            self._memo[key] = (min(expires, time.time() + self.ttl), value)
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+
+    def pivot(self, path, query, spec, fetch):
+        """
+        Pivot of the result fetch() returns for query
+
+        Returns the upstream error response unchanged if fetch() fails.
+        """
+        memo_key = (make_cache_key(path, query, 'POST'), json.dumps(spec, sort_keys=True, default=str))
+        result = self._get(memo_key)
+        if result is not None:
+            return result
+
+        key, frame, expires = self.views.frame(path, query, fetch)
+        if frame is None:
+            return key
+        result = dict(pivot_frame(frame, spec), value=spec['value'], agg=spec['agg'])
+        if not served_stale():
+            self._put(memo_key, result, expires)
+        return result
@@ -0,0 +1,473 @@
+"""
+Query planner for surveydata requests
+Answers queries by filtering cached results that contain them (a state='all'
+pull covers single states, a multi-year pull covers its years, a report pull
+covers its variables) and goes upstream only for the slices nothing covers
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import make_cache_key, normalize_params, ttl_for
+from forksafe import reset_after_fork
+from survey_frame import SurveyFrame
+
+
+# Raw cache entry listing the held results and when they expire, so every
+# worker can plan over them
+SHARED_INDEX_KEY = 'planner:index'
+MAX_ENTRIES = 2000
+
+# Plan paths, in order of preference
+PATHS = ('cache', 'local', 'partial', 'upstream')
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _lower_set(values):
+    return frozenset(str(v).lower() for v in _as_list(values))
+
+
+class HeldResult:
+    """What a cached surveydata result contains, derived from its request body"""
+
+    def __init__(self, key, params, expires):
+        self.key = key
+        self.params = params
+        self.expires = expires
+        self.years = frozenset(_as_list(params.get('year')))
+        self.states = _lower_set(params.get('state') or ['all'])
+        self.reports = _lower_set(params.get('report'))
+        self.variables = frozenset(_as_list(params.get('variable')))
+        self.category_value = params.get('category_value')
+        self.fixed = _fixed_fields(params)
+
+    def names(self, year, state, unit):
+        """True if the request asked for exactly this slice (empty means none exist)"""
+        kind, value = unit
+        named = value in (self.reports if kind == 'report' else self.variables)
+        return year in self.years and state in self.states and named
+
+    def may_cover(self, year, state, unit, category_value):
+        """True if the slice could be filtered out of this result"""
+        if year not in self.years:
+            return False
+        if self.category_value is not None and self.category_value != category_value:
+            return False
+        if state == 'all':
+            # 'all' rows can't be told apart from the state rows it expands to
+            if self.states != {'all'}:
+                return False
+        elif state not in self.states and 'all' not in self.states:
+            return False
+        kind, value = unit
+        if kind == 'report':
+            return value in self.reports
+        # Variables are covered by their own pull or by any report pull;
+        # the filtered rows confirm the report actually contains them
+        return value in self.variables or bool(self.reports)
+
+
+def _fixed_fields(params):
+    """Filters that must match exactly for one result to contain another"""
+    return (
+        _lower_set(params.get('farmtype')),
+        _lower_set(params.get('category')),
+        str(params.get('category2') or '').lower(),
+    )
+
+
+def _units(params):
+    """
+    Content units a request asks for: ('report', name) or ('variable', id)
+
+    Requests naming both reports and variables aren't planned.
+    """
+    reports = _as_list(params.get('report'))
+    variables = _as_list(params.get('variable'))
+    if reports and variables:
+        return None
+    if reports:
+        return [('report', str(r).lower()) for r in dict.fromkeys(reports)]
+    return [('variable', v) for v in dict.fromkeys(variables)]
+
+
+def describe_plan(plan):
+    """One-line summary of a plan, e.g. for an X-Query-Plan header"""
+    if not plan:
+        return ''
+    parts = [plan['path']]
+    for field in ('slices', 'local', 'upstream', 'requests'):
+        if field in plan:
+            parts.append(f"{field}={plan[field]}")
+    parts.append(f"ms={plan['ms']}")
+    return '; '.join(parts)
+
+
+class LoadedResult:
+    """A held result read from the cache: its frame, original rows and expiry"""
+
+    def __init__(self, response, expires):
+        self.frame = SurveyFrame.from_response(response)
+        self.records = response.get('data') or []
+        self.expires = expires
+
+
+class QueryPlanner:
+    """
+    Plans get_survey_data requests against results already in the cache
+
+    A query is split into (year, state, report-or-variable) slices. Each
+    slice is filtered out of a held result that contains it when there is
+    one; the remaining slices are fetched upstream in as few requests as
+    possible and the pieces are stitched back together from the original
+    upstream rows, so the answer is what ARMS would have returned. It is
+    cached only until the first of its parts expires. The path each
+    query took is kept in last_plan() and counted in stats().
+    """
+
+    INDEX_REFRESH = 30.0
+    # Results registered here reach the shared index at most this often
+    INDEX_FLUSH = 5.0
+
+    def __init__(self, client, max_frames=None, index_refresh=None, index_flush=None):
+        self.client = client
+        self.cache = client.cache
+        self.max_frames = max_frames or int(os.getenv('ARMS_PLANNER_FRAMES', '32'))
+        self.index_refresh = (index_refresh if index_refresh is not None
+                              else float(os.getenv('ARMS_PLANNER_INDEX_REFRESH', self.INDEX_REFRESH)))
+        self.index_flush = (index_flush if index_flush is not None
+                            else float(os.getenv('ARMS_PLANNER_INDEX_FLUSH', self.INDEX_FLUSH)))
+        self._lock = threading.Lock()
+        self._dirty = {}
+        self._flush_timer = None
+        self._flushed_at = 0.0
+        self._entries = OrderedDict()
+        self._frames = OrderedDict()
+        self._loaded_at = 0.0
+        self._state_names = None
+        self._local = threading.local()
+        self.counts = dict.fromkeys(PATHS, 0)
+        reset_after_fork(self, '_after_fork')
+
+    def _after_fork(self):
+        # The flush timer didn't survive fork; the parent flushes its own entries
+        self._lock = threading.Lock()
+        self._dirty = {}
+        self._flush_timer = None
+
+    # ---- held results --------------------------------------------------
+
+    def register(self, key, params, expires, share=True):
+        """Record that the cache holds the surveydata result for params under key until expires"""
+        params = normalize_params(params)
+        with self._lock:
+            self._entries[key] = HeldResult(key, params, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+        if share:
+            with self._lock:
+                self._dirty[key] = [key, params, expires]
+            self._schedule_flush()
+
+    def _forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._frames.pop(key, None)
+
+    def _read_shared(self):
+        """[key, params, expires] of the held results other workers registered, unexpired"""
+        raw = self.cache.get_raw(SHARED_INDEX_KEY)
+        if not raw:
+            return []
+        try:
+            items = json.loads(raw)
+        except ValueError:
+            return []
+        now = time.time()
+        return [item for item in items if len(item) == 3 and item[2] > now]
+
+    def _schedule_flush(self):
+        # One pending write at a time, at most one per index_flush seconds, off the request thread
+        with self._lock:
+            if self._flush_timer is not None:
+                return
+            delay = max(0.0, self._flushed_at + self.index_flush - time.time())
+            self._flush_timer = threading.Timer(delay, self.flush_shared)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush_shared(self):
+        """Merge results registered here since the last flush into the shared index"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._flush_timer = None
+            self._flushed_at = time.time()
+        if not dirty:
+            return
+        # Read-merge-write; a lost update only costs a missed plan elsewhere
+        items = [item for item in self._read_shared() if item[0] not in dirty]
+        items.extend(dirty.values())
+        items = items[-MAX_ENTRIES:]
+        payload = json.dumps(items, separators=(',', ':')).encode('utf-8')
+        # The index lives as long as its longest-lived entry, then is purged like them
+        ttl = max(item[2] for item in items) - time.time()
+        self.cache.set_raw(SHARED_INDEX_KEY, 'surveydata', payload, ttl=ttl)
+
+    def _refresh_index(self):
+        """Merge results registered by other workers (at most every index_refresh seconds)"""
+        if time.time() - self._loaded_at < self.index_refresh:
+            return
+        self._loaded_at = time.time()
+        for key, params, expires in self._read_shared():
+            if key not in self._entries:
+                self.register(key, params, expires, share=False)
+
+    def entries(self):
+        """Held results that haven't expired"""
+        self._refresh_index()
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry.expires < now]
+            for key in expired:
+                self._entries.pop(key, None)
+                self._frames.pop(key, None)
+            return list(self._entries.values())
+
+    def _load(self, entry, fetched):
+        """LoadedResult for a held result, or None if it has left the cache"""
+        loaded = self._frames.get(entry.key)
+        if loaded is not None and loaded.expires >= time.time():
+            with self._lock:
+                if entry.key in self._frames:
+                    self._frames.move_to_end(entry.key)
+            return loaded
+
+        cached = fetched.get(entry.key)
+        if cached is None:
+            cached = self.cache.get_with_expiry(entry.key)
+        if cached is None or 'error' in cached[0]:
+            self._forget(entry.key)
+            return None
+        loaded = LoadedResult(*cached)
+        with self._lock:
+            self._frames[entry.key] = loaded
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        return loaded
+
+    def _state_name(self, state):
+        """Row 'state' value for a state id or code (None if unknown)"""
+        if self._state_names is None:
+            listing = self.client.get_states()
+            names = {}
+            for item in listing.get('data', []) if isinstance(listing, dict) else []:
+                if isinstance(item, dict) and item.get('name'):
+                    for field in ('id', 'code', 'name'):
+                        if item.get(field) is not None:
+                            names[str(item[field]).lower()] = item['name']
+            if not names:
+                # Try again on the next query rather than caching the failure
+                return None
+            self._state_names = names
+        return self._state_names.get(state)
+
+    # ---- planning ------------------------------------------------------
+
+    def _extract(self, entry, frame, year, state, unit, category_value):
+        """Rows for one slice of a held result"""
+        df = frame.df
+        if df.empty:
+            return df
+        mask = df['year'] == year
+        if entry.states != {state}:
+            name = self._state_name(state)
+            if name is None:
+                return None
+            mask &= df['state'] == name
+        kind, value = unit
+        if kind == 'report':
+            if len(entry.reports) > 1:
+                mask &= df['report'].astype(str).str.lower() == value
+        elif not (entry.variables == {value} and not entry.reports):
+            mask &= df['variable_id'] == value
+        if category_value is not None and entry.category_value is None:
+            mask &= df['category_value'] == category_value
+        return df[mask.fillna(False).astype(bool)]
+
+    def _cover(self, slices, params, fetched):
+        """Map each slice to (held result, its rows); uncovered slices are left out"""
+        fixed = _fixed_fields(params)
+        category_value = params.get('category_value')
+        candidates = [e for e in self.entries() if e.fixed == fixed]
+        covered = {}
+        for year, state, unit in slices:
+            for entry in candidates:
+                if not entry.may_cover(year, state, unit, category_value):
+                    continue
+                loaded = self._load(entry, fetched)
+                if loaded is None:
+                    continue
+                rows = self._extract(entry, loaded.frame, year, state, unit, category_value)
+                if rows is None:
+                    continue
+                if len(rows) or entry.names(year, state, unit):
+                    covered[(year, state, unit)] = (loaded, rows)
+                    break
+        return covered
+
+    def may_answer(self, params):
+        """
+        True if held results might cover some slice of a request
+
+        Only the request bodies of held results are consulted, so this is
+        cheap enough to decide whether a query needs upstream at all.
+        """
+        units = _units(params)
+        if not units:
+            return False
+        fixed = _fixed_fields(params)
+        candidates = [e for e in self.entries() if e.fixed == fixed]
+        category_value = params.get('category_value')
+        return any(entry.may_cover(year, str(state).lower(), unit, category_value)
+                   for year in _as_list(params.get('year'))
+                   for state in _as_list(params.get('state')) or ['all']
+                   for unit in units
+                   for entry in candidates)
+
+    def _missing_requests(self, missing, params):
+        """
+        Group missing slices into upstream request bodies
+
+        Years sharing the same states and units go into one request.
+        """
+        by_year = OrderedDict()
+        for year, state, unit in missing:
+            states, units = by_year.setdefault(year, (OrderedDict(), OrderedDict()))
+            states[state] = True
+            units[unit] = True
+
+        groups = OrderedDict()
+        for year, (states, units) in by_year.items():
+            groups.setdefault((tuple(states), tuple(units)), []).append(year)
+
+        original = {str(r).lower(): r for r in _as_list(params.get('report'))}
+        original_states = {str(s).lower(): s for s in _as_list(params.get('state'))}
+        bodies = []
+        for (states, units), years in groups.items():
+            body = {k: v for k, v in params.items() if k not in ('year', 'state', 'report', 'variable')}
+            body['year'] = years
+            body['state'] = [original_states.get(s, s) for s in states]
+            if units[0][0] == 'report':
+                body['report'] = [original.get(value, value) for _, value in units]
+            else:
+                body['variable'] = [value for _, value in units]
+            bodies.append(body)
+        return bodies
+
+    def _fetch(self, params, serve_stale=True):
+        """Upstream request for params, cached and registered on success; (key, result, expires)"""
+        key = make_cache_key('surveydata', params, 'POST')
+        result = self.client._fetch_and_cache('surveydata', params, 'POST', key, serve_stale=False)
+        expires = time.time() + ttl_for('surveydata', self.cache.ttls)
+        if 'error' not in result:
+            self.register(key, params, expires)
+        elif serve_stale:
+            # An expired copy answers this request but isn't held for planning
+            result = self.client._stale('surveydata', params, 'POST', key, result)
+        return key, result, expires
+
+    def execute(self, params):
+        """Answer a surveydata request body, recording the plan it took"""
+        start = time.perf_counter()
+        key = make_cache_key('surveydata', params, 'POST')
+        entry = self.cache.get_with_expiry(key)
+        if entry is not None:
+            # Whoever fetched it registered it; other workers pick it up from the shared index
+            return self._done({'path': 'cache'}, start, entry[0])
+
+        units = _units(params)
+        slices = []
+        if units:
+            slices = [(year, str(state).lower(), unit)
+                      for year in _as_list(params.get('year'))
+                      for state in _as_list(params.get('state')) or ['all']
+                      for unit in units]
+        fetched = {}
+        covered = self._cover(slices, params, fetched) if slices else {}
+        if not covered:
+            _, result, _ = self._fetch(params)
+            return self._done({'path': 'upstream', 'slices': len(slices), 'upstream': len(slices),
+                               'requests': 1}, start, result)
+
+        missing = [s for s in slices if s not in covered]
+        bodies = self._missing_requests(missing, params)
+        # No stale fallback per part: the assembled result is cached as fresh
+        if len(bodies) > 1:
+            futures = [self.client._submit(self._fetch, body, False) for body in bodies]
+            responses = [future.result() for future in futures]
+        else:
+            responses = [self._fetch(body, False) for body in bodies]
+        for fetched_key, response, expires in responses:
+            if 'error' in response:
+                # Fall back to an expired copy of the whole result, if any
+                response = self.client._stale('surveydata', params, 'POST', key, response)
+                return self._done({'path': 'partial', 'slices': len(slices), 'local': len(covered),
+                                   'upstream': len(missing), 'requests': len(bodies)},
+                                  start, response)
+            fetched[fetched_key] = (response, expires)
+        if missing:
+            covered.update(self._cover(missing, params, fetched))
+
+        # Stitch the upstream rows themselves back together, so values keep
+        # their JSON types (a frame would turn ints with gaps into floats)
+        parts = [covered[s] for s in slices if s in covered]
+        data = [dict(loaded.records[i]) for loaded, rows in parts for i in rows.index]
+        meta = parts[0][0].frame.meta if parts else {}
+        result = dict(meta, data=data)
+        # Fresh only as long as the part that expires first
+        ttl = min(loaded.expires for loaded, _ in parts) - time.time() if parts else 0
+        if ttl > 0:
+            self.cache.set(key, 'surveydata', result, ttl=ttl)
+
+        plan = {'path': 'partial' if missing else 'local', 'slices': len(slices),
+                'local': len(slices) - len(missing), 'upstream': len(missing),
+                'requests': len(bodies)}
+        return self._done(plan, start, result)
+
+    def _done(self, plan, start, result):
+        plan['ms'] = round((time.perf_counter() - start) * 1000, 2)
+        self._local.plan = plan
+        with self._lock:
+            self.counts[plan['path']] += 1
+        return result
+
+    def last_plan(self):
+        """Plan taken by the last query executed on this thread"""
+        return getattr(self._local, 'plan', None)
+
+    def clear_plan(self):
+        self._local.plan = None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            held = len(self._entries)
+        return dict(counts, held_results=held)
+
+
+def planner_from_env(client):
+    """Planner for client unless disabled with ARMS_PLANNER_ENABLED=0 or caching is off"""
+    if client.cache is None:
+        return None
+    if os.getenv('ARMS_PLANNER_ENABLED', '1').lower() in ('0', 'false', 'no'):
+        return None
+    return QueryPlanner(client)
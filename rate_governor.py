@@ -0,0 +1,317 @@
+"""
+Upstream rate governor for the USDA ARMS API
+A token bucket shared by every thread and worker process on the host, with
+priority classes so user-facing requests get upstream capacity first
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+from forksafe import reset_after_fork
+
+
+# Highest priority first
+PRIORITIES = ('interactive', 'batch', 'background')
+
+# Share of the burst each class leaves untouched for the classes above it,
+# so a busy background job can't drain the tokens interactive requests need
+RESERVES = {'interactive': 0.0, 'batch': 0.25, 'background': 0.5}
+
+DEFAULT_RATE = '1000/hour'
+# Each per-year shard of a multi-year query is its own ARMS call and token; a
+# full 1996-2023 fan-out is 28, so this leaves room for four of them at once
+DEFAULT_BURST = '120'
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'cache', 'rate_governor.bucket')
+
+# tokens, last refill time, throttled-until time
+_STATE = struct.Struct('<ddd')
+
+_UNITS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60,
+          'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+_priority = contextvars.ContextVar('arms_priority', default='interactive')
+
+
+def parse_rate(value):
+    """Requests per second from '5', '300/minute' or '1000/hour'; None for 'off'"""
+    value = str(value).strip().lower()
+    if value in ('', '0', 'off', 'none', 'false'):
+        return None
+    if '/' not in value:
+        return float(value)
+    count, unit = value.split('/', 1)
+    unit = unit.strip()
+    if unit not in _UNITS and unit.endswith('s') and unit[:-1] in _UNITS:
+        unit = unit[:-1]
+    if unit not in _UNITS:
+        raise ValueError(f"Unknown rate unit: {unit}")
+    return float(count) / _UNITS[unit]
+
+
+@contextlib.contextmanager
+def priority(name):
+    """
+    Run the enclosed upstream calls at the given priority class
+
+    The class follows the current context; work handed to other threads
+    keeps it only if submitted with contextvars.copy_context().run.
+    """
+    if name not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class RateGovernor:
+    """
+    Token bucket in front of every upstream ARMS call
+
+    Within a process, waiting callers queue by priority class and then
+    arrival, and only the head of the queue draws tokens. The bucket
+    itself lives in a small flock-protected file when state_path is set,
+    so all workers on the host draw from the same budget; lower classes
+    only take a token while the bucket stays above their reserve. After a
+    429, throttle() holds back everything but interactive requests.
+    """
+
+    # Longest sleep between checks; other workers may have refilled or drained the bucket
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, rate, burst=None, state_path=None, max_wait=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self.state_path = state_path if fcntl is not None else None
+        if self.state_path:
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        self.max_wait = max_wait
+
+        self._local_state = (self.burst, time.time(), 0.0)
+        self._fd = None
+        self._fd_pid = None
+        self._seq = itertools.count()
+        self._reset()
+
+        reset_after_fork(self, '_reset')
+
+    def _reset(self):
+        # Waiters and counters belong to the parent; the child starts clean
+        self._cond = threading.Condition()
+        self._waiters = []
+        # Queue entry -> (event loop, asyncio.Event) for acquire_async callers
+        self._async_waiters = {}
+        self._stats = {name: {'waiting': 0, 'granted': 0, 'rejected': 0,
+                              'wait_total': 0.0, 'wait_max': 0.0} for name in PRIORITIES}
+
+    def _file(self):
+        """State file descriptor; flock is per open file, so each process opens its own"""
+        pid = os.getpid()
+        if self._fd is None or self._fd_pid != pid:
+            self._fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._fd_pid = pid
+        return self._fd
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Current (tokens, updated, throttled_until), refilled to now; yields a setter"""
+        now = time.time()
+        if not self.state_path:
+            box = list(self._local_state)
+            yield now, box
+            self._local_state = tuple(box)
+            return
+
+        fd = self._file()
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            raw = os.pread(fd, _STATE.size, 0)
+            box = list(_STATE.unpack(raw)) if len(raw) == _STATE.size else [self.burst, now, 0.0]
+            yield now, box
+            os.pwrite(fd, _STATE.pack(*box), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _try_take(self, name):
+        """Take a token for a class; returns 0 on success or the seconds to wait"""
+        with self._state() as (now, box):
+            tokens, updated, throttled_until = box
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            box[0], box[1] = tokens, now
+            if name != 'interactive' and now < throttled_until:
+                return throttled_until - now
+            floor = RESERVES[name] * self.burst
+            if tokens - 1 >= floor:
+                box[0] = tokens - 1
+                return 0
+            return (floor + 1 - tokens) / self.rate
+
+    def _enqueue(self, name):
+        # Under self._cond
+        entry = (PRIORITIES.index(name), next(self._seq))
+        heapq.heappush(self._waiters, entry)
+        self._stats[name]['waiting'] += 1
+        return entry
+
+    def _poll(self, entry, name):
+        """Under self._cond: 0 if entry got a token, else seconds to wait (None if not at the head)"""
+        if self._waiters[0] != entry:
+            return None
+        delay = self._try_take(name)
+        if delay == 0:
+            heapq.heappop(self._waiters)
+        return delay
+
+    def _leave(self, entry, name, granted, waited):
+        # Under self._cond
+        stats = self._stats[name]
+        stats['waiting'] -= 1
+        if granted:
+            stats['granted'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+        else:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            stats['rejected'] += 1
+        # The next waiter in line may be able to go now
+        self._cond.notify_all()
+        for loop, wake in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                # Loop closed; its waiter is gone
+                pass
+
+    def _next_wait(self, delay, waited, limit):
+        timeout = self.POLL_INTERVAL if delay is None else min(delay, self.POLL_INTERVAL)
+        if limit is not None:
+            timeout = min(timeout, limit - waited)
+        return timeout
+
+    def acquire(self, name=None):
+        """
+        Wait for a token at the current (or given) priority class
+
+        Returns False if max_wait passed first; background callers always
+        wait.
+        """
+        name = name or current_priority()
+        limit = None if name == 'background' else self.max_wait
+        start = time.perf_counter()
+
+        with self._cond:
+            entry = self._enqueue(name)
+            granted = False
+            try:
+                while True:
+                    delay = self._poll(entry, name)
+                    if delay == 0:
+                        granted = True
+                        break
+                    waited = time.perf_counter() - start
+                    if limit is not None and waited >= limit:
+                        break
+                    self._cond.wait(self._next_wait(delay, waited, limit))
+            finally:
+                self._leave(entry, name, granted, time.perf_counter() - start)
+        return granted
+
+    async def acquire_async(self, name=None):
+        """
+        acquire() for coroutines: waits on the event loop, not in a thread
+
+        Shares the queue with acquire(), so async and thread callers in
+        this process are served in one priority order.
+        """
+        name = name or current_priority()
+        limit = None if name == 'background' else self.max_wait
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        with self._cond:
+            entry = self._enqueue(name)
+            self._async_waiters[entry] = (loop, wake)
+        granted = False
+        try:
+            while True:
+                wake.clear()
+                with self._cond:
+                    delay = self._poll(entry, name)
+                if delay == 0:
+                    granted = True
+                    break
+                waited = time.perf_counter() - start
+                if limit is not None and waited >= limit:
+                    break
+                try:
+                    await asyncio.wait_for(wake.wait(), self._next_wait(delay, waited, limit))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._async_waiters.pop(entry, None)
+                self._leave(entry, name, granted, time.perf_counter() - start)
+        return granted
+
+    def throttle(self, seconds):
+        """ARMS answered 429: hold back batch and background calls for a while"""
+        with self._cond, self._state() as (now, box):
+            box[2] = max(box[2], now + float(seconds))
+
+    def stats(self):
+        """Queue depth and wait times per class for this worker, plus the shared bucket"""
+        with self._cond:
+            with self._state() as (now, box):
+                tokens = min(self.burst, box[0] + max(0.0, now - box[1]) * self.rate)
+                throttled = max(0.0, box[2] - now)
+            classes = {}
+            for name, stats in self._stats.items():
+                classes[name] = {
+                    'queue_depth': stats['waiting'],
+                    'granted': stats['granted'],
+                    'rejected': stats['rejected'],
+                    'wait_avg_ms': round(stats['wait_total'] / stats['granted'] * 1000, 2)
+                    if stats['granted'] else 0.0,
+                    'wait_max_ms': round(stats['wait_max'] * 1000, 2),
+                }
+        return {
+            'rate_per_s': self.rate,
+            'burst': self.burst,
+            'tokens': round(tokens, 2),
+            'throttled_for_s': round(throttled, 2),
+            'shared': bool(self.state_path),
+            'classes': classes,
+        }
+
+
+def governor_from_env():
+    """Governor configured by ARMS_RATE_* variables, or None when ARMS_RATE_LIMIT=off"""
+    rate = parse_rate(os.getenv('ARMS_RATE_LIMIT', DEFAULT_RATE))
+    if rate is None:
+        return None
+    state_path = os.getenv('ARMS_RATE_STATE_PATH', DEFAULT_STATE_PATH)
+    if state_path.lower() in ('', 'off', 'none'):
+        state_path = None
+    return RateGovernor(rate, burst=float(os.getenv('ARMS_RATE_BURST', DEFAULT_BURST)),
+                        state_path=state_path,
+                        max_wait=float(os.getenv('ARMS_RATE_MAX_WAIT', '15')))
@@ -0,0 +1,197 @@
+"""
+Server-side paging, projection, sorting and filtering of surveydata results
+Results are held as SurveyFrames per query, so paging through a large result
+re-reads neither ARMS nor the response cache
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import FALLBACK_TTL, make_cache_key
+from circuit_breaker import fresh_until, served_stale
+from survey_frame import SurveyFrame
+
+
+# Request fields that shape the view rather than the upstream query
+VIEW_PARAMS = ('columns', 'sort', 'order', 'filters', 'q', 'offset', 'limit', 'cursor')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = int(os.getenv('ARMS_MAX_PAGE_SIZE', '1000'))
+
+
+def wants_view(data):
+    """True if the request asks for a page rather than the whole result"""
+    return any(name in data for name in VIEW_PARAMS)
+
+
+def _as_list(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return list(value)
+
+
+def view_signature(options):
+    """Short hash of everything that orders or selects rows"""
+    payload = json.dumps([options['sort'], options['descending'], options['filters'], options['q']],
+                         sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def encode_cursor(offset, signature):
+    raw = json.dumps({'o': offset, 'v': signature}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, signature):
+    """Offset stored in a cursor; raises ValueError if it belongs to another view"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        offset = int(payload['o'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+    if payload.get('v') != signature:
+        raise ValueError('Cursor does not match the requested sort or filters')
+    return offset
+
+
+def view_options(data):
+    """Parse and validate the view fields of a request; raises ValueError"""
+    filters = data.get('filters') or {}
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+    if not isinstance(filters, dict):
+        raise ValueError('filters must be an object of column: value')
+
+    order = str(data.get('order') or 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+
+    limit = int(data.get('limit') or DEFAULT_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+
+    options = {
+        'columns': _as_list(data.get('columns')),
+        'sort': data.get('sort') or None,
+        'descending': order == 'desc',
+        'filters': filters,
+        'q': str(data.get('q') or '').strip(),
+        'limit': min(limit, MAX_PAGE_SIZE),
+    }
+    signature = view_signature(options)
+    if data.get('cursor'):
+        offset = decode_cursor(str(data['cursor']), signature)
+    else:
+        offset = int(data.get('offset') or 0)
+    if offset < 0:
+        raise ValueError('offset must not be negative')
+    options['offset'] = offset
+    options['signature'] = signature
+    return options
+
+
+class ResultViews:
+    """
+    Pages over query results held in memory
+
+    Keeps an LRU of SurveyFrames per query, plus the sorted/filtered
+    frames derived from them, so each page is a slice of an existing
+    frame. Entries expire with the cached responses they were built from
+    (FALLBACK_TTL when that isn't known). A miss rebuilds from fetch(),
+    which the client answers from the response cache.
+    """
+
+    def __init__(self, max_frames=None):
+        self.max_frames = max_frames or int(os.getenv('ARMS_VIEW_FRAMES', '16'))
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()
+
+    def _lru_get(self, key):
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                return None
+            frame, expires = entry
+            if expires < time.time():
+                del self._frames[key]
+                return None
+            self._frames.move_to_end(key)
+            return entry
+
+    def _lru_put(self, key, frame, expires):
+        with self._lock:
+            self._frames[key] = (frame, expires)
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+    def frame(self, path, query, fetch):
+        """
+        (key, SurveyFrame, expires) for a query, building it from fetch() on a miss
+
+        Returns (error response, None, None) if fetch() fails.
+        """
+        key = make_cache_key(path, query, 'POST')
+        entry = self._lru_get(key)
+        if entry is not None:
+            return (key,) + entry
+        result = fetch()
+        if 'error' in result:
+            return result, None, None
+        frame = SurveyFrame.from_response(result)
+        expires = fresh_until() or time.time() + FALLBACK_TTL
+        # Stale results are used for this request only
+        if not served_stale():
+            self._lru_put(key, frame, expires)
+        return key, frame, expires
+
+    def respond(self, path, data, fetch):
+        """
+        Response for a report request
+
+        Without view fields this is fetch() unchanged. With them, it is
+        one page of the (filtered, sorted, projected) result plus a
+        'page' object. Invalid view fields raise ValueError.
+        """
+        if not wants_view(data):
+            return fetch()
+        options = view_options(data)
+
+        query = {k: v for k, v in data.items() if k not in VIEW_PARAMS}
+        key, frame, expires = self.frame(path, query, fetch)
+        if frame is None:
+            return key
+
+        view_key = (key, options['signature'])
+        entry = self._lru_get(view_key)
+        if entry is not None:
+            view = entry[0]
+        else:
+            view = frame.filter(**options['filters'])
+            view = view.contains_text(options['q'])
+            view = view.sort(options['sort'], descending=options['descending'])
+            if not served_stale():
+                self._lru_put(view_key, view, expires)
+
+        offset, limit = options['offset'], options['limit']
+        page = view.slice(offset, limit).select(options['columns'])
+        total = len(view)
+        next_offset = offset + limit
+        return dict(page.to_response(), page={
+            'offset': offset,
+            'limit': limit,
+            'total': total,
+            'count': len(page),
+            'next_cursor': encode_cursor(next_offset, options['signature']) if next_offset < total else None,
+            'prev_cursor': (encode_cursor(max(offset - limit, 0), options['signature'])
+                            if offset > 0 else None),
+            'columns': frame.columns,
+        })
@@ -0,0 +1,122 @@
+"""
+Single-flight coalescing of identical concurrent upstream requests
+Concurrent callers asking for the same key wait on one in-flight call and share its result
+"""
+
+import copy
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+from forksafe import reset_after_fork
+
+
+# Number of lock files used for cross-process coalescing; keys hash onto these
+LOCK_STRIPES = 256
+
+
+class _Call:
+    """One in-flight call and the callers waiting on it"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce duplicate calls across threads, and optionally across processes
+
+    Within a process, the first caller for a key runs the function and
+    later callers block until it finishes. When lock_dir is set, the
+    leader also takes a per-key file lock so leaders in other worker
+    processes queue behind it; once the lock is acquired, recheck() is
+    consulted (typically a shared cache lookup) before going upstream.
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir if lock_dir is not None else os.getenv('ARMS_SINGLEFLIGHT_LOCK_DIR')
+        if self.lock_dir and fcntl is None:
+            self.lock_dir = None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+        reset_after_fork(self, '_reset')
+
+    def _reset(self):
+        # In-flight calls belong to the parent; the child starts clean
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self):
+        """Number of distinct keys currently being fetched"""
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, fn, recheck=None):
+        """
+        Run fn() once for all concurrent callers of key
+
+        Args:
+            key: Hashable identity of the call (e.g. the cache key)
+            fn: Zero-argument function performing the upstream call
+            recheck: Optional zero-argument function returning a result
+                produced meanwhile by another process, or None
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            # Followers get their own copy so callers can't mutate each other's data
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self._run_leader(key, fn, recheck)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _run_leader(self, key, fn, recheck):
+        if not self.lock_dir or recheck is None:
+            return fn()
+
+        with open(self._lock_path(key), 'a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                result = recheck()
+                if result is not None:
+                    return result
+                return fn()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _lock_path(self, key):
+        digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+        stripe = int(digest[:8], 16) % LOCK_STRIPES
+        return os.path.join(self.lock_dir, f"singleflight-{stripe:03d}.lock")
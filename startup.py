@@ -0,0 +1,282 @@
+"""
+Worker startup for the Farm Financial Intelligence Platform
+Defers heavy imports (pandas, numpy, httpx) until a request needs them,
+preloads them and other read-only data in the gunicorn master when
+preloading so workers share the pages copy-on-write, and records how long
+each startup phase took.
+
+Usage:
+    python startup.py            # compare cold import, preload and first-request times
+"""
+
+import contextlib
+import gc
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+
+from dotenv import load_dotenv
+
+from forksafe import reset_after_fork
+
+
+# Imported by preload(); everything else the request path imports is light
+HEAVY_MODULES = ('numpy', 'pandas', 'httpx')
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+_report = {
+    'pid': os.getpid(),
+    'preloaded': False,
+    'forked': False,
+    'phases_ms': {},
+    'first_request_ms': None,
+}
+_env_loaded = False
+_lazy_modules = []
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access
+
+        pd = lazy_module('pandas')   # no import yet
+        pd.DataFrame(...)            # imports pandas now
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            if self.__name__ in sys.modules:
+                module = sys.modules[self.__name__]
+            else:
+                with phase(f"import {self.__name__}"):
+                    module = importlib.import_module(self.__name__)
+            # Later lookups then find attributes directly, without __getattr__
+            self.__dict__.update(module.__dict__)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name):
+    """The module itself if already imported, else a LazyModule for it"""
+    if name in sys.modules:
+        return sys.modules[name]
+    module = LazyModule(name)
+    _lazy_modules.append(module)
+    return module
+
+
+class LazyObject:
+    """
+    Stand-in for an object that is built on first attribute access
+
+        client = lazy(USDAClient, 'client')   # nothing built yet
+        client.get_years()                    # USDAClient() runs now
+    """
+
+    def __init__(self, factory, name):
+        self.__dict__.update(_factory=factory, _name=name, _target=None,
+                             _target_lock=threading.Lock())
+        reset_after_fork(self, '_after_fork')
+
+    def _after_fork(self):
+        # A build may have been under way on another thread of the parent
+        self.__dict__['_target_lock'] = threading.Lock()
+
+    def _load(self):
+        target = self.__dict__['_target']
+        if target is None:
+            with self.__dict__['_target_lock']:
+                target = self.__dict__['_target']
+                if target is None:
+                    with phase(self.__dict__['_name']):
+                        target = self.__dict__['_factory']()
+                    self.__dict__['_target'] = target
+        return target
+
+    @property
+    def loaded(self):
+        return self.__dict__['_target'] is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        if not self.loaded:
+            return f"<lazy {self.__dict__['_name']} (not built)>"
+        return repr(self.__dict__['_target'])
+
+
+def lazy(factory, name):
+    """A LazyObject calling factory() the first time it is used"""
+    return LazyObject(factory, name)
+
+
+def load_env():
+    """Load .env into the environment once (real environment variables win)"""
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a startup phase for the report"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        with _lock:
+            _report['phases_ms'][name] = elapsed
+
+
+def mark_ready(name='app ready'):
+    """Record the time since the process (or, after fork, the worker) started"""
+    with _lock:
+        _report['phases_ms'][name] = round((time.perf_counter() - _started) * 1000, 1)
+
+
+def mark_request():
+    """Record the time to the first request handled by this process"""
+    if _report['first_request_ms'] is None:
+        with _lock:
+            if _report['first_request_ms'] is None:
+                _report['first_request_ms'] = round((time.perf_counter() - _started) * 1000, 1)
+
+
+def preload():
+    """
+    Import the heavy modules and freeze the heap before workers are forked
+
+    gc.freeze() moves everything allocated so far out of the collector's
+    reach, so collections in the workers don't write to (and un-share)
+    the pages inherited from the master.
+    """
+    with phase('preload'):
+        for name in HEAVY_MODULES:
+            with phase(f"import {name}"):
+                importlib.import_module(name)
+        for module in _lazy_modules:
+            module._load()
+        gc.collect()
+        gc.freeze()
+    with _lock:
+        _report['preloaded'] = True
+
+
+def preload_catalog(catalog, timeout=None):
+    """
+    Fill a catalog that has no snapshot from ARMS, within about timeout seconds
+
+    Runs in the master so forked workers start with the listings. The
+    fetch happens on this thread, through a client of its own whose calls
+    give up in time and don't retry, so nothing is left running (or
+    holding a lock) when the workers fork; whatever isn't loaded by then
+    is filled in by the workers' refresh threads.
+    """
+    if timeout is None:
+        timeout = float(os.getenv('ARMS_PRELOAD_CATALOG_TIMEOUT', '10'))
+    if timeout <= 0 or catalog.loaded_at is not None:
+        return False
+
+    from api_client import USDAClient
+    from http_session import RetryPolicy
+    from metadata_catalog import ENTRIES
+
+    with phase('preload catalog'):
+        # Connect and read each get half of one listing's share of the budget
+        per_call = timeout / len(ENTRIES) / 2
+        preload_client = USDAClient(connect_timeout=per_call, read_timeout=per_call,
+                                    retry_policy=RetryPolicy(max_retries=0),
+                                    mirror=False, planner=False, governor=False, breaker=False)
+        app_client, catalog.client = catalog.client, preload_client
+        try:
+            return catalog.fill_missing()
+        except Exception:
+            return False
+        finally:
+            catalog.client = app_client
+            # Timeouts under the preload's short budget say little about ARMS
+            catalog.clear_failures()
+            preload_client.sessions.close()
+
+
+def _after_fork():
+    # Phases so far belong to the master; the worker's clock starts now
+    global _started, _lock
+    _started = time.perf_counter()
+    _lock = threading.Lock()
+    _report.update(pid=os.getpid(), forked=True, first_request_ms=None,
+                   phases_ms={f"master: {k}": v for k, v in _report['phases_ms'].items()
+                              if not k.startswith('master: ')})
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def report():
+    """Startup phases of this process in milliseconds"""
+    with _lock:
+        return dict(_report, phases_ms=dict(_report['phases_ms']))
+
+
+def _measure(code, env):
+    # Wall time of a fresh interpreter running code, in milliseconds
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return round((time.perf_counter() - start) * 1000, 1), output.strip()
+
+
+def main():
+    """Time worker startup with and without preloading, in fresh interpreters"""
+    import json
+    import tempfile
+
+    workdir = tempfile.mkdtemp(prefix='arms-startup-')
+    env = dict(os.environ,
+               USDA_API_KEY=os.getenv('USDA_API_KEY', 'startup-report'),
+               ARMS_CACHE_PATH=os.path.join(workdir, 'cache.sqlite3'),
+               ARMS_RATE_STATE_PATH=os.path.join(workdir, 'rate.bucket'),
+               ARMS_LOG_SAMPLE='0')
+    report_code = 'import json, startup; print(json.dumps(startup.report()))'
+    cases = {
+        'import app (lazy)': 'import app; ' + report_code,
+        'import app + preload': 'import app, startup; startup.preload(); ' + report_code,
+        'import app + first frame (lazy)': (
+            'import app, survey_frame; survey_frame.SurveyFrame.from_response({"data": []}); '
+            + report_code),
+    }
+    print(f"{'case':<40}{'wall ms':>10}")
+    details = {}
+    for name, code in cases.items():
+        elapsed, output = _measure(code, env)
+        details[name] = json.loads(output.splitlines()[-1])
+        print(f"{name:<40}{elapsed:>10}")
+    print()
+    print(json.dumps(details, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -33,10 +33,135 @@ function openTab(tabName, buttonElement) {
     buttonElement.classList.add('active');
 }
 
+// Report responses kept for revalidation with If-None-Match
+const responseCache = new Map();
+const RESPONSE_CACHE_SIZE = 20;
+
+// Compact response format: columns instead of rows, repeated strings sent once
+const COLUMNAR_TYPE = 'application/vnd.arms.columnar+json';
+const COLUMNAR_FORMAT = 'arms-columnar/1';
+
+// Turn a columnar payload's data back into row objects (other payloads pass through)
+function decodeColumnar(payload) {
+    const block = payload && payload.data;
+    if (!block || block.format !== COLUMNAR_FORMAT) {
+        return payload;
+    }
+    const names = Object.keys(block.columns);
+    const columns = names.map(name => {
+        const column = block.columns[name];
+        if (column.type === 'dict') {
+            const dictionary = column.dict;
+            return column.codes.map(code => dictionary[code]);
+        }
+        return column.values;
+    });
+    const rows = new Array(block.rows);
+    for (let i = 0; i < block.rows; i++) {
+        const row = {};
+        for (let j = 0; j < names.length; j++) {
+            row[names[j]] = columns[j][i];
+        }
+        rows[i] = row;
+    }
+    payload.data = rows;
+    return payload;
+}
+
+// POST a JSON query, reusing the cached body when the server answers 304
+async function postJSON(url, payload) {
+    const body = JSON.stringify(payload);
+    const key = `${url}|${body}`;
+    const cached = responseCache.get(key);
+    
+    const headers = {
+        'Content-Type': 'application/json',
+        'Accept': `${COLUMNAR_TYPE}, application/json`
+    };
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+    
+    const response = await fetch(url, { method: 'POST', headers, body });
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    
+    const data = decodeColumnar(await response.json());
+    const etag = response.headers.get('ETag');
+    if (etag && !data.error) {
+        responseCache.delete(key);
+        responseCache.set(key, { etag, data });
+        if (responseCache.size > RESPONSE_CACHE_SIZE) {
+            responseCache.delete(responseCache.keys().next().value);
+        }
+    }
+    return data;
+}
+
+// Rows per page; sorting, searching and paging run on the server
+const PAGE_SIZE = 100;
+
+// Columns shown in result tables (the server sends only these)
+const TABLE_COLUMNS = [
+    'year', 'state', 'category', 'category_value', 'variable_name',
+    'estimate', 'median', 'rse', 'variable_unit'
+];
+
+// Per-section table state: query, sort, search text and page cursor
+const tableViews = {};
+
+// Start a new table query and fetch its first page
+async function loadTable(section, url, payload) {
+    tableViews[section] = { url, payload, sort: null, order: 'asc', q: '', cursor: null };
+    return fetchPage(section);
+}
+
+// Fetch the current page of a section's table
+async function fetchPage(section) {
+    const view = tableViews[section];
+    const request = Object.assign({}, view.payload, {
+        columns: TABLE_COLUMNS,
+        limit: PAGE_SIZE,
+        order: view.order
+    });
+    if (view.sort) request.sort = view.sort;
+    if (view.q) request.q = view.q;
+    if (view.cursor) {
+        request.cursor = view.cursor;
+    } else {
+        request.offset = 0;
+    }
+    return postJSON(view.url, request);
+}
+
+// Re-fetch and redraw a section's table after a sort, search or page change
+async function refreshTable(section) {
+    try {
+        const data = await fetchPage(section);
+        if (data.error) {
+            showError(section, data.error);
+        } else {
+            hideError(section);
+            displayTableData(section, data);
+        }
+    } catch (error) {
+        showError(section, 'Failed to fetch data: ' + error.message);
+    }
+}
+
 // Load available years
+// Retry delay for lookup listings the server is still loading
+const CATALOG_RETRY_MS = 5000;
+
 async function loadYears() {
     try {
         const response = await fetch('/api/years');
+        if (response.status === 503) {
+            // Listing not loaded from ARMS yet; the server is fetching it
+            setTimeout(loadYears, CATALOG_RETRY_MS);
+            return;
+        }
         const data = await response.json();
         
         if (data.data) {
@@ -62,6 +187,11 @@ async function loadYears() {
 async function loadStates() {
     try {
         const response = await fetch('/api/states');
+        if (response.status === 503) {
+            // Listing not loaded from ARMS yet; the server is fetching it
+            setTimeout(loadStates, CATALOG_RETRY_MS);
+            return;
+        }
         const data = await response.json();
         
         if (data.data) {
@@ -99,18 +229,12 @@ async function fetchIncomeStatement() {
     hideError('income');
     
     try {
-        const response = await fetch('/api/income-statement', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                years: selectedYears,
-                state: state,
-                category: category || undefined
-            })
+        const data = await loadTable('income', '/api/income-statement', {
+            years: selectedYears,
+            state: state,
+            category: category || undefined
         });
         
-        const data = await response.json();
-        
         if (data.error) {
             showError('income', data.error);
         } else if (data.data && data.data.length > 0) {
@@ -141,18 +265,12 @@ async function fetchBalanceSheet() {
     hideError('balance');
     
     try {
-        const response = await fetch('/api/balance-sheet', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                years: selectedYears,
-                state: state,
-                category: category || undefined
-            })
+        const data = await loadTable('balance', '/api/balance-sheet', {
+            years: selectedYears,
+            state: state,
+            category: category || undefined
         });
         
-        const data = await response.json();
-        
         if (data.error) {
             showError('balance', data.error);
         } else if (data.data && data.data.length > 0) {
@@ -183,18 +301,12 @@ async function fetchFinancialRatios() {
     hideError('ratios');
     
     try {
-        const response = await fetch('/api/financial-ratios', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                years: selectedYears,
-                state: state,
-                category: category || undefined
-            })
+        const data = await loadTable('ratios', '/api/financial-ratios', {
+            years: selectedYears,
+            state: state,
+            category: category || undefined
         });
         
-        const data = await response.json();
-        
         if (data.error) {
             showError('ratios', data.error);
         } else if (data.data && data.data.length > 0) {
@@ -225,18 +337,12 @@ async function fetchStructuralCharacteristics() {
     hideError('structure');
     
     try {
-        const response = await fetch('/api/structural-characteristics', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                years: selectedYears,
-                state: state,
-                category: category || undefined
-            })
+        const data = await loadTable('structure', '/api/structural-characteristics', {
+            years: selectedYears,
+            state: state,
+            category: category || undefined
         });
         
-        const data = await response.json();
-        
         if (data.error) {
             showError('structure', data.error);
         } else if (data.data && data.data.length > 0) {
@@ -281,13 +387,7 @@ async function performComparison() {
     }
     
     try {
-        const response = await fetch(endpoint, {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({ year, report })
-        });
-        
-        const data = await response.json();
+        const data = await loadTable('compare', endpoint, { year, report });
         
         if (data.error) {
             showError('compare', data.error);
@@ -303,54 +403,101 @@ async function performComparison() {
     }
 }
 
-// Display table data
+// Display table data (one page of a server-side view)
 function displayTableData(section, data) {
     const thead = document.getElementById(`${section}-thead`);
     const tbody = document.getElementById(`${section}-tbody`);
+    const view = tableViews[section] || {};
+    const page = data.page || { offset: 0, total: (data.data || []).length };
     
     thead.innerHTML = '';
     tbody.innerHTML = '';
     
-    if (!data.data || data.data.length === 0) {
-        tbody.innerHTML = '<tr><td colspan="10" style="text-align:center;">No data available</td></tr>';
-        return;
-    }
-    
-    // Create header
+    // Create header (JSON object keys arrive sorted, so use the table's column order)
+    const present = data.data && data.data.length > 0 ? Object.keys(data.data[0]) : page.columns;
+    const keys = data.page
+        ? TABLE_COLUMNS.filter(key => !present || present.includes(key))
+        : present || [];
     const headerRow = document.createElement('tr');
-    const keys = Object.keys(data.data[0]);
     
-    keys.forEach((key, index) => {
+    keys.forEach(key => {
         const th = document.createElement('th');
         th.textContent = formatColumnName(key);
-        th.onclick = () => sortTable(`${section}-table`, index);
+        if (view.sort === key) {
+            th.textContent += view.order === 'asc' ? ' ▲' : ' ▼';
+        }
+        th.onclick = () => sortTable(`${section}-table`, key);
         th.style.cursor = 'pointer';
         th.title = 'Click to sort';
         headerRow.appendChild(th);
     });
     thead.appendChild(headerRow);
     
-    // Create rows
-    data.data.forEach(row => {
+    if (!data.data || data.data.length === 0) {
+        tbody.innerHTML = `<tr><td colspan="${keys.length}" style="text-align:center;">No data available</td></tr>`;
+    }
+    
+    // Create rows, building the page off-DOM and attaching it once
+    const fragment = document.createDocumentFragment();
+    (data.data || []).forEach(row => {
         const tr = document.createElement('tr');
         keys.forEach(key => {
             const td = document.createElement('td');
             td.textContent = formatValue(row[key]);
             tr.appendChild(td);
         });
-        tbody.appendChild(tr);
+        fragment.appendChild(tr);
     });
+    tbody.appendChild(fragment);
     
+    showPager(section, data.page);
     document.getElementById(`${section}-results`).style.display = 'block';
     
     // Show summary if available
-    if (section === 'income' && data.data.length > 0) {
-        showSummary(section, data.data);
+    if (section === 'income') {
+        showSummary(section, page.total);
+    }
+}
+
+// Previous/next controls under a table
+function showPager(section, page) {
+    let pager = document.getElementById(`${section}-pager`);
+    if (!pager) {
+        pager = document.createElement('div');
+        pager.id = `${section}-pager`;
+        pager.className = 'pager';
+        const container = document.getElementById(`${section}-table`).parentElement;
+        container.parentElement.insertBefore(pager, container.nextSibling);
     }
+    pager.innerHTML = '';
+    if (!page || page.total <= page.limit) {
+        return;
+    }
+    
+    const first = page.total ? page.offset + 1 : 0;
+    const last = page.offset + page.count;
+    const label = document.createElement('span');
+    label.textContent = `Rows ${first.toLocaleString()}–${last.toLocaleString()} of ${page.total.toLocaleString()}`;
+    
+    const pageButton = (text, cursor) => {
+        const button = document.createElement('button');
+        button.textContent = text;
+        button.className = 'btn-secondary';
+        button.disabled = !cursor;
+        button.onclick = () => {
+            tableViews[section].cursor = cursor;
+            refreshTable(section);
+        };
+        return button;
+    };
+    
+    pager.appendChild(pageButton('‹ Previous', page.prev_cursor));
+    pager.appendChild(label);
+    pager.appendChild(pageButton('Next ›', page.next_cursor));
 }
 
 // Show data summary
-function showSummary(section, data) {
+function showSummary(section, total) {
     const summaryDiv = document.getElementById(`${section}-summary`);
     if (!summaryDiv) return;
     
@@ -359,7 +506,7 @@ function showSummary(section, data) {
         <div class="summary-grid">
             <div class="summary-item">
                 <span class="summary-label">Total Records:</span>
-                <span class="summary-value">${data.length}</span>
+                <span class="summary-value">${total.toLocaleString()}</span>
             </div>
         </div>
     `;
@@ -384,63 +531,34 @@ function formatValue(value) {
     return value;
 }
 
-// Search functionality
+// Search functionality (debounced, filtered on the server)
+const searchTimers = {};
+const SEARCH_DELAY_MS = 300;
+
 function searchTable(tableId, searchId) {
-    const input = document.getElementById(searchId);
-    const filter = input.value.toUpperCase();
-    const table = document.getElementById(tableId);
-    const tr = table.getElementsByTagName('tr');
-    
-    for (let i = 1; i < tr.length; i++) {
-        let found = false;
-        const td = tr[i].getElementsByTagName('td');
-        
-        for (let j = 0; j < td.length; j++) {
-            if (td[j]) {
-                const txtValue = td[j].textContent || td[j].innerText;
-                if (txtValue.toUpperCase().indexOf(filter) > -1) {
-                    found = true;
-                    break;
-                }
-            }
-        }
-        
-        tr[i].style.display = found ? '' : 'none';
-    }
+    const section = tableId.replace(/-table$/, '');
+    if (!tableViews[section]) return;
+    
+    clearTimeout(searchTimers[section]);
+    searchTimers[section] = setTimeout(() => {
+        const q = document.getElementById(searchId).value.trim();
+        if (q === tableViews[section].q) return;
+        tableViews[section].q = q;
+        tableViews[section].cursor = null;
+        refreshTable(section);
+    }, SEARCH_DELAY_MS);
 }
 
-// Sort table
+// Sort table by a column (toggles direction, sorted on the server)
 function sortTable(tableId, column) {
-    const table = document.getElementById(tableId);
-    const tbody = table.getElementsByTagName('tbody')[0];
-    const rows = Array.from(tbody.getElementsByTagName('tr'));
-    
-    if (rows.length === 0) return;
-    
-    // Check if column contains numbers
-    const firstValue = rows[0].getElementsByTagName('td')[column].textContent.replace(/,/g, '');
-    const isNumeric = !isNaN(parseFloat(firstValue)) && isFinite(firstValue);
-    
-    // Determine sort direction
-    const currentDirection = table.dataset[`sortDir${column}`] || 'asc';
-    const newDirection = currentDirection === 'asc' ? 'desc' : 'asc';
-    table.dataset[`sortDir${column}`] = newDirection;
-    
-    rows.sort((a, b) => {
-        const aVal = a.getElementsByTagName('td')[column].textContent;
-        const bVal = b.getElementsByTagName('td')[column].textContent;
-        
-        if (isNumeric) {
-            const aNum = parseFloat(aVal.replace(/,/g, '')) || 0;
-            const bNum = parseFloat(bVal.replace(/,/g, '')) || 0;
-            return newDirection === 'asc' ? aNum - bNum : bNum - aNum;
-        }
-        
-        const comparison = aVal.localeCompare(bVal);
-        return newDirection === 'asc' ? comparison : -comparison;
-    });
-    
-    rows.forEach(row => tbody.appendChild(row));
+    const section = tableId.replace(/-table$/, '');
+    const view = tableViews[section];
+    if (!view) return;
+    
+    view.order = view.sort === column && view.order === 'asc' ? 'desc' : 'asc';
+    view.sort = column;
+    view.cursor = null;
+    refreshTable(section);
 }
 
 // Helper functions
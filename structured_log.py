@@ -0,0 +1,246 @@
+"""
+Structured (JSON lines) logging for the Flask app and the ARMS clients
+Every request gets an ID, taken from X-Request-ID or generated, which is
+attached to the upstream calls made on its behalf and echoed back in the
+response. Records are queued and written by a background thread, and only
+a sample of ordinary requests is logged; errors and slow requests always are.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+from flask import g, request
+
+
+LOGGER_NAME = 'arms'
+
+SAMPLE_RATE = float(os.getenv('ARMS_LOG_SAMPLE', '0.01'))
+SLOW_MS = float(os.getenv('ARMS_LOG_SLOW_MS', '2000'))
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Longest request ID accepted from a client; longer ones are replaced
+MAX_REQUEST_ID = 128
+
+logger = logging.getLogger(LOGGER_NAME)
+
+_request = contextvars.ContextVar('arms_log_request', default=None)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event, then the record's fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for a writer thread started with the first record in
+    each process, so a gunicorn master runs no thread before it forks
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(None)
+        self.stream = stream
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        self.queue = queue.SimpleQueue()
+        output = logging.StreamHandler(self.stream or sys.stderr)
+        output.setFormatter(JSONFormatter())
+        self._listener = logging.handlers.QueueListener(self.queue, output,
+                                                        respect_handler_level=False)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def after_fork(self):
+        # The parent's writer thread and queue are not ours
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def stop(self):
+        """Flush queued records and stop the writer thread"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+        self._pid = None
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        self.queue.put_nowait(record)
+
+    # The stock prepare() formats the message in the calling thread;
+    # leave all formatting to the writer thread
+    def prepare(self, record):
+        return record
+
+
+def _handlers():
+    return [h for h in logger.handlers if isinstance(h, _QueueHandler)]
+
+
+def configure(stream=None, level=None):
+    """Send the 'arms' logger's records through a queue to stream (stderr)"""
+    for handler in _handlers():
+        handler.stop()
+    logger.handlers[:] = [_QueueHandler(stream)]
+    logger.setLevel(level or os.getenv('ARMS_LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+
+def _shutdown():
+    # Flush queued records on exit
+    for handler in _handlers():
+        handler.stop()
+
+
+def _after_fork():
+    for handler in _handlers():
+        handler.after_fork()
+
+
+configure()
+atexit.register(_shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _is_sampled(request_id):
+    # Derived from the ID so every process handling a request agrees
+    return zlib.crc32(request_id.encode()) / 0xFFFFFFFF < SAMPLE_RATE
+
+
+def start_request(request_id=None, handoff=False):
+    """
+    Begin logging context for a request; returns the holder the clients update
+
+    Work submitted to other threads with contextvars.copy_context().run
+    shares the holder, so upstream time is summed across shard threads.
+    With handoff=True (the ASGI wrapper), the next start_request for the
+    same ID in this context continues the holder instead of replacing it.
+    """
+    current = _request.get()
+    if current is not None and current['handoff'] and current['request_id'] == request_id:
+        current['handoff'] = False
+        return current
+    if not request_id or len(request_id) > MAX_REQUEST_ID:
+        request_id = uuid.uuid4().hex
+    holder = {
+        'request_id': request_id,
+        'sampled': _is_sampled(request_id),
+        'start': time.perf_counter(),
+        'upstream_calls': 0,
+        'upstream_ms': 0.0,
+        'handoff': handoff,
+    }
+    _request.set(holder)
+    return holder
+
+
+def current_request_id():
+    holder = _request.get()
+    return holder['request_id'] if holder else None
+
+
+def log_upstream(endpoint, method, started, status=None, error=None, params=None, client='sync'):
+    """
+    Record one ARMS call that began at perf_counter() time started
+
+    Logged when the request is sampled (or, outside a request, at the
+    sample rate), and always when it failed or was slow.
+    """
+    duration_ms = (time.perf_counter() - started) * 1000
+    holder = _request.get()
+    if holder is not None:
+        holder['upstream_calls'] += 1
+        holder['upstream_ms'] += duration_ms
+        sampled = holder['sampled']
+    else:
+        sampled = random.random() < SAMPLE_RATE
+
+    if error:
+        level = logging.WARNING
+    elif duration_ms >= SLOW_MS or sampled:
+        level = logging.INFO
+    else:
+        return
+    if not logger.isEnabledFor(level):
+        return
+
+    fields = {
+        'request_id': holder['request_id'] if holder else None,
+        'endpoint': endpoint,
+        'method': method,
+        'client': client,
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+    }
+    if error:
+        fields['error'] = error
+    params = {k: v for k, v in (params or {}).items() if k != 'api_key' and v is not None}
+    if params:
+        fields['params'] = params
+    logger.log(level, 'upstream_request', extra={'fields': fields})
+
+
+def init_app(app):
+    """Assign request IDs and log a sample of Flask requests (plus all slow or failed ones)"""
+
+    @app.before_request
+    def _start_request_log():
+        g.request_log = start_request(request.headers.get(REQUEST_ID_HEADER))
+
+    @app.after_request
+    def _log_request(response):
+        holder = g.get('request_log')
+        if holder is None:
+            return response
+        response.headers[REQUEST_ID_HEADER] = holder['request_id']
+
+        duration_ms = (time.perf_counter() - holder['start']) * 1000
+        if response.status_code >= 500:
+            level = logging.WARNING
+        elif duration_ms >= SLOW_MS or holder['sampled']:
+            level = logging.INFO
+        else:
+            return response
+        if logger.isEnabledFor(level):
+            rule = request.url_rule
+            logger.log(level, 'http_request', extra={'fields': {
+                'request_id': holder['request_id'],
+                'route': rule.rule if rule is not None else None,
+                'path': request.path,
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 2),
+                'upstream_calls': holder['upstream_calls'],
+                'upstream_ms': round(holder['upstream_ms'], 2),
+                'stale': bool(response.headers.get('X-ARMS-Stale')),
+            }})
+        return response
@@ -0,0 +1,310 @@
+"""
+Local stub of the USDA ERS ARMS API
+Serves deterministic, ARMS-shaped fixtures so the clients and the Flask app
+can be exercised without hitting the real API
+
+Usage:
+    python stub_arms.py --port 8900 --latency-ms 200
+    USDA_BASE_URL=http://127.0.0.1:8900/data/arms USDA_API_KEY=stub python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+YEARS = list(range(1996, 2024))
+
+STATES = [
+    {'id': 'all', 'code': 'all', 'name': 'All survey states'},
+    {'id': 'ar', 'code': 'AR', 'name': 'Arkansas'},
+    {'id': 'ca', 'code': 'CA', 'name': 'California'},
+    {'id': 'fl', 'code': 'FL', 'name': 'Florida'},
+    {'id': 'ga', 'code': 'GA', 'name': 'Georgia'},
+    {'id': 'il', 'code': 'IL', 'name': 'Illinois'},
+    {'id': 'ia', 'code': 'IA', 'name': 'Iowa'},
+    {'id': 'ks', 'code': 'KS', 'name': 'Kansas'},
+    {'id': 'mn', 'code': 'MN', 'name': 'Minnesota'},
+    {'id': 'ne', 'code': 'NE', 'name': 'Nebraska'},
+    {'id': 'nc', 'code': 'NC', 'name': 'North Carolina'},
+    {'id': 'tx', 'code': 'TX', 'name': 'Texas'},
+    {'id': 'wa', 'code': 'WA', 'name': 'Washington'},
+    {'id': 'wi', 'code': 'WI', 'name': 'Wisconsin'},
+]
+
+REPORTS = {
+    'Farm Business Income Statement': [
+        ('igcfi', 'Gross cash farm income'),
+        ('igcfl', 'Livestock income'),
+        ('igcfc', 'Crop sales'),
+        ('etot', 'Total operating expenses'),
+        ('infi', 'Net farm income'),
+        ('ivpf', 'Value of production'),
+    ],
+    'Farm Business Balance Sheet': [
+        ('kaa', 'Total farm assets'),
+        ('kdt', 'Total farm debt'),
+        ('kne', 'Farm equity'),
+        ('kca', 'Current assets'),
+        ('kcl', 'Current liabilities'),
+    ],
+    'Farm Business Financial Ratios': [
+        ('rda', 'Debt to asset ratio'),
+        ('rroa', 'Rate of return on assets'),
+        ('rroe', 'Rate of return on equity'),
+        ('rom', 'Operating profit margin'),
+    ],
+    'Structural Characteristics': [
+        ('sfarms', 'Number of farms'),
+        ('sacres', 'Acres operated'),
+        ('sage', 'Operator age'),
+    ],
+    'Government Payments': [
+        ('gtot', 'Total government payments'),
+        ('gcons', 'Conservation payments'),
+    ],
+    'Operator Household Income': [
+        ('hinc', 'Total household income'),
+        ('hoff', 'Off-farm income'),
+        ('hfarm', 'Farm income to household'),
+    ],
+}
+
+CATEGORIES = {
+    'all farms': ['TOTAL'],
+    'collapsed farm typology': ['Small family farms', 'Midsize family farms',
+                                'Large-scale family farms', 'Nonfamily farms'],
+    'economic class': ['Less than $100,000', '$100,000 to $349,999',
+                       '$350,000 to $999,999', '$1,000,000 or more'],
+    'nass region': ['Atlantic', 'South', 'Midwest', 'Plains', 'West'],
+    'operator age': ['Under 35', '35 to 64', '65 or older'],
+}
+
+FARM_TYPES = ['Farm Operator Households', 'Farm Businesses', 'All Farms']
+
+
+def _seeded_value(*parts):
+    """Deterministic pseudo-random estimate for a row"""
+    seed = zlib.crc32('|'.join(str(p) for p in parts).encode('utf-8'))
+    return round(random.Random(seed).uniform(1000, 500000), 2)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _variable_index():
+    return {var_id: (report, name)
+            for report, variables in REPORTS.items()
+            for var_id, name in variables}
+
+
+def build_survey_rows(body, scale=1):
+    """
+    Generate the surveydata rows matching a request body
+
+    Args:
+        body: Request body as sent by USDAClient.get_survey_data
+        scale: Multiplies the number of variables per report, to make
+            payload size adjustable for benchmarks
+    """
+    years = [y for y in _as_list(body.get('year')) if y in YEARS]
+    states = [s.lower() for s in _as_list(body.get('state')) or ['all']]
+    if 'all' in states:
+        states = [s['id'] for s in STATES]
+    state_names = {s['id']: s['name'] for s in STATES}
+
+    variable_index = _variable_index()
+    wanted = []
+    for report in _as_list(body.get('report')):
+        for var_id, name in REPORTS.get(report, []):
+            wanted.append((report, var_id, name))
+    for var_id in _as_list(body.get('variable')):
+        if var_id in variable_index and not any(v[1] == var_id for v in wanted):
+            report, name = variable_index[var_id]
+            wanted.append((report, var_id, name))
+
+    category = (_as_list(body.get('category')) or ['all farms'])[0].lower()
+    category_values = CATEGORIES.get(category, CATEGORIES['all farms'])
+    if body.get('category_value'):
+        category_values = [v for v in category_values if v == body['category_value']]
+    category2 = (body.get('category2') or 'all farms').lower()
+    category2_values = CATEGORIES.get(category2, CATEGORIES['all farms'])
+    farmtype = (_as_list(body.get('farmtype')) or ['Farm Operator Households'])[0]
+
+    rows = []
+    for year in years:
+        for state in states:
+            for report, var_id, name in wanted:
+                for copy in range(scale):
+                    variable_id = var_id if copy == 0 else f"{var_id}{copy}"
+                    for value in category_values:
+                        for value2 in category2_values:
+                            estimate = _seeded_value(year, state, variable_id, value, value2)
+                            rows.append({
+                                'year': year,
+                                'state': state_names[state],
+                                'report': report,
+                                'farmtype': farmtype,
+                                'category': category.title() if category != 'all farms' else 'All Farms',
+                                'category_value': value,
+                                'category2': category2.title() if category2 != 'all farms' else 'All Farms',
+                                'category2_value': value2,
+                                'variable_id': variable_id,
+                                'variable_name': name,
+                                'variable_unit': 'dollars per farm',
+                                'variable_description': f"{name} ({report.lower()})",
+                                'estimate': estimate,
+                                'median': round(estimate * 0.8, 2),
+                                'statistic': 'mean',
+                                'rse': round(estimate % 37, 1),
+                                'unreliable_estimate': 0,
+                                'decimal_display': 0,
+                            })
+    return rows
+
+
+def metadata(endpoint, body=None):
+    """Fixtures for the metadata endpoints"""
+    body = body or {}
+    if endpoint == 'year':
+        return YEARS
+    if endpoint == 'state':
+        return STATES
+    if endpoint == 'report':
+        names = list(REPORTS)
+        if body.get('name'):
+            names = [n for n in names if body['name'].lower() in n.lower()]
+        return [{'id': i + 1, 'name': n} for i, n in enumerate(names)]
+    if endpoint == 'variable':
+        variables = [{'id': var_id, 'name': name, 'report': report}
+                     for report, items in REPORTS.items() for var_id, name in items]
+        if body.get('report'):
+            variables = [v for v in variables if v['report'].lower() == body['report'].lower()]
+        if body.get('name'):
+            variables = [v for v in variables if body['name'].lower() in v['name'].lower()]
+        return variables
+    if endpoint == 'category':
+        names = list(CATEGORIES)
+        if body.get('name'):
+            names = [n for n in names if body['name'].lower() in n]
+        return [{'name': n, 'values': CATEGORIES[n]} for n in names]
+    if endpoint == 'farmtype':
+        names = FARM_TYPES
+        if body.get('name'):
+            names = [n for n in names if body['name'].lower() in n.lower()]
+        return [{'name': n} for n in names]
+    return None
+
+
+class StubARMSHandler(BaseHTTPRequestHandler):
+    """Request handler; behaviour is configured on the server object"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, body):
+        server = self.server
+        with server.stats_lock:
+            server.request_count += 1
+
+        if server.latency:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if server.error_rate and random.random() < server.error_rate:
+            return self._send_json({'error': 'injected upstream failure'}, 503)
+
+        endpoint = urlsplit(self.path).path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint == 'surveydata':
+            return self._send_json({'data': build_survey_rows(body, server.scale)})
+
+        data = metadata(endpoint, body)
+        if data is None:
+            return self._send_json({'error': f"Unknown endpoint {endpoint}"}, 404)
+        self._send_json({'data': data})
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json({'error': 'Invalid JSON body'}, 400)
+        self._handle(body)
+
+
+class _StubServer(ThreadingHTTPServer):
+    # Load tests open hundreds of connections at once; the default backlog of 5 drops them
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=8900, latency_ms=0, jitter_ms=0,
+                error_rate=0.0, scale=1):
+    """
+    Create (but do not start) a stub server; port 0 picks a free port
+
+    Args:
+        latency_ms: Fixed delay added to every response
+        jitter_ms: Extra uniformly random delay on top of latency_ms
+        error_rate: Fraction of requests answered with HTTP 503
+        scale: Payload size multiplier for surveydata responses
+    """
+    server = _StubServer((host, port), StubARMSHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000.0
+    server.jitter = jitter_ms / 1000.0
+    server.error_rate = error_rate
+    server.scale = scale
+    server.request_count = 0
+    server.stats_lock = threading.Lock()
+    return server
+
+
+def start_background_server(**kwargs):
+    """Start a stub server on a daemon thread; returns (server, base_url)"""
+    kwargs.setdefault('port', 0)
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/data/arms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the USDA ARMS API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--scale', type=int, default=1)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency_ms, args.jitter_ms,
+                         args.error_rate, args.scale)
+    print(f"Stub ARMS API on http://{args.host}:{server.server_port}/data/arms")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
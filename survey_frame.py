@@ -0,0 +1,246 @@
+"""
+Columnar representation of ARMS surveydata results
+Builds a pandas DataFrame once per response, with categorical dtypes for the
+repeated string columns, so consumers filter, project and serialize without
+walking per-row Python dicts
+"""
+
+import json
+import sys
+import time
+
+from startup import lazy_module
+
+pd = lazy_module('pandas')
+
+
+# Strings repeated on nearly every row of a surveydata response
+CATEGORICAL_COLUMNS = (
+    'report', 'state', 'farmtype', 'category', 'category_value',
+    'category2', 'category2_value', 'variable_id', 'variable_name',
+    'variable_unit', 'variable_description', 'variable_group', 'statistic',
+)
+
+# Integer columns that must not turn into floats when values are missing
+INTEGER_COLUMNS = ('year', 'unreliable_estimate', 'decimal_display', 'variable_sequence',
+                   'variable_level')
+
+# Other string columns become categorical when this share of values repeat
+AUTO_CATEGORICAL_RATIO = 0.5
+
+
+def _is_missing(value):
+    return value is None or value is pd.NA or (isinstance(value, float) and value != value)
+
+
+def _python_values(series, has_missing=True):
+    """Column values as plain Python objects, with None for missing values"""
+    values = series.tolist()
+    if has_missing:
+        values = [None if _is_missing(v) else v for v in values]
+    return values
+
+
+class SurveyFrame:
+    """
+    Surveydata rows held column-wise
+
+    Every operation returns a new SurveyFrame; the response's other
+    top-level fields travel along in meta.
+    """
+
+    def __init__(self, df, meta=None):
+        self.df = df
+        self.meta = meta or {}
+
+    @classmethod
+    def from_records(cls, records, meta=None):
+        """Build a frame from a list of row dicts (column order from the first row)"""
+        if not records:
+            return cls(pd.DataFrame(), meta)
+
+        df = pd.DataFrame.from_records(records, columns=list(records[0].keys()))
+        for name in df.columns:
+            column = df[name]
+            if name in CATEGORICAL_COLUMNS and column.dtype == object:
+                df[name] = column.astype('category')
+            elif name in INTEGER_COLUMNS and column.dtype == float:
+                df[name] = column.astype('Int64')
+            elif column.dtype == object and len(column) >= 16:
+                try:
+                    unique = column.nunique(dropna=True)
+                except TypeError:
+                    # Unhashable values (nested lists/dicts) stay as objects
+                    continue
+                if unique <= len(column) * AUTO_CATEGORICAL_RATIO:
+                    df[name] = column.astype('category')
+        return cls(df, meta)
+
+    @classmethod
+    def from_response(cls, response):
+        """Build a frame from a surveydata response ({'data': [...], ...})"""
+        meta = {k: v for k, v in response.items() if k != 'data'}
+        return cls.from_records(response.get('data') or [], meta)
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def columns(self):
+        return list(self.df.columns)
+
+    def _derive(self, df):
+        return SurveyFrame(df, self.meta)
+
+    def filter(self, **criteria):
+        """
+        Keep rows matching every criterion
+
+        Each value may be a scalar (equality) or a list (membership).
+        Criteria naming columns the frame doesn't have match nothing.
+        """
+        if not criteria or self.df.empty:
+            return self
+        mask = pd.Series(True, index=self.df.index)
+        for name, value in criteria.items():
+            if name not in self.df.columns:
+                return self._derive(self.df.iloc[0:0])
+            column = self.df[name]
+            if isinstance(value, (list, tuple, set)):
+                mask &= column.isin(list(value))
+            else:
+                mask &= column == value
+        return self._derive(self.df[mask])
+
+    def contains_text(self, text, columns=None):
+        """Keep rows where any of the given columns contains text (case-insensitive)"""
+        if not text or self.df.empty:
+            return self
+        mask = pd.Series(False, index=self.df.index)
+        for name in columns or self.columns:
+            column = self.df[name]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                # Match once per category rather than once per row
+                categories = column.cat.categories.astype(str)
+                hits = categories[categories.str.contains(text, case=False, regex=False)]
+                mask |= column.isin(hits)
+            else:
+                mask |= column.astype(str).str.contains(text, case=False, regex=False, na=False)
+        return self._derive(self.df[mask])
+
+    def select(self, columns):
+        """Project onto the given columns (unknown names are ignored)"""
+        if not columns:
+            return self
+        keep = [c for c in columns if c in self.df.columns]
+        return self._derive(self.df[keep])
+
+    def sort(self, by, descending=False):
+        if not by or by not in self.df.columns:
+            return self
+        return self._derive(self.df.sort_values(by, ascending=not descending,
+                                                kind='stable', na_position='last'))
+
+    def slice(self, offset=0, limit=None):
+        end = None if limit is None else offset + limit
+        return self._derive(self.df.iloc[offset:end])
+
+    def _column_lists(self):
+        """Every column as a list of Python values, in column order"""
+        # One vectorized pass finds the columns that need None substitution
+        missing = set(self.df.columns[self.df.isna().any().to_numpy()])
+        return [_python_values(self.df[name], name in missing) for name in self.df.columns]
+
+    def to_columns(self):
+        """{column: [values]} with plain Python values"""
+        return dict(zip(self.columns, self._column_lists()))
+
+    def to_records(self):
+        """List of row dicts, matching the upstream row format"""
+        names = self.columns
+        return [dict(zip(names, row)) for row in zip(*self._column_lists())]
+
+    def to_response(self):
+        """Response dict in the same shape as USDAClient.get_survey_data"""
+        return dict(self.meta, data=self.to_records())
+
+    def to_rows(self, formatter=None):
+        """
+        List of row lists (in column order) for table renderers
+
+        The formatter, if given, is applied column by column.
+        """
+        columns = self._column_lists()
+        if formatter is not None:
+            columns = [[formatter(v) for v in values] for values in columns]
+        return [list(row) for row in zip(*columns)]
+
+    def memory_usage(self):
+        """Bytes used by the frame, including string categories"""
+        return int(self.df.memory_usage(deep=True).sum())
+
+
+def _deep_sizeof(obj, seen=None):
+    """Approximate memory of nested lists/dicts of JSON values"""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_sizeof(v, seen) for v in obj)
+    return size
+
+
+def measure_representation(response, repeat=5):
+    """
+    Compare list-of-dicts and SurveyFrame for one response
+
+    Returns memory in bytes and best-of-repeat timings in milliseconds for
+    conversion and for a typical filter + project + serialize pass.
+    """
+    records = response.get('data') or []
+
+    def best(fn):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        return round(min(timings), 3)
+
+    frame = SurveyFrame.from_response(response)
+    sample = records[0] if records else {}
+    criteria = {k: sample[k] for k in ('year', 'category_value') if k in sample}
+    columns = [k for k in ('year', 'variable_id', 'estimate') if k in sample]
+
+    def dicts_pass():
+        rows = [r for r in records if all(r.get(k) == v for k, v in criteria.items())]
+        return [{k: r.get(k) for k in columns} for r in rows]
+
+    def frame_pass():
+        return frame.filter(**criteria).select(columns).to_records()
+
+    return {
+        'rows': len(records),
+        'dicts_bytes': _deep_sizeof(records),
+        'frame_bytes': frame.memory_usage(),
+        'json_roundtrip_ms': best(lambda: json.loads(json.dumps(records))),
+        'frame_build_ms': best(lambda: SurveyFrame.from_response(response)),
+        'dicts_filter_project_ms': best(dicts_pass),
+        'frame_filter_project_ms': best(frame_pass),
+    }
+
+
+if __name__ == '__main__':
+    # Measure against stub fixtures of increasing size
+    from stub_arms import build_survey_rows
+
+    body = {'year': list(range(2014, 2024)), 'state': ['all'],
+            'report': ['Farm Business Income Statement'],
+            'category': ['collapsed farm typology']}
+    for scale in (1, 5, 20):
+        print(json.dumps(dict(measure_representation({'data': build_survey_rows(body, scale)}),
+                              scale=scale)))
@@ -0,0 +1,124 @@
+"""
+Shared fixtures: a stub ARMS server and the app configured against it
+
+The app modules read their settings when imported, so the environment is
+set up before the first test imports them.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stub_arms  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def stub(tmp_path_factory):
+    """The stub ARMS server every test's app and clients talk to"""
+    server, url = stub_arms.start_background_server()
+    workdir = tmp_path_factory.mktemp('arms')
+    os.environ.update({
+        'USDA_API_KEY': 'test',
+        'USDA_BASE_URL': url,
+        'USDA_MAX_RETRIES': '0',
+        'ARMS_CACHE_PATH': str(workdir / 'cache.sqlite3'),
+        'ARMS_CATALOG_SNAPSHOT': str(workdir / 'catalog.json'),
+        'ARMS_RATE_LIMIT': 'off',
+        'ARMS_LOG_SAMPLE': '0',
+    })
+    for name in ('ARMS_TRANSPORT', 'ARMS_MODE', 'ARMS_CACHE_BACKEND'):
+        os.environ.pop(name, None)
+    # A complete catalog snapshot, so the app's refresh thread stays idle and
+    # every upstream call the stub counts comes from the test itself
+    from metadata_catalog import ENTRIES
+    snapshot = {'saved_at': time.time(), 'entries': {name: {'data': []} for name in ENTRIES},
+                'report_variables': {}}
+    (workdir / 'catalog.json').write_text(json.dumps(snapshot))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def upstream(stub):
+    """The stub, back to a fast and healthy upstream after the test"""
+    yield stub
+    stub.latency = 0
+    stub.error_rate = 0.0
+
+
+@pytest.fixture(scope='session')
+def flask_app(stub):
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+
+def wait_for(predicate, timeout=5.0):
+    """Poll until predicate() is true; False if it never was"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+@pytest.fixture(scope='session')
+def asgi_post(flask_app):
+    """
+    post(path, payload) through the ASGI app -> (status, headers, JSON body)
+
+    Requests run on one event loop for the whole session, as in a uvicorn
+    worker, so work a request leaves running carries on after it returns.
+    """
+    import asgi
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def post(path, payload):
+        messages = asyncio.run_coroutine_threadsafe(
+            _asgi_request(asgi.app, path, payload), loop).result(30)
+        start = next(m for m in messages if m['type'] == 'http.response.start')
+        content = b''.join(m.get('body', b'') for m in messages
+                           if m['type'] == 'http.response.body')
+        headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+        return start['status'], headers, json.loads(content)
+
+    yield post
+    loop.call_soon_threadsafe(loop.stop)
+
+
+async def _asgi_request(application, path, payload):
+    body = json.dumps(payload).encode('utf-8')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'POST', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'root_path': '', 'query_string': b'', 'server': ('testserver', 80),
+        'client': ('127.0.0.1', 50000),
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+    }
+    messages = []
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # Like a client that stays connected until the response is sent
+            await asyncio.sleep(3600)
+        sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages
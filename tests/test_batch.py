@@ -0,0 +1,87 @@
+"""/api/batch limits and deadlines, under WSGI and under the ASGI prefetch"""
+
+import time
+
+from conftest import wait_for
+
+REPORT = 'Farm Business Income Statement'
+
+
+def items(count, state):
+    return [{'id': i, 'report': REPORT, 'years': [1996 + i % 28], 'state': state}
+            for i in range(count)]
+
+
+def test_wsgi_rejects_too_many_items_without_calling_arms(flask_app, upstream):
+    before = upstream.request_count
+    response = flask_app.app.test_client().post('/api/batch', json={'items': items(84, 'ia')})
+    assert response.status_code == 400
+    assert 'At most' in response.get_json()['error']
+    assert upstream.request_count == before
+
+
+def test_wsgi_rejects_bad_deadline(flask_app, upstream):
+    for deadline in ('soon', 0, -1, True):
+        response = flask_app.app.test_client().post(
+            '/api/batch', json={'items': items(1, 'ia'), 'deadline': deadline})
+        assert response.status_code == 400
+
+
+def test_wsgi_reports_slow_items_as_timeouts(flask_app, upstream):
+    upstream.latency = 1.0
+    start = time.perf_counter()
+    response = flask_app.app.test_client().post(
+        '/api/batch', json={'items': items(2, 'ks'), 'deadline': 0.3})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    assert [r['status'] for r in response.get_json()['results']] == ['timeout', 'timeout']
+    assert elapsed < 0.9
+
+
+def test_asgi_rejects_too_many_items_without_calling_arms(asgi_post, upstream):
+    before = upstream.request_count
+    status, _, body = asgi_post('/api/batch', {'items': items(84, 'tx')})
+    assert status == 400
+    assert 'At most' in body['error']
+    assert upstream.request_count == before
+
+
+def test_asgi_rejects_bad_deadline_without_calling_arms(asgi_post, upstream):
+    before = upstream.request_count
+    status, _, _ = asgi_post('/api/batch', {'items': items(2, 'tx'), 'deadline': 'x'})
+    assert status == 400
+    assert upstream.request_count == before
+
+
+def test_asgi_keeps_the_batch_deadline(asgi_post, upstream):
+    upstream.latency = 1.0
+    before = upstream.request_count
+    start = time.perf_counter()
+    status, _, body = asgi_post('/api/batch', {'items': items(2, 'ca'), 'deadline': 0.3})
+    elapsed = time.perf_counter() - start
+    assert status == 200
+    assert [r['status'] for r in body['results']] == ['timeout', 'timeout']
+    assert elapsed < 0.9
+    # The unfinished items are neither cancelled nor sent to ARMS a second time
+    time.sleep(1.2)
+    assert upstream.request_count - before == 2
+
+
+def test_asgi_batch_answers_like_wsgi(flask_app, asgi_post, upstream):
+    payload = {'items': items(3, 'fl')}
+    status, _, body = asgi_post('/api/batch', payload)
+    expected = flask_app.app.test_client().post('/api/batch', json=payload).get_json()
+    assert status == 200
+    assert [r['status'] for r in body['results']] == ['ok', 'ok', 'ok']
+    assert [r['result'] for r in body['results']] == [r['result'] for r in expected['results']]
+
+
+def test_asgi_does_not_repeat_a_failed_prefetch(asgi_post, upstream):
+    upstream.error_rate = 1.0
+    before = upstream.request_count
+    status, _, body = asgi_post('/api/income-statement',
+                                {'years': [2001], 'state': 'wi'})
+    assert status == 200
+    assert 'error' in body
+    assert wait_for(lambda: upstream.request_count - before >= 1)
+    assert upstream.request_count - before == 1
@@ -0,0 +1,59 @@
+"""Response cache behaviour when a backend fails"""
+
+import sqlite3
+
+import pytest
+import requests
+
+from cache import CacheBackend, ResponseCache
+
+
+class FailingBackend(CacheBackend):
+    """Backend whose every call raises, like a broken or misbehaving cache server"""
+
+    def __init__(self, error):
+        self.error = error
+
+    def get(self, key):
+        raise self.error
+
+    def set(self, key, endpoint, body, created, expires):
+        raise self.error
+
+    def delete(self, key):
+        raise self.error
+
+    def add_stats(self, worker, deltas):
+        pass
+
+    def read_stats(self):
+        return {}
+
+
+@pytest.mark.parametrize('error', [
+    KeyError('X-Cache-Expires'),
+    ValueError('truncated body'),
+    requests.exceptions.ConnectionError('refused'),
+    sqlite3.OperationalError('database is locked'),
+])
+def test_backend_errors_are_misses(error):
+    cache = ResponseCache(FailingBackend(error))
+    assert cache.get('k') is None
+    assert cache.get_with_expiry('k') is None
+    assert cache.get_stale('k') is None
+    assert cache.get_raw('k') is None
+    cache.set('k', 'surveydata', {'data': []})
+    cache.set_raw('k', 'surveydata', b'raw')
+    cache.delete('k')
+    assert cache._counters['misses'] == 2
+    assert cache._counters['sets'] == 0
+
+
+def test_stale_entries_outlive_their_ttl(tmp_path):
+    from cache import SQLiteBackend
+    cache = ResponseCache(SQLiteBackend(str(tmp_path / 'cache.sqlite3')))
+    cache.set('k', 'surveydata', {'data': [1]}, ttl=-5)
+    assert cache.get('k') is None
+    value, age = cache.get_stale('k')
+    assert value == {'data': [1]} and age >= 5
+    assert cache.get_stale('k', max_stale=1) is None
@@ -0,0 +1,58 @@
+"""Columnar wire format and its Accept negotiation"""
+
+import pytest
+
+import columnar
+
+QUERY = {'years': [2019], 'state': 'ne'}
+
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, False),
+    ('', False),
+    ('*/*', False),
+    ('application/json', False),
+    ('application/vnd.arms.columnar+json', True),
+    ('application/vnd.arms.columnar+json, application/json', True),
+    ('application/vnd.arms.columnar+json;q=0', False),
+    ('Application/Vnd.Arms.Columnar+JSON; Q=0', False),
+    ('application/vnd.arms.columnar+json;q=0.5, application/json', False),
+    ('application/json;q=0.5, application/vnd.arms.columnar+json;q=0.9', True),
+    ('application/vnd.arms.columnar+json; charset=utf-8; q=0.8, */*;q=0.1', True),
+])
+def test_accepts_columnar(accept, expected):
+    assert columnar.accepts_columnar(accept) is expected
+
+
+def test_encode_decode_round_trip():
+    response = {'data': [{'year': 2020, 'state': 'Iowa', 'estimate': 1.5, 'unit': None},
+                         {'year': 2021, 'state': 'Iowa', 'estimate': 2, 'unit': None}],
+                'page': {'total': 2}}
+    encoded = columnar.encode(response)
+    assert encoded['data']['format'] == columnar.FORMAT
+    assert encoded['page'] == response['page']
+    assert columnar.decode(encoded) == response
+
+
+def test_rows_without_uniform_fields_are_not_encoded():
+    assert columnar.encode({'data': [{'a': 1}, {'b': 2}]}) is None
+    assert columnar.encode({'data': []}) is None
+
+
+def test_route_answers_in_the_format_asked_for(flask_app, upstream):
+    http = flask_app.app.test_client()
+    rows = http.post('/api/income-statement', json=QUERY)
+    assert rows.mimetype == 'application/json'
+    assert 'Accept' in rows.headers['Vary']
+
+    encoded = http.post('/api/income-statement', json=QUERY,
+                        headers={'Accept': 'application/vnd.arms.columnar+json, application/json'})
+    assert encoded.mimetype == columnar.MIMETYPE
+    assert columnar.decode(encoded.get_json()) == rows.get_json()
+
+    refused = http.post('/api/income-statement', json=QUERY,
+                        headers={'Accept': 'application/vnd.arms.columnar+json;q=0'})
+    assert refused.mimetype == 'application/json'
+
+    by_query = http.post('/api/income-statement?format=columnar', json=QUERY)
+    assert by_query.mimetype == columnar.MIMETYPE
@@ -0,0 +1,84 @@
+"""Priority ordering, reserves and throttling in the upstream rate governor"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_governor import RateGovernor, parse_rate
+
+
+def drain(governor):
+    while governor._try_take('interactive') == 0:
+        pass
+
+
+def test_parse_rate():
+    assert parse_rate('5') == 5.0
+    assert parse_rate('300/minute') == 5.0
+    assert parse_rate('3600/hours') == 1.0
+    assert parse_rate('off') is None
+    with pytest.raises(ValueError):
+        parse_rate('5/fortnight')
+
+
+def test_waiters_are_served_by_priority_class():
+    governor = RateGovernor(rate=20, burst=4, max_wait=5)
+    drain(governor)
+    granted = []
+
+    def wait(name):
+        assert governor.acquire(name)
+        granted.append(name)
+
+    threads = []
+    # Lowest class first, so arrival order alone would get it wrong
+    for name in ('background', 'batch', 'interactive'):
+        thread = threading.Thread(target=wait, args=(name,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(5)
+    assert granted == ['interactive', 'batch', 'background']
+
+
+def test_lower_classes_leave_the_reserve_untouched():
+    governor = RateGovernor(rate=0.001, burst=4, max_wait=0.1)
+    # batch keeps 25% (1 token) for interactive callers
+    assert [governor.acquire('batch') for _ in range(4)] == [True, True, True, False]
+    assert governor.acquire('interactive')
+    assert not governor.acquire('interactive')
+
+
+def test_throttle_holds_back_batch_but_not_interactive():
+    governor = RateGovernor(rate=100, burst=10, max_wait=0.2)
+    governor.throttle(5)
+    assert not governor.acquire('batch')
+    assert governor.acquire('interactive')
+    assert governor.stats()['classes']['batch']['rejected'] == 1
+
+
+def test_interactive_gives_up_after_max_wait():
+    governor = RateGovernor(rate=0.001, burst=1, max_wait=0.2)
+    drain(governor)
+    start = time.perf_counter()
+    assert not governor.acquire('interactive')
+    assert 0.15 < time.perf_counter() - start < 1.0
+
+
+def test_async_waiters_share_the_queue_and_the_rate():
+    governor = RateGovernor(rate=20, burst=1, max_wait=5)
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(*(governor.acquire_async('interactive')
+                                         for _ in range(11)))
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(run())
+    assert all(results)
+    # One token at once, then 20 per second
+    assert 0.4 < elapsed < 1.5
+    assert governor.stats()['classes']['interactive']['granted'] == 11
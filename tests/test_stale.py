@@ -0,0 +1,68 @@
+"""Serving stale cache entries while ARMS is down, and recovering afterwards"""
+
+import time
+
+import pytest
+
+from conftest import wait_for
+
+
+@pytest.fixture
+def client(upstream, tmp_path):
+    from api_client import USDAClient
+    from cache import ResponseCache, SQLiteBackend
+    from circuit_breaker import CircuitBreaker
+
+    client = USDAClient(cache=ResponseCache(SQLiteBackend(str(tmp_path / 'cache.sqlite3'))),
+                        mirror=False, planner=False, governor=False, breaker=False,
+                        transport=False)
+    client.breaker = CircuitBreaker(client._probe, failure_threshold=1, reset_timeout=0.5,
+                                    max_reset_timeout=0.5)
+    return client
+
+
+def expire(client, key):
+    """Make the cached entry for key expired a minute ago (well within max stale)"""
+    body, _ = client.cache.backend.get(key)
+    now = time.time()
+    client.cache.backend.set(key, 'surveydata', body, now - 3600, now - 60)
+
+
+def test_outage_serves_stale_then_recovers(client, upstream):
+    from api_client import build_survey_params
+    from cache import make_cache_key
+    from circuit_breaker import track_staleness
+
+    query = {'years': [2015], 'state': 'ia', 'report': 'Farm Business Income Statement'}
+    fresh = client.get_survey_data(**query)
+    assert 'error' not in fresh
+    params, _ = build_survey_params(**query)
+    key = make_cache_key('surveydata', params, 'POST')
+    expire(client, key)
+
+    # ARMS fails: the expired copy answers, flagged stale, and the circuit opens
+    upstream.error_rate = 1.0
+    staleness = track_staleness()
+    stale = client.get_survey_data(**query)
+    assert stale == fresh
+    assert staleness['stale'] and staleness['age'] > 0
+    assert client.breaker.state == 'open'
+
+    # While open, requests fail fast to the stale copy without reaching ARMS
+    before = upstream.request_count
+    assert client.get_survey_data(**query) == fresh
+    assert upstream.request_count == before
+    assert client.breaker.stats()['rejected'] >= 1
+
+    # ARMS is back: a probe closes the circuit and the stale entry is refreshed
+    upstream.error_rate = 0.0
+    assert wait_for(lambda: client.breaker.state == 'closed')
+    assert wait_for(lambda: client.cache.get(key) is not None)
+    assert upstream.request_count > before
+
+
+def test_outage_without_a_cached_copy_is_an_error(client, upstream):
+    upstream.error_rate = 1.0
+    result = client.get_survey_data(years=[2016], state='ks',
+                                    report='Farm Business Income Statement')
+    assert 'error' in result
@@ -0,0 +1,258 @@
+"""
+Trend analytics over ARMS surveydata
+Turns surveydata rows into one series per variable x state x category value
+and computes year-over-year change, CAGR, rolling means, volatility and
+inflation-adjusted values for all series at once with NumPy/pandas
+"""
+
+import json
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+from cache import ttl_for
+from circuit_breaker import fresh_until, served_stale
+from startup import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+
+# GDP implicit price deflator, 2017 = 100 (BEA NIPA table 1.1.9, rounded).
+# Override with ARMS_DEFLATOR_PATH pointing at a {"year": index} JSON file.
+GDP_DEFLATOR = {
+    1996: 67.7, 1997: 68.8, 1998: 69.5, 1999: 70.6, 2000: 72.2,
+    2001: 73.7, 2002: 74.8, 2003: 76.2, 2004: 78.4, 2005: 80.8,
+    2006: 83.3, 2007: 85.5, 2008: 87.3, 2009: 88.0, 2010: 89.2,
+    2011: 91.1, 2012: 92.9, 2013: 94.5, 2014: 96.2, 2015: 97.1,
+    2016: 98.1, 2017: 100.0, 2018: 102.4, 2019: 104.3, 2020: 105.5,
+    2021: 110.2, 2022: 118.0, 2023: 122.3,
+}
+DEFLATOR_NAME = 'GDP implicit price deflator (2017=100)'
+
+# Row fields identifying a series, in output order (absent fields are skipped)
+SERIES_KEYS = ('variable_id', 'state', 'category', 'category_value', 'category2', 'category2_value')
+# Per-series descriptive fields taken from the first row
+SERIES_LABELS = ('variable_name', 'variable_unit', 'report')
+
+DEFAULT_WINDOW = 3
+
+
+def load_deflator():
+    """Deflator index by year, from ARMS_DEFLATOR_PATH or the built-in table"""
+    path = os.getenv('ARMS_DEFLATOR_PATH')
+    if not path:
+        return dict(GDP_DEFLATOR), DEFLATOR_NAME
+    with open(path, 'r', encoding='utf-8') as f:
+        return {int(year): float(value) for year, value in json.load(f).items()}, os.path.basename(path)
+
+
+def build_series(rows, years):
+    """
+    Pivot surveydata rows into a (years x series) array
+
+    Returns (values, labels): values is a float array with NaN where a
+    series has no estimate for a year; labels holds one dict per column.
+    """
+    if not rows or 'estimate' not in rows[0]:
+        return np.empty((len(years), 0)), []
+
+    # Only the columns used here; building the full frame costs more than the math
+    fields = set(rows[0])
+    keys = [k for k in SERIES_KEYS if k in fields]
+    label_fields = [k for k in SERIES_LABELS if k in fields]
+    df = pd.DataFrame({name: [row.get(name) for row in rows]
+                       for name in keys + label_fields + ['year', 'estimate']})
+    df['estimate'] = pd.to_numeric(df['estimate'], errors='coerce')
+    # Key columns must not be NaN for groupby; missing values become ''
+    df[keys] = df[keys].fillna('')
+
+    grouped = df.groupby(keys, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    year_index = pd.Index(years).get_indexer(df['year'])
+    inside = year_index >= 0
+
+    values = np.full((len(years), grouped.ngroups), np.nan)
+    # Later rows for the same series and year don't overwrite the first one
+    order = np.arange(len(df))[inside][::-1]
+    values[year_index[order], codes[order]] = df['estimate'].to_numpy(dtype=float)[order]
+
+    _, first_rows = np.unique(codes, return_index=True)
+    key_values = df[keys].to_numpy()
+    labels = [dict(zip(keys, key_values[i]), **{name: rows[i].get(name) for name in label_fields})
+              for i in first_rows.tolist()]
+    return values, labels
+
+
+def compute_trends(values, years, window=DEFAULT_WINDOW, base_year=None, deflator=None):
+    """
+    Trend statistics for every column of a (years x series) array
+
+    years must be non-empty. Returns a dict of arrays: yoy_pct,
+    rolling_mean and real_estimate are (years x series); cagr_pct,
+    volatility_pct, first_year and last_year hold one value per series.
+    """
+    years = np.asarray(years)
+    n_years, n_series = values.shape
+
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        yoy = np.full_like(values, np.nan)
+        previous = values[:-1]
+        yoy[1:] = np.where(previous != 0, (values[1:] / previous - 1) * 100, np.nan)
+
+        # Rolling mean from cumulative sums; NaN unless the whole window has values
+        sums = np.vstack([np.zeros(n_series), np.cumsum(np.nan_to_num(values), axis=0)])
+        counts = np.vstack([np.zeros(n_series), np.cumsum(~np.isnan(values), axis=0)])
+        rolling = np.full_like(values, np.nan)
+        if n_years >= window:
+            window_sums = sums[window:] - sums[:-window]
+            window_counts = counts[window:] - counts[:-window]
+            rolling[window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+
+        present = ~np.isnan(values)
+        has_data = present.any(axis=0)
+        first = np.argmax(present, axis=0)
+        last = n_years - 1 - np.argmax(present[::-1], axis=0)
+        columns = np.arange(n_series)
+        first_values = values[first, columns]
+        last_values = values[last, columns]
+        span = (years[last] - years[first]).astype(float)
+        valid = has_data & (span > 0) & (first_values > 0) & (last_values > 0)
+        cagr = np.where(valid, ((last_values / first_values) ** (1 / np.where(span > 0, span, 1)) - 1) * 100,
+                        np.nan)
+
+        changes = (~np.isnan(yoy)).sum(axis=0)
+        volatility = np.where(changes >= 2, np.nanstd(yoy, axis=0, ddof=1), np.nan)
+
+        real = np.full_like(values, np.nan)
+        if deflator:
+            if base_year is None:
+                # Express real values in dollars of the last year with an index
+                base_year = max((y for y in deflator if y <= years.max()), default=None)
+            index = np.array([deflator.get(int(y), np.nan) for y in years])
+            base = deflator.get(int(base_year), np.nan) if base_year else np.nan
+            real = values * (base / index)[:, None]
+
+    return {
+        'yoy_pct': yoy,
+        'rolling_mean': rolling,
+        'real_estimate': real,
+        'cagr_pct': cagr,
+        'volatility_pct': volatility,
+        'first_year': np.where(has_data, years[first], 0),
+        'last_year': np.where(has_data, years[last], 0),
+        'base_year': base_year,
+    }
+
+
+def _json_columns(array, digits):
+    """Rounded values as Python lists (one per series for 2-D input), None for NaN"""
+    rounded = np.round(array.astype(float), digits)
+    objects = np.where(np.isnan(rounded), None, rounded)
+    return objects.T.tolist() if objects.ndim == 2 else objects.tolist()
+
+
+def trends_response(values, labels, years, stats, window, deflator_name):
+    """JSON-ready analytics: shared year axis plus one entry per series"""
+    columns = {
+        'estimate': _json_columns(values, 2),
+        'yoy_pct': _json_columns(stats['yoy_pct'], 2),
+        'rolling_mean': _json_columns(stats['rolling_mean'], 2),
+        'real_estimate': _json_columns(stats['real_estimate'], 2),
+        'cagr_pct': _json_columns(stats['cagr_pct'], 3),
+        'volatility_pct': _json_columns(stats['volatility_pct'], 3),
+        'first_year': [int(y) or None for y in stats['first_year'].tolist()],
+        'last_year': [int(y) or None for y in stats['last_year'].tolist()],
+    }
+    series = [dict(label, **{name: values_[i] for name, values_ in columns.items()})
+              for i, label in enumerate(labels)]
+    return {
+        'years': list(years),
+        'window': window,
+        'base_year': stats['base_year'],
+        'deflator': deflator_name,
+        'series': series,
+    }
+
+
+class TrendEngine:
+    """
+    Memoized trend analytics
+
+    Pivoted series (with the response they came from) are memoized per
+    input query and the computed analytics per (input query, options),
+    both for as long as the cached surveydata they were built from stays
+    fresh.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or int(os.getenv('ARMS_TREND_MEMO', '64'))
+        self.ttl = ttl if ttl is not None else ttl_for('surveydata')
+        self.deflator, self.deflator_name = load_deflator()
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+
+    def _get(self, key):
+        """(expires, value) memoized under key, or None"""
+        with self._lock:
+            entry = self._memo.get(key)
+            if entry is None or entry[0] < time.time():
+                return None
+            self._memo.move_to_end(key)
+            return entry
+
+    def _put(self, key, value, expires=None):
+        expires = min(expires or float('inf'), time.time() + self.ttl)
+        with self._lock:
+            self._memo[key] = (expires, value)
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return expires
+
+    def analyze(self, input_key, fetch, years, window=DEFAULT_WINDOW, base_year=None,
+                include_rows=False):
+        """
+        Analytics for the rows fetch() returns (memoized under input_key)
+
+        fetch is only called on a memo miss; its error responses are
+        returned as-is. With include_rows the memoized response is returned
+        with the analytics added under 'analytics'. Raises ValueError for a
+        base_year the deflator has no index for.
+        """
+        if base_year is not None and base_year not in self.deflator:
+            raise ValueError(f"No deflator index for base_year {base_year} "
+                             f"({min(self.deflator)}-{max(self.deflator)} available)")
+
+        cached = self._get((input_key, 'series'))
+        if cached is not None:
+            expires, series = cached
+        else:
+            response = fetch()
+            if 'error' in response:
+                return response
+            values, labels = build_series(response.get('data') or [], years)
+            series = (values, labels, response)
+            expires = None
+            if not served_stale():
+                expires = self._put((input_key, 'series'), series, fresh_until())
+        values, labels, response = series
+
+        options_key = (input_key, window, base_year)
+        cached = self._get(options_key)
+        if cached is not None:
+            result = cached[1]
+        else:
+            stats = compute_trends(values, years, window=window, base_year=base_year,
+                                   deflator=self.deflator)
+            result = trends_response(values, labels, years, stats, window, self.deflator_name)
+            if expires is not None:
+                # Never outlives the series it was computed from
+                self._put(options_key, result, expires)
+        if include_rows:
+            return dict(response, analytics=result)
+        return result